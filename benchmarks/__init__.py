@@ -0,0 +1,2 @@
+"""Benchmarks for the endpoints that participants and experimenters use most.
+"""
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""Time the endpoints that participants and experimenters use most, and count
+the SQL statements each one runs.
+
+An experiment is generated with the factories in ``tests/factories.py``, and
+each endpoint is requested through the Flask test client a number of times.
+The results are written as JSON, so that runs on different commits can be
+compared:
+
+    python -m benchmarks.run_benchmarks --participants 500 --output before.json
+
+By default the benchmarks run against a temporary SQLite database. To run them
+against MySQL, pass a database URI with ``--database``. Every table in that
+database is dropped, so never point it at a database you care about.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import click
+import openpyxl
+
+from quizApp import create_app, db, models
+from scripts.clear_db import clear_db
+from tests.factories import ChoiceFactory, GraphFactory, ParticipantFactory, \
+    create_experiment, create_result
+from tests.helpers import count_queries, download_job_output, get_job
+
+EXPERIMENTER_EMAIL = "experimenter"
+PARTICIPANT_EMAIL = "participant"
+
+
+def create_users():
+    """Create an experimenter and a participant to log in as. Their
+    passwords are the same as their emails.
+    """
+    experimenter = models.User(
+        email=EXPERIMENTER_EMAIL, password=EXPERIMENTER_EMAIL, active=True,
+        roles=[models.Role(name="experimenter")])
+    participant = models.Participant(
+        email=PARTICIPANT_EMAIL, password=PARTICIPANT_EMAIL, active=True,
+        roles=[models.Role(name="participant")])
+    db.session.add_all([experimenter, participant])
+    return participant
+
+
+def create_benchmark_experiment(num_participants, num_activities,
+                                num_choices):
+    """Create an experiment in which every participant but the first has
+    answered every activity and finalized their assignment set. The first
+    assignment set is given to the participant the benchmarks log in as.
+
+    Returns the experiment and the participant's assignment set.
+    """
+    experiment = create_experiment(num_activities, num_participants,
+                                   ["question_mc_singleselect"])
+    experiment.start = datetime.now() - timedelta(days=1)
+    experiment.stop = datetime.now() + timedelta(days=1)
+
+    for assignment_set in experiment.assignment_sets:
+        for assignment in assignment_set.assignments:
+            activity = assignment.activity
+            activity.choices = [ChoiceFactory() for _ in range(num_choices)]
+
+            # The factories fill datasets with plain MediaItems, which
+            # databases that enforce NOT NULL, such as SQLite, refuse
+            for dataset in activity.datasets:
+                dataset.media_items = [GraphFactory() for _ in
+                                       dataset.media_items]
+
+    own_set = experiment.assignment_sets[0]
+    own_set.participant = create_users()
+    own_set.complete = False
+    own_set.progress = 0
+
+    for assignment_set in experiment.assignment_sets[1:]:
+        assignment_set.participant = ParticipantFactory()
+        assignment_set.complete = True
+        assignment_set.progress = len(assignment_set.assignments)
+
+        for assignment in assignment_set.assignments:
+            assignment.result = create_result(assignment.activity)
+
+    db.session.add(experiment)
+    db.session.flush()
+    models.ExperimentStats.rebuild(experiment)
+    db.session.commit()
+
+    return experiment, own_set
+
+
+def generate_data(num_participants, num_activities, num_choices):
+    """Empty the database and generate the benchmark experiment in it.
+
+    Returns a dictionary describing the generated data, for the benchmarks to
+    use.
+    """
+    clear_db()
+    experiment, assignment_set = create_benchmark_experiment(
+        num_participants, num_activities, num_choices)
+    assignment = assignment_set.assignments[0]
+
+    return {
+        "size": (num_participants, num_activities, num_choices),
+        "experiment_id": experiment.id,
+        "assignment_set_id": assignment_set.id,
+        "assignment_id": assignment.id,
+        "choice_id": assignment.activity.choices[0].id,
+    }
+
+
+def log_in(client, email):
+    """Log in as the user with the given email.
+    """
+    client.get("/logout")
+    response = client.post("/login", data={"email": email,
+                                           "password": email})
+    assert response.status_code == 302, "Could not log in as " + email
+
+
+def get_assignment_url(context):
+    """Return the URL of the participant's first assignment.
+    """
+    return "/experiments/{}/assignment_sets/{}/assignments/{}".format(
+        context["experiment_id"], context["assignment_set_id"],
+        context["assignment_id"])
+
+
+def read_assignment(client, context):
+    """Show the participant their first assignment.
+    """
+    log_in(client, PARTICIPANT_EMAIL)
+    return lambda: client.get(get_assignment_url(context))
+
+
+def update_assignment(client, context):
+    """Submit an answer to the participant's first assignment.
+    """
+    log_in(client, PARTICIPANT_EMAIL)
+    render_time = datetime.now()
+    data = {"choices": context["choice_id"],
+            "render_time": render_time.isoformat(),
+            "submit_time": (render_time + timedelta(seconds=5)).isoformat()}
+    return lambda: client.patch(get_assignment_url(context), data=data)
+
+
+def results_experiment(client, context):
+    """Show the experimenter the results page of the experiment.
+    """
+    log_in(client, EXPERIMENTER_EMAIL)
+    url = "/experiments/{}/results".format(context["experiment_id"])
+    return lambda: client.get(url)
+
+
+def export_results_experiment(client, context):
+    """Export the results of the experiment and download them.
+    """
+    log_in(client, EXPERIMENTER_EMAIL)
+    url = "/experiments/{}/results/export".format(context["experiment_id"])
+    return lambda: download_job_output(client, client.get(url))
+
+
+def export_data(client, _):
+    """Export the database and download the workbook.
+    """
+    log_in(client, EXPERIMENTER_EMAIL)
+    return lambda: download_job_output(client, client.get("/data/export"))
+
+
+def remove_participants(workbook_data):
+    """Given the data of an exported workbook, return it with the
+    participants of the assignment sets removed.
+
+    A participant can only have one assignment set in an experiment, so the
+    imported copy of the experiment can't reuse them.
+    """
+    workbook = openpyxl.load_workbook(io.BytesIO(workbook_data))
+    sheet = workbook.get_sheet_by_name("Assignment Sets")
+    rows = list(sheet.rows)
+    column = [cell.value for cell in rows[0]].index(
+        "assignment_set:participant")
+
+    for row in rows[1:]:
+        row[column].value = None
+
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def import_data(client, context):
+    """Export the database, then import the exported workbook.
+
+    Every run adds another copy of the exported objects to the database, so
+    the data is generated again before each run, and every run imports into
+    the same database. This also replaces whatever the other benchmarks
+    changed, so this benchmark is run last.
+    """
+    # Export the data as it is after each reset, without the changes made by
+    # the other benchmarks
+    generate_data(*context["size"])
+    workbook = remove_participants(export_data(client, context)().data)
+
+    def request():
+        """Import the exported workbook, checking that the import job
+        succeeded.
+        """
+        response = client.post(
+            "/data/import",
+            data={"data": (io.BytesIO(workbook), "export.xlsx")})
+        job = get_job(response)
+        assert job.status == "finished", job.traceback
+        return response
+
+    return request, lambda: generate_data(*context["size"])
+
+
+BENCHMARKS = OrderedDict([
+    ("read_assignment", read_assignment),
+    ("update_assignment", update_assignment),
+    ("results_experiment", results_experiment),
+    ("export_results_experiment", export_results_experiment),
+    ("export_data", export_data),
+    ("import_data", import_data),
+])
+"""OrderedDict: Maps the name of each benchmark to a function that, given a
+test client and a dictionary describing the generated data, does any setup
+and returns a function that makes one request. Benchmarks whose requests
+change the data return a pair of that function and one that resets the
+data, which is called before each run.
+"""
+
+
+def run_benchmark(app, request, num_runs, reset=None):
+    """Make the request num_runs times and return a list of dictionaries
+    describing each run.
+
+    Each run is given its own app context, and so its own database session,
+    as a real request would be. If reset is given, it is called before each
+    run, and is not timed.
+    """
+    runs = []
+
+    for _ in range(num_runs):
+        if reset:
+            with app.app_context():
+                reset()
+
+        with app.app_context():
+            with count_queries() as statements:
+                start = time.time()
+                response = request()
+                seconds = time.time() - start
+
+        runs.append({
+            "seconds": seconds,
+            "queries": len(statements),
+            "status_code": response.status_code,
+        })
+
+    return runs
+
+
+def summarize(runs):
+    """Return the fastest, median and mean time and query count of runs.
+    """
+    seconds = sorted(run["seconds"] for run in runs)
+    queries = sorted(run["queries"] for run in runs)
+
+    return {
+        "min_seconds": seconds[0],
+        "median_seconds": seconds[len(seconds) // 2],
+        "mean_seconds": sum(seconds) / len(seconds),
+        "min_queries": queries[0],
+        "max_queries": queries[-1],
+    }
+
+
+def run_benchmarks(app, context, num_runs, only=None):
+    """Run every benchmark, or only those named in only, num_runs times.
+
+    Returns an OrderedDict mapping the name of each benchmark to a summary
+    of its runs and the runs themselves.
+    """
+    results = OrderedDict()
+    client = app.test_client()
+
+    for name, benchmark in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+
+        click.echo("Running {}".format(name), err=True)
+        with app.app_context():
+            request = benchmark(client, context)
+
+        reset = None
+        if isinstance(request, tuple):
+            request, reset = request
+
+        runs = run_benchmark(app, request, num_runs, reset)
+        results[name] = {
+            "summary": summarize(runs),
+            "runs": runs,
+        }
+
+    return results
+
+
+def get_commit():
+    """Return the git commit being benchmarked, or None if it can't be found.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"]).\
+            decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option("--database",
+              help="URI of the database to use. All of its tables are "
+              "dropped. Defaults to a temporary SQLite database.")
+@click.option("--participants", type=int, default=100,
+              help="Number of assignment sets in the experiment")
+@click.option("--activities", type=int, default=10,
+              help="Number of assignments in each assignment set")
+@click.option("--choices", type=int, default=4,
+              help="Number of choices in each question")
+@click.option("--runs", type=int, default=5,
+              help="Number of times to run each benchmark")
+@click.option("--only", multiple=True, type=click.Choice(list(BENCHMARKS)),
+              help="Only run this benchmark. May be given more than once.")
+@click.option("--output", type=click.File("w"), default="-",
+              help="File to write the JSON results to")
+def main(output, only, runs, choices, activities, participants, database):
+    """Generate an experiment, run the benchmarks, and write the results.
+    """
+    database_file = None
+    if not database:
+        handle, database_file = tempfile.mkstemp(".db")
+        os.close(handle)
+        database = "sqlite:///" + database_file
+
+    app = create_app("testing", overrides={
+        "SQLALCHEMY_DATABASE_URI": database,
+        "METRICS_ENABLED": False,
+    })
+
+    with app.app_context():
+        context = generate_data(participants, activities, choices)
+
+    results = OrderedDict([
+        ("commit", get_commit()),
+        ("date", datetime.now().isoformat()),
+        ("database", app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0]),
+        ("participants", participants),
+        ("activities", activities),
+        ("choices", choices),
+        ("benchmarks", run_benchmarks(app, context, runs, only)),
+    ])
+
+    if database_file:
+        os.remove(database_file)
+
+    output.write(json.dumps(results, indent=2))
+    output.write("\n")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
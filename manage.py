@@ -15,9 +15,10 @@ import sqlalchemy_utils
 
 from quizApp import create_app
 from quizApp import db
+from quizApp import job_queue
 from quizApp import models
 from quizApp import security
-from scripts import populate_db, post_hits
+from scripts import loadtest, populate_db, post_hits
 
 
 @click.pass_context
@@ -179,6 +180,137 @@ def delete_user(email):
     print("User deleted successfully. ID was: {}".format(user_id))
 
 
+@cli.command("provision-participants")
+@click.option("--count", type=int, required=True,
+              help="Number of participants to create")
+@click.option("--batch-size", type=int, default=500,
+              help="Number of participants to insert with each statement")
+def provision_participants(batch_size, count):
+    """Create participants ahead of time, so that participants who register
+    through mturk or auto_register only need to claim one.
+
+    Provisioned participants can't log in with a password.
+    """
+    models.Participant.provision(count, batch_size)
+    num_available = models.Participant.query.\
+        filter_by(provisioned=True).count()
+
+    print("Provisioned {} participants. {} are available.".format(
+        count, num_available))
+
+
+@cli.command("repair-scores")
+@click.option("--experiment-id", type=int,
+              help="Only repair assignment sets in this experiment")
+def repair_scores(experiment_id):
+    """Recompute the running score of every assignment set.
+    """
+    query = models.AssignmentSet.query
+
+    if experiment_id:
+        query = query.filter_by(experiment_id=experiment_id)
+
+    num_repaired = 0
+    for assignment_set in query:
+        assignment_set.recompute_score()
+        num_repaired += 1
+
+    db.session.commit()
+
+    print("Repaired {} assignment sets.".format(num_repaired))
+
+
+@cli.command("rebuild-stats")
+@click.option("--experiment-id", type=int,
+              help="Only rebuild statistics for this experiment")
+def rebuild_stats(experiment_id):
+    """Recompute the statistics of every experiment from scratch.
+    """
+    query = models.Experiment.query
+
+    if experiment_id:
+        query = query.filter_by(id=experiment_id)
+
+    num_rebuilt = 0
+    for experiment in query.all():
+        models.ExperimentStats.rebuild(experiment)
+        num_rebuilt += 1
+
+    db.session.commit()
+
+    print("Rebuilt statistics for {} experiments.".format(num_rebuilt))
+
+
+@cli.command("delete-expired-jobs")
+def delete_expired_jobs():
+    """Delete jobs that finished more than JOB_EXPIRY_SECONDS ago, and their
+    output files.
+    """
+    num_deleted = job_queue.delete_expired_jobs()
+
+    print("Deleted {} expired jobs.".format(num_deleted))
+
+
+@cli.command("shuffle-pool")
+@click.option("--experiment-id", type=int, required=True,
+              help="ID of the experiment whose pool to shuffle")
+@click.option("--seed", type=int,
+              help="Seed to shuffle with, for a reproducible order")
+def shuffle_pool(seed, experiment_id):
+    """Shuffle the unqueued assignment sets of an experiment into its claim
+    queue.
+    """
+    experiment = models.Experiment.query.get(experiment_id)
+
+    if not experiment:
+        raise click.BadParameter(
+            "No experiment with ID {}".format(experiment_id),
+            param_hint="--experiment-id")
+
+    num_queued = experiment.shuffle_claim_queue(seed)
+    db.session.commit()
+
+    print("Queued {} assignment sets with seed {}.".format(
+        num_queued, experiment.claim_seed))
+
+
+@cli.command("loadtest")
+@click.option("--experiment-id", type=int, required=True,
+              help="ID of the experiment the participants should take")
+@click.option("--participants", type=int, default=100,
+              help="Number of participants to simulate")
+@click.option("--concurrency", type=int, default=10,
+              help="Number of participants taking the experiment at once")
+@click.option("--mturk", is_flag=True,
+              help=("Register through the mturk registration endpoint "
+                    "rather than auto_register"))
+@click.option("--url",
+              help=("URL of a running QuizApp instance to test. By default, "
+                    "the app is served locally for the test"))
+@click.pass_context
+def run_loadtest(ctx, url, mturk, concurrency, participants, experiment_id):
+    """Simulate participants taking an experiment at the same time and
+    report throughput, latency, and error rates.
+
+    Every simulated participant claims an assignment set, so make sure the
+    experiment has enough of them.
+    """
+    server = None
+    if not url:
+        app = create_app(ctx.find_root().params["config"])
+        server = loadtest.serve(app)
+        url = "http://127.0.0.1:{}".format(server.server_port)
+
+    try:
+        results = loadtest.run_loadtest(url, experiment_id, participants,
+                                        concurrency, mturk)
+    finally:
+        if server:
+            server.shutdown()
+
+    print(loadtest.format_summary(results.summarize()))
+
+
 @cli.command("populate-db")
 def run_populate_db():
     """Run the populate_db.py script.
@@ -11,6 +11,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CsrfProtect
 
 from quizApp import config
+from quizApp.cache import fragment_cache
 
 
 db = SQLAlchemy()
@@ -19,6 +20,12 @@ security = Security()
 migrate = Migrate()
 mail = Mail()
 
+# The job queue and metrics use the models, which need db to be defined first
+# pylint: disable=wrong-import-position
+from quizApp.jobs import job_queue  # noqa: E402
+from quizApp.metrics import metrics  # noqa: E402
+# pylint: enable=wrong-import-position
+
 
 def create_app(config_name, overrides=None):
     """Create and return an instance of this application.
@@ -45,11 +52,16 @@ def create_app(config_name, overrides=None):
 
     migrate.init_app(app, db)
 
+    job_queue.init_app(app)
+    metrics.init_app(app)
+    fragment_cache.init_app(app)
+
     from quizApp.views.activities import activities
     from quizApp.views.core import core
     from quizApp.views.datasets import datasets
     from quizApp.views.experiments import experiments
     from quizApp.views.data import data
+    from quizApp.views.jobs import jobs
     from quizApp.views.mturk import mturk
     from quizApp.filters import filters
 
@@ -58,6 +70,7 @@ def create_app(config_name, overrides=None):
     app.register_blueprint(core)
     app.register_blueprint(datasets)
     app.register_blueprint(experiments)
+    app.register_blueprint(jobs)
     app.register_blueprint(mturk)
     app.register_blueprint(filters)
 
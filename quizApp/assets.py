@@ -0,0 +1,111 @@
+"""Prepare uploaded images so that they can be served quickly.
+
+When a graph is uploaded, it is resized and recompressed into several
+variants:
+
+``full``
+    The image at its original size.
+``display``
+    The image shrunk to fit within ``GRAPH_DISPLAY_SIZE``, which is what
+    participants see.
+``thumbnail``
+    The image shrunk to fit within ``GRAPH_THUMBNAIL_SIZE``, for listings.
+
+Each variant is stored under a filename made from a hash of its contents.
+Since a file never changes once it is written, its URL can be cached by
+clients forever, and the URL of a graph can be found from the database alone,
+without checking the filesystem.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import current_app
+from PIL import Image
+
+CACHE_SECONDS = 365 * 24 * 60 * 60
+"""int: How long clients may cache a variant for.
+"""
+
+
+def get_variant_sizes():
+    """Return an OrderedDict mapping the name of each variant to the size it
+    must fit within, or None if it is not resized.
+    """
+    return OrderedDict([
+        ("full", None),
+        ("display", current_app.config["GRAPH_DISPLAY_SIZE"]),
+        ("thumbnail", current_app.config["GRAPH_THUMBNAIL_SIZE"]),
+    ])
+
+
+def encode_image(image, image_format):
+    """Compress image in the given format, which is either JPEG or PNG, and
+    return the bytes.
+    """
+    output = io.BytesIO()
+
+    if image_format == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(output, "JPEG", quality=85, optimize=True,
+                   progressive=True)
+    else:
+        if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.save(output, "PNG", optimize=True)
+
+    return output.getvalue()
+
+
+def write_file(path, data):
+    """Write data to path, making sure that nobody sees a partly written file.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+
+    with os.fdopen(handle, "wb") as temp_file:
+        temp_file.write(data)
+
+    # mkstemp makes files only readable by their owner, but these may be
+    # served by the web server directly
+    os.chmod(temp_path, 0o644)
+    os.rename(temp_path, path)
+
+
+def save_image_variants(stream, directory):
+    """Read an image from stream, save each of its variants in directory, and
+    return an OrderedDict mapping the name of each variant to its path.
+
+    Photographs uploaded as JPEGs are kept as JPEGs, anything else is stored
+    as a PNG, which suits graphs. Variants that already exist are not written
+    again.
+
+    Raises IOError if stream does not contain an image Pillow can read.
+    """
+    image = Image.open(stream)
+    image.load()
+    image_format = "JPEG" if image.format == "JPEG" else "PNG"
+    extension = ".jpg" if image_format == "JPEG" else ".png"
+    paths = OrderedDict()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for variant, size in get_variant_sizes().items():
+        variant_image = image.copy()
+        if size:
+            variant_image.thumbnail(size, Image.ANTIALIAS)
+
+        data = encode_image(variant_image, image_format)
+        filename = hashlib.sha1(data).hexdigest() + extension
+        path = os.path.join(directory, filename)
+
+        if not os.path.isfile(path):
+            write_file(path, data)
+
+        paths[variant] = path
+
+    return paths
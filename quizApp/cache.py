@@ -0,0 +1,159 @@
+"""Cache fragments of HTML that are expensive to render but rarely change.
+
+Fragments are stored in a backend chosen by the ``FRAGMENT_CACHE_TYPE`` config
+option:
+
+``lru``
+    An in-process cache holding the ``FRAGMENT_CACHE_SIZE`` most recently used
+    fragments. Each process has its own copy. This is the default.
+``memcached`` or ``redis``
+    A cache server running at the first of ``FRAGMENT_CACHE_SERVERS``, given
+    as ``host:port``, which is shared by every process. Fragments expire after
+    ``FRAGMENT_CACHE_TIMEOUT`` seconds. Their clients are not in
+    ``requirements.txt`` and have to be installed separately: ``pylibmc`` or
+    ``python-memcached`` for ``memcached``, and ``redis`` for ``redis``.
+``null``
+    Nothing is cached.
+
+Keys should include a version of whatever the fragment was rendered from, so
+that a fragment never needs to be invalidated: when the object changes, its
+version changes, and the old fragment is no longer looked up. It is eventually
+evicted instead.
+"""
+from __future__ import unicode_literals
+from builtins import object
+from collections import OrderedDict
+import threading
+
+from flask import current_app
+from werkzeug.contrib.cache import MemcachedCache, NullCache, RedisCache
+
+
+class LRUCache(object):
+    """An in-process cache that holds up to max_size values, discarding the
+    least recently used value when it is full. Safe to use from several
+    threads.
+
+    Attributes:
+        hits (int): How many times ``get`` found a value
+        misses (int): How many times ``get`` did not find a value
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the value stored under key, or None if there isn't one.
+        """
+        with self.lock:
+            try:
+                value = self.values.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # Move the value to the most recently used end
+            self.values[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key.
+        """
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value
+
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+    def delete(self, key):
+        """Remove the value stored under key, if there is one.
+        """
+        with self.lock:
+            self.values.pop(key, None)
+
+    def clear(self):
+        """Remove every value.
+        """
+        with self.lock:
+            self.values.clear()
+
+
+class FragmentCache(object):
+    """Stores rendered fragments in the backend configured for each app.
+
+    Attributes:
+        key_prefix (str): Prepended to keys in shared backends, so that they
+            can be used by other applications too
+    """
+
+    def __init__(self, app=None, key_prefix="quizapp:"):
+        self.key_prefix = key_prefix
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the backend given by ``FRAGMENT_CACHE_TYPE`` for this app.
+        """
+        cache_type = app.config["FRAGMENT_CACHE_TYPE"]
+        timeout = app.config["FRAGMENT_CACHE_TIMEOUT"]
+
+        if cache_type == "lru":
+            backend = LRUCache(app.config["FRAGMENT_CACHE_SIZE"])
+        elif cache_type == "memcached":
+            try:
+                backend = MemcachedCache(
+                    app.config["FRAGMENT_CACHE_SERVERS"],
+                    default_timeout=timeout, key_prefix=self.key_prefix)
+            except RuntimeError:
+                raise RuntimeError("FRAGMENT_CACHE_TYPE is memcached, but no "
+                                   "memcached client is installed. Install "
+                                   "pylibmc or python-memcached.")
+        elif cache_type == "redis":
+            host, port = app.config["FRAGMENT_CACHE_SERVERS"][0].split(":")
+            try:
+                backend = RedisCache(host, int(port), default_timeout=timeout,
+                                     key_prefix=self.key_prefix)
+            except RuntimeError:
+                raise RuntimeError("FRAGMENT_CACHE_TYPE is redis, but the "
+                                   "redis client is not installed. Install "
+                                   "redis.")
+        elif cache_type == "null":
+            backend = NullCache()
+        else:
+            raise ValueError("Unknown FRAGMENT_CACHE_TYPE: {}".
+                             format(cache_type))
+
+        app.extensions["fragment_cache"] = backend
+
+    @property
+    def backend(self):
+        """The backend of the current app.
+        """
+        return current_app.extensions["fragment_cache"]
+
+    def get_or_render(self, key, render):
+        """Return the fragment stored under key. If there isn't one, call
+        render to render it, and store the result.
+        """
+        fragment = self.backend.get(key)
+
+        if fragment is None:
+            fragment = render()
+            self.backend.set(key, fragment)
+
+        return fragment
+
+    def clear(self):
+        """Remove every fragment of the current app.
+        """
+        self.backend.clear()
+
+
+fragment_cache = FragmentCache()
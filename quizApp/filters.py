@@ -4,8 +4,15 @@ import os
 
 from flask import Blueprint, current_app, url_for, request
 
+from quizApp.cache import LRUCache
+
 filters = Blueprint("filters", __name__)
 
+graph_url_cache = LRUCache(10000)
+"""LRUCache: URLs of graphs whose files were found, keyed by the graph's ID,
+path and version, so that their files are only checked once per process.
+"""
+
 
 @filters.app_template_filter("is_nav_child")
 def is_nav_child(child, parent):
@@ -29,21 +36,60 @@ def datetime_format_filter(value, fmt="%Y-%m-%d %H:%M:%S"):
 
 
 @filters.app_template_filter("get_graph_url")
-def get_graph_url_filter(graph):
-    """Given a ``Graph``, return html to display it.
+def get_graph_url_filter(graph, variant="display"):
+    """Given a ``Graph``, return the URL of the given variant of it, which is
+    one of ``full``, ``display`` or ``thumbnail``.
+
+    Graphs uploaded through the asset pipeline have content-hashed variants,
+    whose URLs never change, so no files need to be checked. Other graphs
+    only have their original file in the graph directory, which is served by
+    ``datasets.read_media_item_file`` for every variant, or a placeholder if
+    the file is missing. Their URL includes the graph's version, so that
+    clients can cache the file, for instance when it is prefetched, until the
+    graph changes. Once their file has been found, their URL is kept in
+    ``graph_url_cache``.
     """
-    if os.path.isfile(graph.path):
-        filename = graph.filename()
-    else:
-        filename = current_app.config.get("EXPERIMENTS_PLACEHOLDER_GRAPH")
-
-    graph_path = url_for('static',
-                         filename=os.path.join(
-                             current_app.config.get("GRAPH_DIRECTORY"),
-                             filename))
+    if graph.display_path:
+        if variant == "full":
+            path = graph.path
+        else:
+            path = getattr(graph, variant + "_path")
+
+        return url_for("datasets.read_graph_file",
+                       filename=os.path.basename(path))
+
+    key = (graph.id, graph.path, graph.version)
+    graph_path = graph_url_cache.get(key)
+
+    if graph_path:
+        return graph_path
+
+    graph_file = os.path.join(current_app.static_folder,
+                              current_app.config["GRAPH_DIRECTORY"],
+                              graph.filename())
+
+    if not os.path.isfile(graph_file):
+        # Missing files are checked again every time, in case they are
+        # copied into place later
+        return url_for('static',
+                       filename=os.path.join(
+                           current_app.config.get("GRAPH_DIRECTORY"),
+                           current_app.config.get(
+                               "EXPERIMENTS_PLACEHOLDER_GRAPH")))
+
+    graph_path = url_for("datasets.read_media_item_file",
+                         media_item_id=graph.id, v=graph.version or 0)
+    graph_url_cache.set(key, graph_path)
     return graph_path
 
 
+def invalidate_graph_url(graph):
+    """Forget the cached URL of this graph, because its file has been replaced
+    or deleted.
+    """
+    graph_url_cache.delete((graph.id, graph.path, graph.version))
+
+
 @filters.app_template_filter("prev_next_tabs")
 def prev_next_tabs(tablist):
     """Given a list of tabs, return the previous and next tab.
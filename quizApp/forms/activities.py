@@ -17,6 +17,7 @@ class ActivityForm(OrderFormMixin, ModelForm):
         """Specify model and field order.
         """
         model = Activity
+        exclude = ['version']
         order = ('question', '*', 'needs_comment', 'include_in_scorecards',
                  'scorecard_settings', 'submit')
 
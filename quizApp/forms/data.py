@@ -6,9 +6,10 @@ from wtforms.validators import DataRequired
 
 
 class ImportDataForm(Form):
-    """Provide a FileField for an xlsx upload.
+    """Provide a FileField for an xlsx upload, or a zip file containing one
+    CSV file per sheet.
     """
 
     data = FileField("Import data", validators=[DataRequired()],
-                     render_kw={"accept": ".xlsx"})
+                     render_kw={"accept": ".xlsx,.zip"})
     submit = SubmitField("Submit")
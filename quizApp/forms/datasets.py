@@ -1,38 +1,52 @@
 """Forms for dataset views.
 """
 
-import os
+from PIL import Image
 from wtforms import SubmitField, FileField
+from wtforms.validators import StopValidation
 from wtforms_alchemy import ModelForm
 
-from quizApp import db
+from quizApp.assets import save_image_variants
+from quizApp.filters import invalidate_graph_url
 from quizApp.forms.common import OrderFormMixin
 from quizApp.models import Graph, Dataset, Text
 
 
 class UploadedFileField(FileField):
-    """This behaves just like FileField, however when ``populate_obj`` is
-    called it will overwrite the file pointed to by ``obj.name`` with the
-    uploaded file.
-
-    ``obj.directory`` must return the directory where the file is to be saved,
-    if ``getattr(obj, name)`` does not exist.
+    """This behaves just like FileField, but only accepts images. When
+    ``populate_obj`` is called, the uploaded image is resized and recompressed
+    into variants which are stored under content-hash filenames, see
+    ``quizApp.assets``.
+
+    ``obj.directory`` must return the directory where the variants are to be
+    saved. ``getattr(obj, name)`` is set to the path of the full size variant,
+    and the other variants are stored in attributes named after them, e.g.
+    ``display_path`` and ``thumbnail_path`` if ``name`` is ``path``. Previous
+    variants are left in place, since clients may have cached their URLs.
     """
+    def pre_validate(self, form):
+        if not self.data:
+            return
+
+        try:
+            Image.open(self.data.stream).verify()
+        except Exception:
+            # Pillow raises all sorts of exceptions for broken files
+            raise StopValidation("The uploaded file is not a valid image.")
+        finally:
+            self.data.stream.seek(0)
+
     def populate_obj(self, obj, name):
         if not self.data:
             return
 
-        path = getattr(obj, name)
-        # Replace the current graph with this
+        paths = save_image_variants(self.data.stream, obj.directory)
 
-        if not os.path.isfile(path):
-            # Need to create a new file
-            file_name = str(obj.id) +\
-                os.path.splitext(self.data.filename)[1]
-            path = os.path.join(obj.directory, file_name)
-            setattr(obj, name, path)
-            db.session.commit()
-        self.data.save(path)
+        for variant, path in paths.items():
+            if variant == "full":
+                setattr(obj, name, path)
+            else:
+                setattr(obj, "{}_{}".format(variant, name), path)
 
 
 class DatasetForm(OrderFormMixin, ModelForm):
@@ -54,12 +68,21 @@ class GraphForm(OrderFormMixin, ModelForm):
         """Specify model and field order.
         """
         model = Graph
-        exclude = ['path']
+        exclude = ['path', 'display_path', 'thumbnail_path', 'version']
         order = ('*', 'submit')
 
     path = UploadedFileField("Replace graph", render_kw={"accept": "image/*"})
     submit = SubmitField("Save")
 
+    def populate_obj(self, obj):
+        """If a new file was uploaded, forget the graph's cached URL before
+        the file is replaced.
+        """
+        if self.path.data:
+            invalidate_graph_url(obj)
+
+        super(GraphForm, self).populate_obj(obj)
+
 
 class TextForm(OrderFormMixin, ModelForm):
     """Form for updating Text objects.
@@ -68,6 +91,7 @@ class TextForm(OrderFormMixin, ModelForm):
         """Specify model and field order.
         """
         model = Text
+        exclude = ['version']
         order = ('*', 'submit')
 
     submit = SubmitField("Save")
@@ -204,7 +204,7 @@ class CreateExperimentForm(OrderFormMixin, ModelForm):
         """Specify model and field order.
         """
         model = Experiment
-        exclude = ['created']
+        exclude = ['created', 'claim_seed', 'claim_cursor', 'version']
         order = ('*', 'scorecard_settings', 'submit')
 
     scorecard_settings = ModelFormField(ScorecardSettingsForm)
@@ -0,0 +1,506 @@
+"""Functions for importing the rows of spreadsheets into the database.
+
+Rows are inserted in bulk rather than by instantiating models, so anything a
+model sets up in its constructor is done by its prepare_import_mappings method
+instead, and the checks its validators make are run by validate_import once
+every sheet has been imported.
+"""
+from collections import OrderedDict, defaultdict
+import csv
+import io
+import itertools
+import zipfile
+
+from future.utils import PY2
+import openpyxl
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOMANY
+from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
+
+from quizApp import db
+from quizApp import models
+
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def parse_ids(value):
+    """Given the contents of a relationship cell, return a list of the integer
+    ids in it.
+    """
+    # goddamn stupid excel
+    return [int(float(fk)) for fk in str(value).split(",")]
+
+
+def get_row_mapper(model, row):
+    """Return the mapper of the model that a row represents, correctly handling
+    polymorphism.
+
+    Since the actual object represented by a row may be different from another
+    in the same sheet, we need to take into account any possible polymorphisms.
+
+    This method looks at the model to see if it has polymorphic identities. If
+    so, it returns the mapper of the correct one. If not, it returns the mapper
+    of the passed in model.
+
+    Arguments:
+        model - The model of the sheet the row is in.
+        row - A dictionary mapping field names to values.
+    """
+    model_mapper = inspect(model)
+    if not model_mapper.polymorphic_identity:
+        return model_mapper
+
+    polymorphic_type = row[model_mapper.polymorphic_on.name]
+    return model_mapper.polymorphic_map[polymorphic_type]
+
+
+def parse_row(model, headers, row):
+    """Split a row from an imported spreadsheet into its column values, its
+    relationships, and its PK.
+
+    The PK is not inserted into the database. To avoid conflicts between
+    imported PK and existing PK, we do not assign PK's based on user input.
+    However we have to store them because other rows in the user input may be
+    referencing a certain PK.
+
+    Returns None if the row is empty. Otherwise returns a dictionary with:
+        mapper - The mapper of the model this row represents.
+        values - A dictionary of column values, suitable for
+        bulk_insert_mappings.
+        relationships - A list of (property, ids) tuples, where ids are the
+        values of a relationship column as they appear in the spreadsheet.
+        pk - The PK of this row as it appears in the spreadsheet, or None.
+    """
+    cells = {}
+    for header, value in zip(headers, row):
+        if not value or header is None:
+            continue
+        cells[header] = value
+
+    if not cells:
+        return None
+
+    row_mapper = get_row_mapper(model, cells)
+    parsed_row = {"mapper": row_mapper, "values": {}, "relationships": [],
+                  "pk": None}
+
+    for field_name, value in cells.items():
+        prop = row_mapper.attrs[field_name]
+
+        if isinstance(prop, RelationshipProperty):
+            parsed_row["relationships"].append((prop, parse_ids(value)))
+        elif isinstance(prop, ColumnProperty) and \
+                prop.columns[0].primary_key:
+            parsed_row["pk"] = int(float(value))
+        elif isinstance(prop, ColumnProperty):
+            parsed_row["values"][field_name] = value
+
+    if row_mapper.polymorphic_on is not None:
+        polymorphic_key = row_mapper.get_property_by_column(
+            row_mapper.polymorphic_on).key
+        parsed_row["values"][polymorphic_key] = \
+            row_mapper.polymorphic_identity
+
+    if not parsed_row["values"] and not parsed_row["relationships"]:
+        return None
+
+    return parsed_row
+
+
+def resolve_ids(mapper, obj_ids, pk_mapping):
+    """Given a mapper and a collection of ids as they appear in the
+    spreadsheet, return a dictionary mapping each of them to the id of the
+    object in the database.
+
+    Objects created in this import session are looked up in pk_mapping. The
+    rest are checked against the database using one IN query per
+    IMPORT_BATCH_SIZE ids.
+    """
+    table_mapping = pk_mapping[mapper.local_table.name]
+    resolved = {}
+    missing = []
+
+    for obj_id in set(obj_ids):
+        if obj_id in table_mapping:
+            resolved[obj_id] = table_mapping[obj_id]
+        else:
+            missing.append(obj_id)
+
+    pk = mapper.primary_key[0]
+    for index in range(0, len(missing), IMPORT_BATCH_SIZE):
+        batch = missing[index:index + IMPORT_BATCH_SIZE]
+        for (obj_id,) in db.session.query(pk).filter(pk.in_(batch)):
+            resolved[obj_id] = obj_id
+
+    for obj_id in missing:
+        if obj_id not in resolved:
+            raise ValueError("No such object {} with ID {}".
+                             format(mapper.class_, obj_id))
+
+    return resolved
+
+
+def resolve_relationships(parsed_rows, pk_mapping):
+    """Replace the spreadsheet ids in the relationships of every row with
+    database ids, querying the database once per related table.
+
+    Many to one relationships are turned into foreign key values on the row.
+    """
+    referenced_ids = defaultdict(set)
+    for parsed_row in parsed_rows:
+        for prop, ids in parsed_row["relationships"]:
+            referenced_ids[prop.mapper.base_mapper].update(ids)
+
+    resolved = {mapper: resolve_ids(mapper, ids, pk_mapping)
+                for mapper, ids in referenced_ids.items()}
+
+    for parsed_row in parsed_rows:
+        relationships = []
+        for prop, ids in parsed_row["relationships"]:
+            ids = [resolved[prop.mapper.base_mapper][i] for i in ids]
+
+            if prop.direction in (MANYTOMANY, ONETOMANY):
+                relationships.append((prop, ids))
+            else:
+                local_column = prop.local_remote_pairs[0][0]
+                key = prop.parent.get_property_by_column(local_column).key
+                parsed_row["values"][key] = ids[0]
+        parsed_row["relationships"] = relationships
+
+
+def insert_rows(model, parsed_rows):
+    """Insert the column values of every row into the database, grouped by
+    polymorphic identity.
+
+    If the ids of the new objects are needed, either because other rows may
+    refer to them or because they have collections to link, they are stored
+    in the values of each row, as described in ``models.insert_mappings``.
+    """
+    rows_by_mapper = OrderedDict()
+    for parsed_row in parsed_rows:
+        rows_by_mapper.setdefault(parsed_row["mapper"], []).append(parsed_row)
+
+    for mapper, mapper_rows in rows_by_mapper.items():
+        mappings = [r["values"] for r in mapper_rows]
+        return_defaults = any(r["pk"] is not None or r["relationships"]
+                              for r in mapper_rows)
+
+        model.prepare_import_mappings(mappings)
+        models.insert_mappings(mapper, mappings,
+                               return_defaults=return_defaults)
+
+
+def get_position_key(prop):
+    """If the collection of a one to many relationship is ordered by a column
+    of the related objects, such as one maintained by ordering_list, return
+    the key of that column. Otherwise return None.
+    """
+    if not prop.order_by or len(prop.order_by) != 1:
+        return None
+
+    column = prop.mapper.local_table.c[prop.order_by[0].key]
+    if column.primary_key:
+        return None
+
+    return prop.mapper.get_property_by_column(column).key
+
+
+def get_secondary_rows(prop, obj_id, ids):
+    """Given a many to many relationship, return the rows of its association
+    table that link the object with id obj_id to the objects with the given
+    ids.
+    """
+    local_key = prop.synchronize_pairs[0][1].key
+    remote_key = prop.secondary_synchronize_pairs[0][1].key
+    return [{local_key: obj_id, remote_key: remote_id} for remote_id in ids]
+
+
+def get_remote_updates(prop, obj_id, ids):
+    """Given a one to many relationship, return mappings for
+    bulk_update_mappings that point the objects with the given ids at the
+    object with id obj_id, in order.
+    """
+    remote_column = prop.local_remote_pairs[0][1]
+    remote_mapper = prop.mapper.base_mapper
+    pk_key = remote_mapper.primary_key[0].key
+    fk_key = remote_mapper.get_property_by_column(remote_column).key
+    position_key = get_position_key(prop)
+
+    mappings = []
+    for position, remote_id in enumerate(ids):
+        mapping = {pk_key: remote_id, fk_key: obj_id}
+        if position_key:
+            mapping[position_key] = position
+        mappings.append(mapping)
+
+    return mappings
+
+
+def link_relationships(parsed_rows):
+    """Populate the collections of the inserted rows.
+
+    Many to many relationships become rows in the association table, which are
+    inserted with one executemany per relationship. One to many relationships
+    become updates of the foreign key on the related objects. If the
+    collection is ordered by a position column, the position of each related
+    object is set to its index in the spreadsheet cell.
+    """
+    secondary_rows = defaultdict(list)
+    remote_updates = defaultdict(list)
+
+    for parsed_row in parsed_rows:
+        if not parsed_row["relationships"]:
+            continue
+
+        obj_id = parsed_row["values"][
+            parsed_row["mapper"].primary_key[0].key]
+
+        for prop, ids in parsed_row["relationships"]:
+            if prop.direction == MANYTOMANY:
+                secondary_rows[prop.secondary].extend(
+                    get_secondary_rows(prop, obj_id, ids))
+            else:
+                remote_updates[prop.mapper.base_mapper].extend(
+                    get_remote_updates(prop, obj_id, ids))
+
+    for table, rows in secondary_rows.items():
+        db.session.execute(table.insert(), rows)
+
+    for mapper, mappings in remote_updates.items():
+        db.session.bulk_update_mappings(mapper, mappings)
+
+
+def import_sheet(model, headers, rows, pk_mapping):
+    """Import the rows of one sheet into the database.
+
+    Arguments:
+        model - The model the sheet contains.
+        headers - A list of field names, one per column, or None for columns
+        that should be skipped.
+        rows - An iterable of lists of cell values.
+        pk_mapping - A mapping of table names to dictionaries that map PKs in
+        the spreadsheet to PKs in the database. It is updated with the rows
+        of this sheet.
+
+    Returns the number of rows imported.
+    """
+    parsed_rows = []
+    for row in rows:
+        parsed_row = parse_row(model, headers, row)
+        if parsed_row:
+            parsed_rows.append(parsed_row)
+
+    if not parsed_rows:
+        return 0
+
+    resolve_relationships(parsed_rows, pk_mapping)
+    insert_rows(model, parsed_rows)
+    link_relationships(parsed_rows)
+
+    for parsed_row in parsed_rows:
+        if parsed_row["pk"] is not None:
+            pk_key = parsed_row["mapper"].primary_key[0].key
+            pk_mapping[model.__tablename__][parsed_row["pk"]] = \
+                parsed_row["values"][pk_key]
+
+    return len(parsed_rows)
+
+
+def iter_csv_rows(zip_file, file_name):
+    """Return an iterator over the rows of a CSV file in a zip file, as lists
+    of strings.
+
+    Raises KeyError if the zip file does not contain file_name.
+    """
+    info = zip_file.getinfo(file_name)
+
+    def iter_rows():
+        """Read the file one row at a time.
+        """
+        with zip_file.open(info) as csv_file:
+            if PY2:
+                for row in csv.reader(csv_file):
+                    yield [value.decode("utf-8") for value in row]
+            else:
+                for row in csv.reader(io.TextIOWrapper(csv_file,
+                                                       encoding="utf-8")):
+                    yield row
+
+    return iter_rows()
+
+
+def iter_sheet_rows(workbook, sheet_name):
+    """Return an iterator over the rows of a sheet, as lists of values.
+
+    The workbook is either an openpyxl workbook, ideally opened in read-only
+    mode, or a zip file containing one CSV file per sheet, named after the
+    sheet. Either way, rows are read as they are iterated over.
+
+    Raises KeyError if the workbook does not contain this sheet.
+    """
+    if isinstance(workbook, zipfile.ZipFile):
+        return iter_csv_rows(workbook, sheet_name + ".csv")
+
+    sheet = workbook.get_sheet_by_name(sheet_name)
+    return ([cell.value for cell in row] for row in sheet.iter_rows())
+
+
+def iter_batches(iterable, batch_size):
+    """Yield lists of up to batch_size items from iterable.
+    """
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, batch_size))
+
+
+def open_import_file(import_file, file_name):
+    """Open an uploaded file for importing. The type of the file is determined
+    from file_name.
+
+    XLSX files are opened in read-only mode, so that their sheets can be parsed
+    one row at a time. Zip files are expected to contain one CSV file per
+    sheet.
+    """
+    if file_name.lower().endswith(".zip"):
+        return zipfile.ZipFile(import_file)
+    return openpyxl.load_workbook(import_file, read_only=True)
+
+
+def get_imported_assignment_ids(pk_mapping):
+    """Return the set of ids of the assignments that were imported, or that
+    were given an activity, result or media item that was imported, given the
+    pk_mapping of an import.
+    """
+    assignment_ids = set(
+        pk_mapping[models.Assignment.__tablename__].values())
+    table = models.Assignment.__table__
+    media_item_table = models.assignment_media_item_table
+    related_columns = [
+        (table.c.id, table.c.activity_id,
+         models.Activity.__tablename__),
+        (table.c.id, table.c.result_id,
+         models.Result.__tablename__),
+        (media_item_table.c.assignment_id, media_item_table.c.media_item_id,
+         models.MediaItem.__tablename__),
+    ]
+
+    for id_column, related_column, table_name in related_columns:
+        for batch in iter_batches(pk_mapping[table_name].values(),
+                                  IMPORT_BATCH_SIZE):
+            assignment_ids.update(
+                assignment_id for assignment_id, in db.session.execute(
+                    select([id_column]).
+                    where(related_column.in_(batch))))
+
+    return assignment_ids
+
+
+def validate_assignment(assignment):
+    """Run the checks that the validators of an assignment and its result make
+    when they are set.
+
+    Raises AssertionError if the assignment is not valid.
+    """
+    if assignment.activity:
+        assignment.validate_activity(None, assignment.activity)
+
+    if assignment.result:
+        assignment.validate_result(None, assignment.result)
+        if hasattr(assignment.result, "validate_choice"):
+            assignment.result.validate_choice(assignment)
+
+
+def validate_import(pk_mapping):
+    """Check everything that was imported, given the pk_mapping of an import,
+    as the validators of the models would when they are changed.
+
+    That is, every imported assignment, and every assignment given an
+    imported activity, result or media item, must have as many media items as
+    its activity asks for and a result of the right type, with choices from
+    its activity. The answer of every imported integer question must be
+    within its bounds. Assignments are loaded IMPORT_BATCH_SIZE at a time,
+    along with their activities, media items and results.
+
+    Raises ValueError if anything is not valid.
+    """
+    # Rows were changed without going through the session, so anything it
+    # has already loaded may be out of date
+    db.session.expire_all()
+
+    assignment_ids = {
+        db_id: spreadsheet_id for spreadsheet_id, db_id in
+        pk_mapping[models.Assignment.__tablename__].items()}
+    activity_ids = {
+        db_id: spreadsheet_id for spreadsheet_id, db_id in
+        pk_mapping[models.Activity.__tablename__].items()}
+
+    for batch in iter_batches(get_imported_assignment_ids(pk_mapping),
+                              IMPORT_BATCH_SIZE):
+        assignments = models.Assignment.query.\
+            filter(models.Assignment.id.in_(batch)).\
+            options(joinedload("activity"), subqueryload("media_items"),
+                    joinedload("result")).all()
+
+        # Load the choices of multiselect results now, rather than with one
+        # query per result
+        result_ids = [a.result_id for a in assignments if a.result_id]
+        if result_ids:
+            models.MultiSelectQuestionResult.query.\
+                filter(models.MultiSelectQuestionResult.id.in_(result_ids)).\
+                options(subqueryload("choices")).all()
+
+        for assignment in assignments:
+            try:
+                validate_assignment(assignment)
+            except AssertionError:
+                raise ValueError(
+                    "Assignment with ID {} does not match its activity".
+                    format(assignment_ids.get(assignment.id,
+                                              assignment.id)))
+
+    for batch in iter_batches(activity_ids, IMPORT_BATCH_SIZE):
+        for question in models.IntegerQuestion.query.\
+                filter(models.IntegerQuestion.id.in_(batch)):
+            if question.answer is None:
+                continue
+            try:
+                question.validate_answer(None, question.answer)
+            except AssertionError:
+                raise ValueError(
+                    "Answer of activity with ID {} is out of bounds".
+                    format(activity_ids[question.id]))
+
+
+def get_imported_experiments(pk_mapping):
+    """Return a list of the experiments that were imported, or that contain
+    an assignment set or assignment that was imported, given the pk_mapping
+    of an import.
+    """
+    experiment_ids = set(pk_mapping[models.Experiment.__tablename__].values())
+    assignment_set_ids = set(
+        pk_mapping[models.AssignmentSet.__tablename__].values())
+
+    for batch in iter_batches(
+            pk_mapping[models.Assignment.__tablename__].values(),
+            IMPORT_BATCH_SIZE):
+        assignment_set_ids.update(
+            set_id for set_id, in db.session.query(
+                models.Assignment.assignment_set_id).
+            filter(models.Assignment.id.in_(batch)))
+
+    for batch in iter_batches(assignment_set_ids, IMPORT_BATCH_SIZE):
+        experiment_ids.update(
+            experiment_id for experiment_id, in db.session.query(
+                models.AssignmentSet.experiment_id).
+            filter(models.AssignmentSet.id.in_(batch)))
+
+    experiment_ids.discard(None)
+    if not experiment_ids:
+        return []
+
+    return models.Experiment.query.\
+        filter(models.Experiment.id.in_(experiment_ids)).all()
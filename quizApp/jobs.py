@@ -0,0 +1,266 @@
+"""Run long running operations, such as imports and exports, in the
+background.
+
+Each operation is recorded as a Job in the database and handed to a pool of
+worker threads, so that the request that started it can return the job's ID
+at once. Job handlers are registered with the ``handler`` decorator of the job
+queue:
+
+    @job_queue.handler("export")
+    def export_job(args, report_progress):
+        ...
+        return {"output_path": file_name, "output_name": "export.xlsx"}
+
+A handler receives the arguments the job was submitted with and a function
+that accepts a number from 0 to 1 describing how far along the job is. It may
+return a dictionary; ``output_path`` and ``output_name`` are stored on the job
+so the file can be downloaded later, and anything else is stored as the job's
+result.
+
+Handlers run inside a savepoint which is committed if they succeed, so they
+should not commit the session themselves. If a handler raises an exception,
+its changes are rolled back and the traceback is stored on the job.
+
+Jobs only live in the process that submitted them. While a job is queued or
+running, that process updates its heartbeat every ``JOB_HEARTBEAT_SECONDS``.
+If the process exits, for example when a worker is restarted, the heartbeat
+stops, and once it is older than ``JOB_STALE_SECONDS`` the job is marked as
+failed the next time an app starts handling requests.
+
+Jobs that finished or failed more than ``JOB_EXPIRY_SECONDS`` ago are deleted,
+along with their output files, when an app starts handling requests and by the
+``delete-expired-jobs`` command of ``manage.py``, which can be run
+periodically. Output files are written to the temporary directory of the
+process that ran the job, so downloading and deleting them only works if every
+process runs on the same host or shares that directory.
+
+If the ``JOB_SYNCHRONOUS`` config option is set, jobs are run immediately in
+the thread that submits them. This is useful for testing.
+"""
+from __future__ import unicode_literals
+from builtins import object
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import and_, or_, select
+
+from quizApp import db
+from quizApp.models import Job
+
+STALE_JOB_TRACEBACK = ("The process running this job exited before the job "
+                       "finished. Please try again.")
+
+
+class JobQueue(object):
+    """Keeps track of job handlers and runs jobs in a pool of worker threads
+    for each app.
+    """
+
+    def __init__(self, app=None):
+        self.handlers = {}
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Start the worker pool for this app, and the thread that updates
+        the heartbeats of its jobs.
+
+        The number of workers is given by the ``JOB_WORKERS`` config option.
+        """
+        executor = None
+        if not app.config["JOB_SYNCHRONOUS"]:
+            executor = ThreadPoolExecutor(app.config["JOB_WORKERS"])
+
+        state = {"app": app, "executor": executor, "active": set(),
+                 "lock": threading.Lock()}
+        app.extensions["job_queue"] = state
+
+        if executor:
+            heartbeat = threading.Thread(target=self.beat, args=(state,))
+            heartbeat.daemon = True
+            heartbeat.start()
+
+        app.before_first_request(self.fail_stale_jobs)
+        app.before_first_request(self.delete_expired_jobs)
+
+    def handler(self, job_type):
+        """Register the decorated function as the handler for jobs of type
+        job_type.
+        """
+        def decorator(func):
+            """Register func.
+            """
+            self.handlers[job_type] = func
+            return func
+        return decorator
+
+    def submit(self, job_type, **kwargs):
+        """Create a job of type job_type with the given arguments, queue it,
+        and return it.
+        """
+        if job_type not in self.handlers:
+            raise ValueError("No handler for jobs of type {}".
+                             format(job_type))
+
+        job = Job(type=job_type, status="queued", progress=0,
+                  args=json.dumps(kwargs), heartbeat=datetime.now())
+        job.save()
+
+        state = current_app.extensions["job_queue"]
+        if state["executor"]:
+            with state["lock"]:
+                state["active"].add(job.id)
+            state["executor"].submit(self.work, state, job.id)
+        else:
+            self.run(job, lambda progress: setattr(job, "progress", progress))
+
+        return job
+
+    def work(self, state, job_id):
+        """Run the job with the given ID in a worker thread.
+        """
+        with state["app"].app_context():
+            try:
+                job = Job.query.get(job_id)
+                self.run(job, lambda progress: set_progress(job_id, progress))
+            finally:
+                db.session.remove()
+                with state["lock"]:
+                    state["active"].discard(job_id)
+
+    @staticmethod
+    def beat(state):
+        """Update the heartbeats of the jobs queued or running in this
+        process every ``JOB_HEARTBEAT_SECONDS``, forever.
+        """
+        app = state["app"]
+
+        while True:
+            time.sleep(app.config["JOB_HEARTBEAT_SECONDS"])
+
+            with state["lock"]:
+                job_ids = list(state["active"])
+
+            if not job_ids:
+                continue
+
+            try:
+                with app.app_context():
+                    touch_jobs(job_ids)
+            except Exception:
+                app.logger.exception("Could not update job heartbeats")
+
+    @staticmethod
+    def fail_stale_jobs():
+        """Mark queued or running jobs whose heartbeat is older than
+        ``JOB_STALE_SECONDS`` as failed, as the process they were in has
+        exited. Returns how many jobs were marked.
+        """
+        table = Job.__table__
+        now = datetime.now()
+        cutoff = now - timedelta(
+            seconds=current_app.config["JOB_STALE_SECONDS"])
+
+        result = db.session.execute(
+            table.update().
+            where(and_(table.c.status.in_(["queued", "running"]),
+                       or_(table.c.heartbeat.is_(None),
+                           table.c.heartbeat < cutoff))).
+            values(status="failed", finished=now,
+                   traceback=STALE_JOB_TRACEBACK))
+        db.session.commit()
+
+        return result.rowcount
+
+    @staticmethod
+    def delete_expired_jobs():
+        """Delete jobs that finished or failed more than
+        ``JOB_EXPIRY_SECONDS`` ago, and their output files. Returns how many
+        jobs were deleted.
+        """
+        table = Job.__table__
+        cutoff = datetime.now() - timedelta(
+            seconds=current_app.config["JOB_EXPIRY_SECONDS"])
+        expired = and_(table.c.status.in_(["finished", "failed"]),
+                       table.c.finished < cutoff)
+
+        output_paths = db.session.execute(
+            select([table.c.output_path]).
+            where(and_(expired, table.c.output_path.isnot(None))))
+
+        for row in output_paths:
+            try:
+                os.remove(row.output_path)
+            except OSError:
+                # The file was already deleted, or is on another host
+                pass
+
+        result = db.session.execute(table.delete().where(expired))
+        db.session.commit()
+
+        return result.rowcount
+
+    def run(self, job, report_progress):
+        """Run a job and record its outcome.
+        """
+        job.status = "running"
+        job.started = datetime.now()
+        job.heartbeat = job.started
+        db.session.commit()
+
+        savepoint = db.session.begin_nested()
+        try:
+            result = self.handlers[job.type](job.get_args(), report_progress)
+            savepoint.commit()
+        except Exception:
+            savepoint.rollback()
+            job.status = "failed"
+            job.traceback = traceback.format_exc()
+        else:
+            result = result or {}
+            job.output_path = result.pop("output_path", None)
+            job.output_name = result.pop("output_name", None)
+            job.result = json.dumps(result)
+            job.status = "finished"
+            job.progress = 1
+
+        job.finished = datetime.now()
+        db.session.commit()
+
+
+def set_progress(job_id, progress):
+    """Update the progress of a job outside of the current session, so that
+    it can be seen before the job's changes are committed.
+    """
+    db.engine.execute(Job.__table__.update().
+                      where(Job.__table__.c.id == job_id).
+                      values(progress=progress))
+
+
+def touch_jobs(job_ids):
+    """Set the heartbeat of the jobs with the given IDs to now, outside of
+    the current session.
+    """
+    db.engine.execute(Job.__table__.update().
+                      where(Job.__table__.c.id.in_(job_ids)).
+                      values(heartbeat=datetime.now()))
+
+
+def iter_with_progress(iterable, total, report_progress, every=100):
+    """Yield the items in iterable, reporting progress every ``every`` items
+    given that there are ``total`` items.
+    """
+    for index, item in enumerate(iterable):
+        if total and index % every == 0:
+            report_progress(min(float(index) / total, 1))
+        yield item
+
+
+job_queue = JobQueue()
@@ -0,0 +1,323 @@
+"""Record how many SQL statements each endpoint runs and how long it takes.
+
+If the ``METRICS_ENABLED`` config option is set, every request is timed, along
+with the SQL statements it runs and the templates it renders. The totals for
+each endpoint are served at ``/metrics`` in the Prometheus text format, so
+they can be scraped and graphed:
+
+    quizapp_requests_total{endpoint="experiments.read_assignment"} 12
+    quizapp_request_statements_total{endpoint="experiments.read_assignment"} 96
+
+The hit and miss counts of the in-process caches are served there too.
+
+Only experimenters can read ``/metrics``. Scrapers that cannot log in can
+instead send the value of the ``METRICS_TOKEN`` config option as a bearer
+token:
+
+    Authorization: Bearer <METRICS_TOKEN>
+
+Requests that take longer than ``METRICS_SLOW_REQUEST_SECONDS`` or run more
+than ``METRICS_SLOW_REQUEST_STATEMENTS`` statements are logged as warnings,
+so that regressions such as lazy loads in a loop show up in the logs.
+"""
+from __future__ import unicode_literals
+from builtins import object
+from collections import defaultdict
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Response, abort, current_app, g, has_request_context, \
+    request, request_started, request_finished, before_render_template, \
+    template_rendered
+from flask_security import current_user
+from sqlalchemy import event
+
+from quizApp import db
+from quizApp.cache import LRUCache
+from quizApp.filters import graph_url_cache
+
+REQUEST_SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                           5, 10]
+"""list of float: Upper bounds, in seconds, of the buckets in the request
+duration histogram.
+"""
+
+
+class RequestMetrics(object):
+    """What has happened so far in the current request.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.statements = 0
+        self.db_seconds = 0
+        self.render_seconds = 0
+        self.render_starts = []
+
+
+class EndpointMetrics(object):
+    """Running totals for every request to one endpoint.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.db_seconds = 0
+        self.render_seconds = 0
+        self.seconds = 0
+        self.buckets = [0] * (len(REQUEST_SECONDS_BUCKETS) + 1)
+
+    def record(self, request_metrics, seconds):
+        """Add a request that took ``seconds`` to the totals.
+        """
+        self.requests += 1
+        self.statements += request_metrics.statements
+        self.db_seconds += request_metrics.db_seconds
+        self.render_seconds += request_metrics.render_seconds
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(REQUEST_SECONDS_BUCKETS,
+                                        seconds)] += 1
+
+
+class Metrics(object):
+    """Hooks into the database engine and request signals of each app that
+    has metrics enabled.
+
+    Attributes:
+        url (str): Where the metrics of each app are served
+    """
+
+    def __init__(self, app=None, url="/metrics"):
+        self.url = url
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Start recording metrics for this app, if ``METRICS_ENABLED`` is
+        set, and add the endpoint that serves them.
+        """
+        if not app.config["METRICS_ENABLED"]:
+            return
+
+        app.extensions["metrics"] = {
+            "endpoints": defaultdict(EndpointMetrics),
+            "lock": threading.Lock(),
+        }
+
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", start_statement)
+        event.listen(engine, "after_cursor_execute", finish_statement)
+
+        request_started.connect(start_request, app)
+        before_render_template.connect(start_render, app)
+        template_rendered.connect(finish_render, app)
+        request_finished.connect(finish_request, app)
+
+        app.add_url_rule(self.url, "metrics", read_metrics)
+
+
+def get_request_metrics():
+    """Return the metrics of the current request, or None if we are not in a
+    request that is being recorded.
+    """
+    if not has_request_context():
+        return None
+    return getattr(g, "request_metrics", None)
+
+
+def start_request(_, **__):
+    """Start recording a request.
+    """
+    g.request_metrics = RequestMetrics()
+
+
+def start_statement(conn, *_):
+    """Remember when a statement started executing.
+    """
+    conn.info.setdefault("statement_starts", []).append(time.time())
+
+
+def finish_statement(conn, *_):
+    """Count a statement and the time it took towards the current request.
+    """
+    start = conn.info["statement_starts"].pop()
+    request_metrics = get_request_metrics()
+
+    if request_metrics:
+        request_metrics.statements += 1
+        request_metrics.db_seconds += time.time() - start
+
+
+def start_render(_, **__):
+    """Remember when a template started rendering.
+    """
+    request_metrics = get_request_metrics()
+
+    if request_metrics:
+        request_metrics.render_starts.append(time.time())
+
+
+def finish_render(_, **__):
+    """Count the time spent rendering a template towards the current request.
+
+    Templates rendered while rendering another template are already counted in
+    the outer template's time.
+    """
+    request_metrics = get_request_metrics()
+
+    if request_metrics and request_metrics.render_starts:
+        start = request_metrics.render_starts.pop()
+
+        if not request_metrics.render_starts:
+            request_metrics.render_seconds += time.time() - start
+
+
+def finish_request(app, response, **__):
+    """Add the current request to the totals of its endpoint and log it if it
+    was slow.
+    """
+    request_metrics = get_request_metrics()
+
+    if not request_metrics:
+        return
+
+    g.request_metrics = None
+    seconds = time.time() - request_metrics.start
+    endpoint = request.endpoint or "unknown"
+
+    state = app.extensions["metrics"]
+    with state["lock"]:
+        state["endpoints"][endpoint].record(request_metrics, seconds)
+
+    if seconds > app.config["METRICS_SLOW_REQUEST_SECONDS"] or \
+            request_metrics.statements > \
+            app.config["METRICS_SLOW_REQUEST_STATEMENTS"]:
+        app.logger.warning(
+            "Slow request: %s %s (%s) returned %s in %.3fs, running %d "
+            "statements in %.3fs and rendering for %.3fs",
+            request.method, request.path, endpoint, response.status_code,
+            seconds, request_metrics.statements, request_metrics.db_seconds,
+            request_metrics.render_seconds)
+
+
+def format_metrics(endpoints):
+    """Given a mapping of endpoint names to EndpointMetrics, return their
+    totals in the Prometheus text format.
+    """
+    lines = []
+
+    def add_metric(name, metric_type, description, get_value):
+        """Add a metric with a value for every endpoint.
+        """
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+
+        for endpoint, totals in sorted(endpoints.items()):
+            lines.append('{}{{endpoint="{}"}} {}'.format(
+                name, escape_label(endpoint), get_value(totals)))
+
+    add_metric("quizapp_requests_total", "counter",
+               "Number of requests handled.",
+               lambda totals: totals.requests)
+    add_metric("quizapp_request_statements_total", "counter",
+               "Number of SQL statements run while handling requests.",
+               lambda totals: totals.statements)
+    add_metric("quizapp_request_db_seconds_total", "counter",
+               "Time spent running SQL statements while handling requests.",
+               lambda totals: totals.db_seconds)
+    add_metric("quizapp_request_render_seconds_total", "counter",
+               "Time spent rendering templates while handling requests.",
+               lambda totals: totals.render_seconds)
+
+    name = "quizapp_request_seconds"
+    lines.append("# HELP {} Time spent handling requests.".format(name))
+    lines.append("# TYPE {} histogram".format(name))
+
+    for endpoint, totals in sorted(endpoints.items()):
+        label = 'endpoint="{}"'.format(escape_label(endpoint))
+        count = 0
+
+        for bound, bucket in zip(REQUEST_SECONDS_BUCKETS + ["+Inf"],
+                                 totals.buckets):
+            count += bucket
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, label, bound, count))
+
+        lines.append("{}_sum{{{}}} {}".format(name, label, totals.seconds))
+        lines.append("{}_count{{{}}} {}".format(name, label,
+                                                totals.requests))
+
+    return "\n".join(lines) + "\n"
+
+
+def format_cache_metrics(caches):
+    """Given a mapping of cache names to LRUCaches, return their hit and miss
+    counts in the Prometheus text format.
+    """
+    lines = []
+
+    counts = [
+        ("hits", "Number of cache lookups that found a value."),
+        ("misses", "Number of cache lookups that did not find a value."),
+    ]
+
+    for name, description in counts:
+        metric = "quizapp_cache_{}_total".format(name)
+        lines.append("# HELP {} {}".format(metric, description))
+        lines.append("# TYPE {} counter".format(metric))
+
+        for cache_name, cache in sorted(caches.items()):
+            lines.append('{}{{cache="{}"}} {}'.format(
+                metric, escape_label(cache_name), getattr(cache, name)))
+
+    return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').\
+        replace("\n", "\\n")
+
+
+def is_metrics_reader():
+    """Return True if the current request may read the metrics, that is if it
+    carries the ``METRICS_TOKEN`` or comes from an experimenter.
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    authorization = request.headers.get("Authorization", "")
+
+    if token and authorization.startswith("Bearer ") and \
+            hmac.compare_digest(authorization[len("Bearer "):].encode("utf-8"),
+                                token.encode("utf-8")):
+        return True
+
+    return current_user.is_authenticated and \
+        current_user.has_role("experimenter")
+
+
+def read_metrics():
+    """Serve the totals of every endpoint in the Prometheus text format.
+    """
+    if not is_metrics_reader():
+        abort(403)
+
+    state = current_app.extensions["metrics"]
+
+    with state["lock"]:
+        text = format_metrics(state["endpoints"])
+
+    caches = {"graph_url": graph_url_cache}
+    fragment_backend = current_app.extensions["fragment_cache"]
+    if isinstance(fragment_backend, LRUCache):
+        caches["fragment"] = fragment_backend
+
+    text += format_cache_metrics(caches)
+
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+metrics = Metrics()
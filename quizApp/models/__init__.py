@@ -0,0 +1,43 @@
+"""Models for the quizApp.
+
+The models are split into modules by topic, and every model is imported here,
+so that they are all mapped together and can be used as ``models.<name>``.
+"""
+from __future__ import unicode_literals
+
+from quizApp.models.base import Base, VersionMixin, get_id_increment, \
+    insert_mappings
+from quizApp.models.users import UNUSABLE_PASSWORD, roles_users, Role, \
+    User, participant_dataset_table, Participant
+from quizApp.models.activities import Result, ScorecardResult, \
+    IntegerQuestionResult, MultipleChoiceQuestionResult, \
+    result_choice_table, MultiSelectQuestionResult, \
+    FreeAnswerQuestionResult, Activity, question_dataset_table, Scorecard, \
+    Question, IntegerQuestion, MultipleChoiceQuestion, SingleSelectQuestion, \
+    MultiSelectQuestion, ScaleQuestion, FreeAnswerQuestion, Choice, \
+    ScorecardSettings, populate_scorecard_settings
+from quizApp.models.experiments import AssignmentSet, \
+    assignment_media_item_table, Assignment, Experiment
+from quizApp.models.media import MediaItem, Graph, Text, Dataset
+from quizApp.models.stats import TIME_TO_SUBMIT_BUCKETS, get_or_create_row, \
+    ExperimentStats, ActivityStats
+from quizApp.models.jobs import Job
+
+__all__ = [
+    "Base", "VersionMixin", "get_id_increment", "insert_mappings",
+    "UNUSABLE_PASSWORD", "roles_users", "Role", "User",
+    "participant_dataset_table", "Participant",
+    "Result", "ScorecardResult", "IntegerQuestionResult",
+    "MultipleChoiceQuestionResult", "result_choice_table",
+    "MultiSelectQuestionResult", "FreeAnswerQuestionResult", "Activity",
+    "question_dataset_table", "Scorecard", "Question", "IntegerQuestion",
+    "MultipleChoiceQuestion", "SingleSelectQuestion", "MultiSelectQuestion",
+    "ScaleQuestion", "FreeAnswerQuestion", "Choice", "ScorecardSettings",
+    "populate_scorecard_settings",
+    "AssignmentSet", "assignment_media_item_table", "Assignment",
+    "Experiment",
+    "MediaItem", "Graph", "Text", "Dataset",
+    "TIME_TO_SUBMIT_BUCKETS", "get_or_create_row", "ExperimentStats",
+    "ActivityStats",
+    "Job",
+]
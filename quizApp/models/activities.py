@@ -1,268 +1,13 @@
-"""Models for the quizApp.
+"""Models for activities, their choices, and the results participants give to
+them.
 """
 from __future__ import unicode_literals
 from builtins import object
-import os
-from datetime import datetime
 
-from quizApp import db
-from flask import current_app
-from flask_security import UserMixin, RoleMixin
-
-
-class Base(db.Model):
-    """Base class for all models.
-
-    All models have an identical id field.
-
-    Attributes:
-        id (int): A unique identifier.
-    """
-    __abstract__ = True
-
-    id = db.Column(db.Integer, primary_key=True)
-
-    def save(self, commit=True):
-        """Save this model to the database.
-
-        If commit is True, then the session will be comitted as well.
-        """
-        db.session.add(self)
-
-        if commit:
-            db.session.commit()
-
-    def import_dict(self, **kwargs):
-        """Populate this object using data imported from a spreadsheet or
-        similar. This means that not all fields will be passed into this
-        function, however there are enough fields to populate all necessary
-        fields. Due to validators, some fields need to be populated before
-        others. Subclasses of Base to which this applies are expected to
-        override this method and implement their import correctly.
-        """
-        for key, value in list(kwargs.items()):
-            setattr(self, key, value)
-
-
-roles_users = db.Table('roles_users',
-                       db.Column('user_id', db.Integer(),
-                                 db.ForeignKey('user.id')),
-                       db.Column('role_id', db.Integer(),
-                                 db.ForeignKey('role.id')))
-
-
-class Role(Base, RoleMixin):
-    """A Role describes what a User can and can't do.
-    """
-    name = db.Column(db.String(80), unique=True)
-    description = db.Column(db.String(255))
-
-
-class User(Base, UserMixin):
-    """A User is used for authentication.
-
-    Attributes:
-        name (string): The username of this user.
-        password (string): This user's password.
-        authenticated (bool): True if this user is authenticated.
-        type (string): The type of this user, e.g. experimenter, participant
-    """
-
-    email = db.Column(db.String(255), unique=True)
-    active = db.Column(db.Boolean())
-    password = db.Column(db.String(255), nullable=False)
-    confirmed_at = db.Column(db.DateTime())
-    roles = db.relationship("Role", secondary=roles_users,
-                            backref=db.backref('users', lazy='dynamic'))
-
-    type = db.Column(db.String(50), nullable=False)
-
-    def has_any_role(self, roles):
-        """Given a list of Roles, return True if the user has at least one of
-        them.
-        """
-        return any(self.has_role(role) for role in roles)
-
-    __mapper_args__ = {
-        'polymorphic_identity': 'user',
-        'polymorphic_on': type
-    }
-
-
-participant_dataset_table = db.Table(
-    "participant_dataset", db.metadata,
-    db.Column('participant_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('dataset_id', db.Integer, db.ForeignKey('dataset.id'))
-)
-
-
-class Participant(User):
-    """A User that takes Experiments.
-
-    Attributes:
-        opt_in (bool): Has this user opted in to data collection?
-        foreign_id (str): If the user is coming from an external source (e.g.
-            canvas, mechanical turk) it may be necessary to record their user
-            ID on the other service (e.g. preventing multiple submission). This
-            field holds the foreign ID of this user.
-        assignment_sets (list of AssignmentSets): List of AssignmentSets that
-            this participant has
-    """
-
-    opt_in = db.Column(db.Boolean)
-    foreign_id = db.Column(db.String(100))
-
-    assignment_sets = db.relationship("AssignmentSet",
-                                      back_populates="participant")
-
-    __mapper_args__ = {
-        'polymorphic_identity': 'participant',
-    }
-
-
-class AssignmentSet(Base):
-    """An AssignmentSet represents a sequence of Assignments within an
-    Experiment. All Assignments in an AssignmentSet are done in order by the
-    same Participant.
-
-    Attributes:
-        progress (int): Which Assignment the user is currently working on.
-        complete (bool): True if the user has finalized their responses, False
-            otherwise
-        participant (Participant): Which Participant this refers to
-        experiment (Experiment): Which Experiment this refers to
-        assignments (list of Assignment): The assignments that this Participant
-            should do in this Experiment
-    """
-    class Meta(object):
-        """Specify field order.
-        """
-        field_order = ('*', 'assignments')
-
-    progress = db.Column(db.Integer, nullable=False, default=0,
-                         info={"import_include": False})
-    complete = db.Column(db.Boolean, default=False,
-                         info={"import_include": False})
-
-    participant_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    participant = db.relationship("Participant",
-                                  back_populates="assignment_sets",
-                                  info={"import_include": False})
-
-    experiment_id = db.Column(db.Integer, db.ForeignKey('experiment.id'))
-    experiment = db.relationship("Experiment",
-                                 back_populates="assignment_sets")
-
-    assignments = db.relationship("Assignment",
-                                  back_populates="assignment_set")
-
-    @property
-    def score(self):
-        """Return the cumulative score of all assignments in this
-        AssignmentSet,
-
-        Currently this iterates through all assignments. Profiling will be
-        required to see if this is too slow.
-        """
-        score = 0
-
-        for assignment in self.assignments[:self.progress]:
-            score += assignment.score
-
-        return score
-
-    def import_dict(self, **kwargs):
-        experiment = kwargs.pop("experiment")
-        self.experiment = experiment
-
-        super(AssignmentSet, self).import_dict(**kwargs)
-
-assignment_media_item_table = db.Table(
-    "assignment_media_item", db.metadata,
-    db.Column("assignment_id", db.Integer,
-              db.ForeignKey("assignment.id")),
-    db.Column("media_item_id", db.Integer, db.ForeignKey("media_item.id"))
-)
-
-
-class Assignment(Base):
-    """For a given Activity, determine which MediaItems, if any, a particular
-    Participant sees, as well as recording the Participant's answer, or if
-    they skipped this assignment.
-
-    Attributes:
-        comment (string): An optional comment entered by the student.
-        choice_order (string): A JSON object in string form that represents the
-            order of choices that this participant was presented with when
-            answering this question, e.g. {[1, 50, 9, 3]} where the numbers are
-            the IDs of those choices.
-        time_to_submit (timedelta): Time from the question being rendered to
-            the question being submitted.
-        media_items (list of MediaItem): What MediaItems should be shown
-        activity (Activity): Which Activity this Participant should see
-        assignment_set (AssignmentSet): Which AssignmentSet this Assignment
-            belongs to
-    """
-
-    comment = db.Column(db.String(500), info={"import_include": False})
-    choice_order = db.Column(db.String(80), info={"import_include": False})
-    time_to_submit = db.Column(db.Interval(), info={"import_include": False})
-
-    media_items = db.relationship("MediaItem",
-                                  secondary=assignment_media_item_table,
-                                  back_populates="assignments")
+from sqlalchemy import inspect
 
-    activity_id = db.Column(db.Integer, db.ForeignKey("activity.id"))
-    activity = db.relationship("Activity", back_populates="assignments")
-
-    result_id = db.Column(db.Integer, db.ForeignKey("result.id"))
-    result = db.relationship("Result", back_populates="assignment",
-                             info={"import_include": False}, uselist=False)
-
-    assignment_set_id = db.Column(
-        db.Integer,
-        db.ForeignKey("assignment_set.id"),
-    )
-    assignment_set = db.relationship("AssignmentSet",
-                                     info={"import_include": False},
-                                     back_populates="assignments")
-
-    @property
-    def correct(self):
-        """Check if this assignment was answered correctly.
-        """
-        return self.activity.is_correct(self.result)
-
-    @property
-    def score(self):
-        """Get the score for this assignment.
-
-        This method simply passes `result` to the `activity`'s `get_score`
-        method and returns the result.
-
-        Note that if there is no `activity` this will raise an AttributeError.
-        """
-        return self.activity.get_score(self.result)
-
-    @db.validates("activity")
-    def validate_activity(self, _, activity):
-        """Make sure that the number of media items on the activity is the same as
-        the number of media items this assignment has.
-        """
-        try:
-            assert (activity.num_media_items == len(self.media_items)) or \
-                activity.num_media_items == -1
-        except AttributeError:
-            pass
-
-        return activity
-
-    @db.validates("result")
-    def validate_result(self, _, result):
-        """Make sure that this assignment has the correct type of result.
-        """
-        assert isinstance(result, self.activity.Meta.result_class)
-        return result
+from quizApp import db
+from quizApp.models.base import Base, VersionMixin, insert_mappings
 
 
 class Result(Base):
@@ -394,7 +139,7 @@ class FreeAnswerQuestionResult(Result):
     }
 
 
-class Activity(Base):
+class Activity(Base, VersionMixin):
     """An Activity is essentially a screen that a User sees while doing an
     Experiment. It may be an instructional screen or show a Question, or do
     something else.
@@ -417,6 +162,10 @@ class Activity(Base):
             this Activity is done
         include_in_scorecards (bool): Whether or not to show this Activity in
             scorecards
+        stats (list of ActivityStats): Running statistics about this Activity
+            in each Experiment it appears in
+        version (int): Incremented whenever this Activity or its choices are
+            changed, see ``VersionMixin``
     """
     class Meta(object):
         """Define what kind of Result we are looking for.
@@ -437,12 +186,23 @@ class Activity(Base):
                                       db.ForeignKey("scorecard_settings.id"))
     scorecard_settings = db.relationship("ScorecardSettings")
 
+    stats = db.relationship("ActivityStats", back_populates="activity",
+                            cascade="all, delete-orphan",
+                            info={"export_include": False,
+                                  "import_include": False})
+
     def __init__(self, *args, **kwargs):
         """Make sure to populate scorecard_settings.
         """
         self.scorecard_settings = ScorecardSettings()
         super(Activity, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def prepare_import_mappings(cls, mappings):
+        """Make sure to populate scorecard_settings.
+        """
+        populate_scorecard_settings(mappings)
+
     def get_score(self, result):
         """Get the participant's score for this Activity.
 
@@ -725,82 +485,6 @@ class Choice(Base):
         return label
 
 
-class MediaItem(Base):
-    """A MediaItem is any aid to be shown when displaying an assignment. It can
-    be text, image, videos, sound, whatever. Specific types should subclass
-    this class and define their own fields needed for rendering.
-
-    Attributes:
-        name (str): Name for this Media Item
-        assignments (list of Assignment): Which Assignments display this
-            MediaItem
-        dataset (Dataset): Which Dataset owns this MediaItem
-    """
-
-    assignments = db.relationship(
-        "Assignment",
-        secondary=assignment_media_item_table,
-        back_populates="media_items")
-    dataset = db.relationship("Dataset", back_populates="media_items")
-    dataset_id = db.Column(db.Integer, db.ForeignKey("dataset.id"))
-    type = db.Column(db.String(80), nullable=False)
-    name = db.Column(db.String(100), nullable=False,
-                     info={"label": "Name"},
-                     default="New media item")
-
-    __mapper_args__ = {
-        'polymorphic_identity': 'media_item',
-        'polymorphic_on': type
-    }
-
-
-class Graph(MediaItem):
-    """A Graph is an image file located on the server that may be shown in
-    conjunction with an Assignment.
-
-    Attributes:
-        path (str): Absolute path to this Graph on disk
-    """
-
-    path = db.Column(db.String(200), nullable=False)
-
-    def filename(self):
-        """Return the filename of this graph.
-        """
-        return os.path.basename(self.path)
-
-    @property
-    def directory(self):
-        """Return the directory this graph is located in.
-
-        If ``path`` is not empty, return the lowest directory specified by
-        ``path``. Otherwise, return the designated graph directory.
-        """
-        current_directory = os.path.split(self.path)[0]
-        if current_directory:
-            return current_directory
-        return os.path.join(current_app.static_folder,
-                            current_app.config.get("GRAPH_DIRECTORY"))
-
-    __mapper_args__ = {
-        'polymorphic_identity': 'graph'
-    }
-
-
-class Text(MediaItem):
-    """Text is simply a piece of text that can be used as a MediaItem.
-
-    Attributes:
-        text (str): The text of this media item.
-    """
-
-    text = db.Column(db.Text, info={"label": "Text"})
-
-    __mapper_args__ = {
-        'polymorphic_identity': 'text'
-    }
-
-
 class ScorecardSettings(Base):
     """A ScorecardSettings object represents the configuration of some kind of
     scorecard.
@@ -835,94 +519,15 @@ class ScorecardSettings(Base):
                                        "Display feedback on scorecard"})
 
 
-class Experiment(Base):
-    """An Experiment contains a list of Activities.
-
-    Attributes:
-        name (str): The name of this experiment
-        created (datetime): When this experiment was created
-        start (datetime): When this experiment becomes accessible for answers
-        stop (datetime): When this experiment stops accepting answers
-        assignment_sets (list of ParticiapntExperiment): List of
-            AssignmentSets that are associated with this Experiment
-        disable_previous (bool): If True, don't allow Participants to view and
-            modify previous activities.
-        show_timers (bool): If True, display a timer on each activity
-            expressing how long the user has been viewing this activity.
-        show_scores (bool): If True, show the participant a cumulative score on
-            every activity.
-        scorecard_settings (ScorecardSettings): A ScorecardSettings instance
-            that determines how scorecards will be rendered in this Experiment.
-
-            If the ``display_scorecard`` field is ``False``, then no scorecards
-            will be displayed.
-
-            If the ``display_scorecard`` field is ``True``, then scorecards
-            will be displayed after Activities whose own ``ScorecardSettings``
-            objects specify that scorecards should be shown. They will be
-            rendered according to the ``ScorecardSettings`` of that Activity.
-
-            In addition, a scorecard will be rendered after the experiment
-            according to the Experiment's ``ScorecardSettings``.
-        flash (bool): If True, flash the MediaItem for flash_duration
-            milliseconds
-        flash_duration (int): How long to display the MediaItem in milliseconds
+def populate_scorecard_settings(mappings):
+    """Insert a new ScorecardSettings for every mapping that does not refer to
+    one, and set scorecard_settings_id accordingly.
     """
+    missing = [m for m in mappings if not m.get("scorecard_settings_id")]
+    settings = [{} for _ in missing]
 
-    name = db.Column(db.String(150), nullable=False, info={"label": "Name"})
-    created = db.Column(db.DateTime)
-    start = db.Column(db.DateTime, nullable=False, info={"label": "Start"})
-    stop = db.Column(db.DateTime, nullable=False, info={"label": "Stop"})
-    blurb = db.Column(db.Text, info={"label": "Blurb"})
-    show_scores = db.Column(db.Boolean,
-                            info={"label": ("Show score tally during the"
-                                            " experiment")})
-    flash = db.Column(db.Boolean,
-                      info={"label": "Flash MediaItems when displaying"})
-    flash_duration = db.Column(db.Integer, nullable=False, default=0,
-                               info={"label": "Flash duration (ms)"})
-    disable_previous = db.Column(db.Boolean,
-                                 info={"label": ("Don't let participants go "
-                                                 "back after submitting an "
-                                                 "activity")})
-    show_timers = db.Column(db.Boolean,
-                            info={"label": "Show timers on activities"})
-
-    assignment_sets = db.relationship("AssignmentSet",
-                                      back_populates="experiment")
-
-    scorecard_settings_id = db.Column(db.Integer,
-                                      db.ForeignKey("scorecard_settings.id"))
-    scorecard_settings = db.relationship("ScorecardSettings",
-                                         uselist=False)
-
-    def __init__(self, *args, **kwargs):
-        """Make sure to populate scorecard_settings.
-        """
-        self.scorecard_settings = ScorecardSettings()
-        super(Experiment, self).__init__(*args, **kwargs)
-
-    @property
-    def running(self):
-        """Returns True if this experiment is currently running, otherwise
-        False.
-        """
-        now = datetime.now()
-        return now >= self.start and now <= self.stop
-
-
-class Dataset(Base):
-    """A Dataset represents some data that MediaItems are based on.
-
-    Attributes:
-        name (string): The name of this dataset.
-        info (string): Some information about this dataset
-        media_items (list of MediaItem): Which MediaItems this Dataset owns
-        questions (list of Questions): Which Questions reference this Dataset
-    """
-    name = db.Column(db.String(100), nullable=False, info={"label": "Name"})
-    info = db.Column(db.Text, info={"label": "Info"})
+    insert_mappings(inspect(ScorecardSettings), settings,
+                    return_defaults=True)
 
-    media_items = db.relationship("MediaItem", back_populates="dataset")
-    questions = db.relationship("Question", secondary=question_dataset_table,
-                                back_populates="datasets")
+    for mapping, setting in zip(missing, settings):
+        mapping["scorecard_settings_id"] = setting["id"]
@@ -0,0 +1,151 @@
+"""The base class and mixins shared by all models, and helpers for inserting
+rows in bulk.
+"""
+from __future__ import unicode_literals
+from builtins import object
+from collections import OrderedDict
+from datetime import datetime
+
+from quizApp import db
+
+
+class Base(db.Model):
+    """Base class for all models.
+
+    All models have an identical id field.
+
+    Attributes:
+        id (int): A unique identifier.
+    """
+    __abstract__ = True
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    def save(self, commit=True):
+        """Save this model to the database.
+
+        If commit is True, then the session will be comitted as well.
+        """
+        db.session.add(self)
+
+        if commit:
+            db.session.commit()
+
+    @classmethod
+    def prepare_import_mappings(cls, mappings):
+        """Prepare rows imported from a spreadsheet or similar for bulk
+        insertion. Each mapping is a dictionary of column values that will be
+        inserted without instantiating this model, so anything the constructor
+        would set up must be done here instead. Subclasses of Base to which
+        this applies are expected to override this method.
+        """
+        pass
+
+
+class VersionMixin(object):
+    """Keeps track of changes to a model, so that anything rendered from it
+    can be cached until it changes.
+
+    Attributes:
+        version (int): Incremented by ``bump_version`` whenever this object
+            is changed
+        updated_at (datetime): When ``bump_version`` was last called, in UTC
+    """
+
+    version = db.Column(db.Integer, nullable=False, default=0,
+                        info={"export_include": False,
+                              "import_include": False})
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           info={"export_include": False,
+                                 "import_include": False})
+
+    def bump_version(self):
+        """Mark this object as changed, so that cached renders of it are no
+        longer used.
+        """
+        self.version = (self.version or 0) + 1
+        self.updated_at = datetime.utcnow()
+
+
+def get_id_increment():
+    """Return the difference between the ids the database gives to
+    consecutive rows of one multi-row INSERT, or None if they are not
+    guaranteed to be evenly spaced.
+
+    SQLite only has one writer at a time. MySQL reserves the ids of a
+    multi-row INSERT up front unless ``innodb_autoinc_lock_mode`` is 2.
+    """
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        return 1
+
+    if dialect == "mysql":
+        lock_mode, increment = db.session.execute(
+            "SELECT @@innodb_autoinc_lock_mode, "
+            "@@auto_increment_increment").first()
+        if lock_mode in (0, 1):
+            return increment
+
+    return None
+
+
+def group_mappings(mapper, mappings):
+    """Group dictionaries of attribute values of mapper by the columns they
+    give values for, so that each group can be inserted with one multi-row
+    INSERT.
+
+    Return a list of groups, each a list of pairs of a mapping and the column
+    values to insert for it.
+    """
+    pk_key = mapper.primary_key[0].key
+    column_keys = {prop.key: prop.columns[0].key
+                   for prop in mapper.column_attrs}
+
+    mappings_by_keys = OrderedDict()
+    for mapping in mappings:
+        # The id is given as NULL so that no row has an empty VALUES clause
+        values = {pk_key: None}
+        values.update((column_keys[key], value)
+                      for key, value in mapping.items() if value is not None)
+        mappings_by_keys.setdefault(frozenset(values), []).append(
+            (mapping, values))
+
+    return list(mappings_by_keys.values())
+
+
+def insert_mappings(mapper, mappings, return_defaults=False,
+                    batch_size=500):
+    """Insert dictionaries of attribute values into the table of mapper, like
+    ``bulk_insert_mappings``.
+
+    If return_defaults is True, the id of each new row is stored in its
+    mapping. ``bulk_insert_mappings`` does this by inserting rows one at a
+    time, so instead mappings with the same keys are inserted batch_size at a
+    time with one multi-row INSERT, and the ids of the rows are worked out
+    from the id the database reports for the statement. If the database does
+    not guarantee that these ids are evenly spaced, rows are inserted one at
+    a time after all.
+    """
+    increment = get_id_increment() if return_defaults else None
+
+    if increment is None:
+        db.session.bulk_insert_mappings(mapper, mappings,
+                                        return_defaults=return_defaults)
+        return
+
+    pk_key = mapper.primary_key[0].key
+    # SQLite reports the id of the last row, MySQL the id of the first
+    last_id_reported = db.session.get_bind().dialect.name == "sqlite"
+
+    for group in group_mappings(mapper, mappings):
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            first_id = db.session.execute(
+                mapper.local_table.insert().values(
+                    [values for _, values in batch])).lastrowid
+            if last_id_reported:
+                first_id -= (len(batch) - 1) * increment
+
+            for index, (mapping, _) in enumerate(batch):
+                mapping[pk_key] = first_id + index * increment
@@ -0,0 +1,402 @@
+"""Models for experiments and the assignments participants complete in them.
+"""
+from __future__ import unicode_literals
+from builtins import object
+import json
+import random
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.ext.orderinglist import ordering_list
+
+from quizApp import db
+from quizApp.models.base import Base, VersionMixin
+from quizApp.models.activities import ScorecardSettings, \
+    populate_scorecard_settings
+
+
+class AssignmentSet(Base):
+    """An AssignmentSet represents a sequence of Assignments within an
+    Experiment. All Assignments in an AssignmentSet are done in order by the
+    same Participant. A Participant has at most one AssignmentSet in each
+    Experiment.
+
+    Attributes:
+        progress (int): Which Assignment the user is currently working on.
+        complete (bool): True if the user has finalized their responses, False
+            otherwise
+        participant (Participant): Which Participant this refers to
+        experiment (Experiment): Which Experiment this refers to
+        assignments (list of Assignment): The assignments that this Participant
+            should do in this Experiment, in order. Each assignment's
+            ``position`` is its index in this list.
+        score (int): The cumulative score of all assignments before
+            ``progress``. This is kept up to date as assignments are answered,
+            see ``update_score``.
+        category_scores (str): A JSON object in string form that maps each
+            activity category to the cumulative score and number of
+            assignments of that category that are counted in ``score``, e.g.
+            ``{"maps": {"score": 3, "count": 2}}``.
+        claim_order (int): This set's place in its experiment's claim queue,
+            or None if it has not been queued. See
+            ``Experiment.shuffle_claim_queue``.
+    """
+    class Meta(object):
+        """Specify field order.
+        """
+        field_order = ('*', 'assignments')
+
+    __table_args__ = (
+        db.UniqueConstraint("experiment_id", "participant_id",
+                            name="uq_assignment_set_experiment_id_"
+                            "participant_id"),
+        db.Index("ix_assignment_set_experiment_id_complete",
+                 "experiment_id", "complete"),
+        db.Index("ix_assignment_set_experiment_id_claim_order",
+                 "experiment_id", "claim_order"),
+    )
+
+    progress = db.Column(db.Integer, nullable=False, default=0,
+                         info={"import_include": False})
+    complete = db.Column(db.Boolean, default=False,
+                         info={"import_include": False})
+    score = db.Column(db.Integer, nullable=False, default=0,
+                      info={"import_include": False})
+    category_scores = db.Column(db.Text, info={"import_include": False})
+
+    participant_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    participant = db.relationship("Participant",
+                                  back_populates="assignment_sets",
+                                  info={"import_include": False})
+
+    experiment_id = db.Column(db.Integer, db.ForeignKey('experiment.id'))
+    experiment = db.relationship("Experiment",
+                                 back_populates="assignment_sets")
+    claim_order = db.Column(db.Integer, info={"import_include": False})
+
+    assignments = db.relationship("Assignment",
+                                  back_populates="assignment_set",
+                                  order_by="Assignment.position",
+                                  collection_class=ordering_list(
+                                      "position", reorder_on_append=True))
+
+    def get_category_scores(self):
+        """Return ``category_scores`` as a dictionary.
+        """
+        if not self.category_scores:
+            return {}
+        return json.loads(self.category_scores)
+
+    def update_score(self, assignment, previous_score=None):
+        """Add the score of ``assignment`` to the running totals.
+
+        If ``previous_score`` is not None, then ``assignment`` has already
+        been counted with that score, so only the difference is applied.
+
+        This should be called in the same transaction that changes the result
+        of ``assignment``.
+        """
+        new_score = assignment.score or 0
+        category_scores = self.get_category_scores()
+        category = category_scores.setdefault(
+            assignment.activity.category or "",
+            {"score": 0, "count": 0})
+
+        if previous_score is None:
+            category["count"] += 1
+            delta = new_score
+        else:
+            delta = new_score - previous_score
+
+        category["score"] += delta
+        self.score = (self.score or 0) + delta
+        self.category_scores = json.dumps(category_scores)
+
+    def recompute_score(self):
+        """Recompute ``score`` and ``category_scores`` by iterating through
+        every assignment before ``progress``.
+
+        This is only necessary to repair existing rows, as ``update_score``
+        keeps these fields current.
+        """
+        self.score = 0
+        self.category_scores = None
+
+        for assignment in self.assignments[:self.progress]:
+            self.update_score(assignment)
+
+
+assignment_media_item_table = db.Table(
+    "assignment_media_item", db.metadata,
+    db.Column("assignment_id", db.Integer,
+              db.ForeignKey("assignment.id")),
+    db.Column("media_item_id", db.Integer, db.ForeignKey("media_item.id"))
+)
+
+
+class Assignment(Base):
+    """For a given Activity, determine which MediaItems, if any, a particular
+    Participant sees, as well as recording the Participant's answer, or if
+    they skipped this assignment.
+
+    Attributes:
+        comment (string): An optional comment entered by the student.
+        choice_order (string): A JSON object in string form that represents the
+            order of choices that this participant was presented with when
+            answering this question, e.g. {[1, 50, 9, 3]} where the numbers are
+            the IDs of those choices.
+        time_to_submit (timedelta): Time from the question being rendered to
+            the question being submitted.
+        media_items (list of MediaItem): What MediaItems should be shown
+        activity (Activity): Which Activity this Participant should see
+        assignment_set (AssignmentSet): Which AssignmentSet this Assignment
+            belongs to
+        position (int): The index of this Assignment in its AssignmentSet's
+            list of assignments. This is maintained by the list.
+    """
+    __table_args__ = (
+        db.Index("ix_assignment_assignment_set_id_position",
+                 "assignment_set_id", "position"),
+    )
+
+    comment = db.Column(db.String(500), info={"import_include": False})
+    choice_order = db.Column(db.String(80), info={"import_include": False})
+    time_to_submit = db.Column(db.Interval(), info={"import_include": False})
+
+    media_items = db.relationship("MediaItem",
+                                  secondary=assignment_media_item_table,
+                                  back_populates="assignments")
+
+    activity_id = db.Column(db.Integer, db.ForeignKey("activity.id"))
+    activity = db.relationship("Activity", back_populates="assignments")
+
+    result_id = db.Column(db.Integer, db.ForeignKey("result.id"))
+    result = db.relationship("Result", back_populates="assignment",
+                             info={"import_include": False}, uselist=False)
+
+    assignment_set_id = db.Column(
+        db.Integer,
+        db.ForeignKey("assignment_set.id"),
+    )
+    assignment_set = db.relationship("AssignmentSet",
+                                     info={"import_include": False},
+                                     back_populates="assignments")
+    position = db.Column(db.Integer, info={"import_include": False})
+
+    @property
+    def correct(self):
+        """Check if this assignment was answered correctly.
+        """
+        return self.activity.is_correct(self.result)
+
+    @property
+    def score(self):
+        """Get the score for this assignment.
+
+        This method simply passes `result` to the `activity`'s `get_score`
+        method and returns the result.
+
+        Note that if there is no `activity` this will raise an AttributeError.
+        """
+        return self.activity.get_score(self.result)
+
+    @db.validates("activity")
+    def validate_activity(self, _, activity):
+        """Make sure that the number of media items on the activity is the same as
+        the number of media items this assignment has.
+        """
+        try:
+            assert (activity.num_media_items == len(self.media_items)) or \
+                activity.num_media_items == -1
+        except AttributeError:
+            pass
+
+        return activity
+
+    @db.validates("result")
+    def validate_result(self, _, result):
+        """Make sure that this assignment has the correct type of result.
+        """
+        assert isinstance(result, self.activity.Meta.result_class)
+        return result
+
+
+class Experiment(Base, VersionMixin):
+    """An Experiment contains a list of Activities.
+
+    Attributes:
+        name (str): The name of this experiment
+        created (datetime): When this experiment was created
+        start (datetime): When this experiment becomes accessible for answers
+        stop (datetime): When this experiment stops accepting answers
+        assignment_sets (list of ParticiapntExperiment): List of
+            AssignmentSets that are associated with this Experiment
+        disable_previous (bool): If True, don't allow Participants to view and
+            modify previous activities.
+        show_timers (bool): If True, display a timer on each activity
+            expressing how long the user has been viewing this activity.
+        show_scores (bool): If True, show the participant a cumulative score on
+            every activity.
+        scorecard_settings (ScorecardSettings): A ScorecardSettings instance
+            that determines how scorecards will be rendered in this Experiment.
+
+            If the ``display_scorecard`` field is ``False``, then no scorecards
+            will be displayed.
+
+            If the ``display_scorecard`` field is ``True``, then scorecards
+            will be displayed after Activities whose own ``ScorecardSettings``
+            objects specify that scorecards should be shown. They will be
+            rendered according to the ``ScorecardSettings`` of that Activity.
+
+            In addition, a scorecard will be rendered after the experiment
+            according to the Experiment's ``ScorecardSettings``.
+        flash (bool): If True, flash the MediaItem for flash_duration
+            milliseconds
+        flash_duration (int): How long to display the MediaItem in milliseconds
+        stats (ExperimentStats): Running statistics about this Experiment
+        activity_stats (list of ActivityStats): Running statistics about each
+            Activity in this Experiment
+        claim_seed (int): The seed used to shuffle this Experiment's claim
+            queue, so that the order in which AssignmentSets are given out can
+            be reproduced.
+        claim_cursor (int): The ``claim_order`` of the next AssignmentSet to
+            give out.
+        version (int): Incremented whenever this Experiment's settings are
+            changed, see ``VersionMixin``
+    """
+
+    name = db.Column(db.String(150), nullable=False, info={"label": "Name"})
+    created = db.Column(db.DateTime)
+    start = db.Column(db.DateTime, nullable=False, info={"label": "Start"})
+    stop = db.Column(db.DateTime, nullable=False, info={"label": "Stop"})
+    blurb = db.Column(db.Text, info={"label": "Blurb"})
+    show_scores = db.Column(db.Boolean,
+                            info={"label": ("Show score tally during the"
+                                            " experiment")})
+    flash = db.Column(db.Boolean,
+                      info={"label": "Flash MediaItems when displaying"})
+    flash_duration = db.Column(db.Integer, nullable=False, default=0,
+                               info={"label": "Flash duration (ms)"})
+    disable_previous = db.Column(db.Boolean,
+                                 info={"label": ("Don't let participants go "
+                                                 "back after submitting an "
+                                                 "activity")})
+    show_timers = db.Column(db.Boolean,
+                            info={"label": "Show timers on activities"})
+
+    assignment_sets = db.relationship("AssignmentSet",
+                                      back_populates="experiment")
+
+    scorecard_settings_id = db.Column(db.Integer,
+                                      db.ForeignKey("scorecard_settings.id"))
+    scorecard_settings = db.relationship("ScorecardSettings",
+                                         uselist=False)
+
+    stats = db.relationship("ExperimentStats", back_populates="experiment",
+                            uselist=False, cascade="all, delete-orphan",
+                            info={"export_include": False,
+                                  "import_include": False})
+    activity_stats = db.relationship("ActivityStats",
+                                     back_populates="experiment",
+                                     cascade="all, delete-orphan",
+                                     info={"export_include": False,
+                                           "import_include": False})
+
+    claim_seed = db.Column(db.Integer, info={"import_include": False})
+    claim_cursor = db.Column(db.Integer, nullable=False, default=0,
+                             info={"export_include": False,
+                                   "import_include": False})
+
+    def __init__(self, *args, **kwargs):
+        """Make sure to populate scorecard_settings, and create the
+        statistics up front, so that they never need to be inserted while
+        participants are submitting.
+        """
+        # The statistics models refer to assignments, so they are imported
+        # here rather than at the top of this module
+        from quizApp.models.stats import ExperimentStats
+
+        self.scorecard_settings = ScorecardSettings()
+        self.stats = ExperimentStats(num_finished=0)
+        super(Experiment, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def prepare_import_mappings(cls, mappings):
+        """Make sure to populate scorecard_settings.
+        """
+        populate_scorecard_settings(mappings)
+
+    @property
+    def running(self):
+        """Returns True if this experiment is currently running, otherwise
+        False.
+        """
+        now = datetime.now()
+        return now >= self.start and now <= self.stop
+
+    def shuffle_claim_queue(self, seed=None):
+        """Shuffle the unclaimed AssignmentSets in this experiment that are
+        not queued yet and add them to the end of the claim queue.
+
+        Participants are given AssignmentSets in ``claim_order``, so the
+        shuffle happens once here rather than on every claim. The sets are
+        shuffled with a random number generator seeded by ``claim_seed``,
+        which is set to ``seed`` if given, or picked at random if this
+        experiment has no seed yet. Shuffling the same sets with the same seed
+        always gives the same order.
+
+        Returns the number of AssignmentSets that were queued.
+        """
+        if seed is not None:
+            self.claim_seed = seed
+        elif self.claim_seed is None:
+            self.claim_seed = random.SystemRandom().randint(0, 2**31 - 1)
+
+        db.session.flush()
+        table = AssignmentSet.__table__
+        experiment_table = Experiment.__table__
+
+        set_ids = [row[0] for row in db.session.execute(
+            select([table.c.id]).
+            where(and_(table.c.experiment_id == self.id,
+                       table.c.participant_id.is_(None),
+                       table.c.claim_order.is_(None))).
+            order_by(table.c.id))]
+
+        if not set_ids:
+            return 0
+
+        last_order = db.session.execute(
+            select([func.max(table.c.claim_order)]).
+            where(table.c.experiment_id == self.id)).scalar()
+        cursor = db.session.execute(
+            select([experiment_table.c.claim_cursor]).
+            where(experiment_table.c.id == self.id)).scalar()
+        first_order = cursor
+        if last_order is not None:
+            first_order = max(last_order + 1, cursor)
+
+        random.Random(self.claim_seed).shuffle(set_ids)
+
+        db.session.execute(
+            table.update().
+            where(table.c.id == bindparam("set_id")).
+            values(claim_order=bindparam("new_claim_order")),
+            [{"set_id": set_id, "new_claim_order": first_order + index}
+             for index, set_id in enumerate(set_ids)])
+
+        return len(set_ids)
+
+    @classmethod
+    def shuffle_claim_queues(cls):
+        """Call ``shuffle_claim_queue`` on every experiment that has unclaimed
+        AssignmentSets that are not queued, e.g. after an import.
+        """
+        table = AssignmentSet.__table__
+        experiment_ids = select([table.c.experiment_id]).\
+            where(and_(table.c.participant_id.is_(None),
+                       table.c.claim_order.is_(None))).\
+            distinct()
+
+        for experiment in cls.query.filter(cls.id.in_(experiment_ids)):
+            experiment.shuffle_claim_queue()
@@ -0,0 +1,56 @@
+"""The model of jobs run in the background by the job queue.
+"""
+from __future__ import unicode_literals
+import json
+from datetime import datetime
+
+from quizApp import db
+from quizApp.models.base import Base
+
+
+class Job(Base):
+    """A Job is a long running operation, such as an import or an export, that
+    is run in the background by the job queue.
+
+    Attributes:
+        type (str): What kind of job this is, which determines what handler
+            runs it
+        status (str): One of queued, running, finished, or failed
+        progress (float): How much of this job is done, from 0 to 1
+        args (str): A JSON object of arguments for the handler
+        result (str): A JSON object describing the outcome of this job
+        output_path (str): The path of the file this job produced, if any
+        output_name (str): The file name to use when downloading the output
+        traceback (str): If this job failed, the traceback of the exception
+        created (datetime): When this job was submitted
+        started (datetime): When this job started running
+        finished (datetime): When this job finished or failed
+        heartbeat (datetime): When the process this job is queued or running
+            in last showed it was alive
+    """
+    type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    progress = db.Column(db.Float, nullable=False, default=0)
+    args = db.Column(db.Text)
+    result = db.Column(db.Text)
+    output_path = db.Column(db.String(255))
+    output_name = db.Column(db.String(255))
+    traceback = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.now)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    heartbeat = db.Column(db.DateTime)
+
+    def get_args(self):
+        """Return ``args`` as a dictionary.
+        """
+        if not self.args:
+            return {}
+        return json.loads(self.args)
+
+    def get_result(self):
+        """Return ``result`` as a dictionary.
+        """
+        if not self.result:
+            return {}
+        return json.loads(self.result)
@@ -0,0 +1,113 @@
+"""Models for media items and the datasets they belong to.
+"""
+from __future__ import unicode_literals
+import os
+
+from flask import current_app
+
+from quizApp import db
+from quizApp.models.base import Base, VersionMixin
+from quizApp.models.activities import question_dataset_table
+from quizApp.models.experiments import assignment_media_item_table
+
+
+class MediaItem(Base, VersionMixin):
+    """A MediaItem is any aid to be shown when displaying an assignment. It can
+    be text, image, videos, sound, whatever. Specific types should subclass
+    this class and define their own fields needed for rendering.
+
+    Attributes:
+        name (str): Name for this Media Item
+        assignments (list of Assignment): Which Assignments display this
+            MediaItem
+        dataset (Dataset): Which Dataset owns this MediaItem
+        version (int): Incremented whenever this MediaItem is changed, see
+            ``VersionMixin``
+    """
+
+    assignments = db.relationship(
+        "Assignment",
+        secondary=assignment_media_item_table,
+        back_populates="media_items")
+    dataset = db.relationship("Dataset", back_populates="media_items")
+    dataset_id = db.Column(db.Integer, db.ForeignKey("dataset.id"))
+    type = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(100), nullable=False,
+                     info={"label": "Name"},
+                     default="New media item")
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'media_item',
+        'polymorphic_on': type
+    }
+
+
+class Graph(MediaItem):
+    """A Graph is an image file located on the server that may be shown in
+    conjunction with an Assignment.
+
+    Attributes:
+        path (str): Absolute path to this Graph on disk
+        display_path (str): Absolute path to the copy of this Graph that is
+            shown to participants, or None if it was not uploaded through the
+            asset pipeline, see ``quizApp.assets``
+        thumbnail_path (str): Absolute path to a thumbnail of this Graph, or
+            None if it was not uploaded through the asset pipeline
+    """
+
+    path = db.Column(db.String(200), nullable=False)
+    display_path = db.Column(db.String(200))
+    thumbnail_path = db.Column(db.String(200))
+
+    def filename(self):
+        """Return the filename of this graph.
+        """
+        return os.path.basename(self.path)
+
+    @property
+    def directory(self):
+        """Return the directory this graph is located in.
+
+        If ``path`` is not empty, return the lowest directory specified by
+        ``path``. Otherwise, return the designated graph directory.
+        """
+        current_directory = os.path.split(self.path)[0]
+        if current_directory:
+            return current_directory
+        return os.path.join(current_app.static_folder,
+                            current_app.config.get("GRAPH_DIRECTORY"))
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'graph'
+    }
+
+
+class Text(MediaItem):
+    """Text is simply a piece of text that can be used as a MediaItem.
+
+    Attributes:
+        text (str): The text of this media item.
+    """
+
+    text = db.Column(db.Text, info={"label": "Text"})
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'text'
+    }
+
+
+class Dataset(Base):
+    """A Dataset represents some data that MediaItems are based on.
+
+    Attributes:
+        name (string): The name of this dataset.
+        info (string): Some information about this dataset
+        media_items (list of MediaItem): Which MediaItems this Dataset owns
+        questions (list of Questions): Which Questions reference this Dataset
+    """
+    name = db.Column(db.String(100), nullable=False, info={"label": "Name"})
+    info = db.Column(db.Text, info={"label": "Info"})
+
+    media_items = db.relationship("MediaItem", back_populates="dataset")
+    questions = db.relationship("Question", secondary=question_dataset_table,
+                                back_populates="datasets")
@@ -0,0 +1,221 @@
+"""Models for running statistics about experiments, so that results can be
+shown without scanning every assignment.
+"""
+from __future__ import unicode_literals
+import bisect
+import json
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from quizApp import db
+from quizApp.models.base import Base
+from quizApp.models.experiments import Assignment, AssignmentSet
+
+
+TIME_TO_SUBMIT_BUCKETS = [1, 2, 5, 10, 30, 60, 120, 300, 600]
+"""list of int: Upper bounds, in seconds, of the buckets in time to submit
+histograms. The last bucket of a histogram counts every time above the last
+bound.
+"""
+
+
+def get_or_create_row(query, create, lock=False):
+    """Return the row found by query, calling create to make it if there
+    isn't one.
+
+    If lock is True, lock the row until the end of the transaction so
+    concurrent updates are not lost.
+
+    A missing row is inserted before it is locked, in a savepoint: a locking
+    read of a row that doesn't exist only locks the gap where it would go,
+    and two transactions holding the same gap deadlock when both insert. If
+    another transaction inserts the row first, our insert fails on a unique
+    constraint once they commit, and their row is used instead.
+    """
+    row = query.first()
+
+    if not row:
+        savepoint = db.session.begin_nested()
+        try:
+            row = create()
+            db.session.add(row)
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()
+            row = None
+
+    if lock or not row:
+        row = query.with_for_update().populate_existing().first()
+
+    return row
+
+
+class ExperimentStats(Base):
+    """Running statistics about an Experiment, so that results can be shown
+    without scanning every Assignment.
+
+    These are updated as participants submit assignments and finalize
+    assignment sets. Use ``rebuild`` to recompute them from scratch.
+
+    Attributes:
+        num_finished (int): How many AssignmentSets have been finalized
+        experiment (Experiment): Which Experiment these statistics describe
+    """
+    num_finished = db.Column(db.Integer, nullable=False, default=0)
+
+    experiment_id = db.Column(db.Integer, db.ForeignKey("experiment.id"),
+                              nullable=False, unique=True)
+    experiment = db.relationship("Experiment", back_populates="stats")
+
+    @classmethod
+    def get_or_create(cls, experiment, lock=False):
+        """Return the statistics for ``experiment``, creating them if they do
+        not exist.
+
+        If ``lock`` is True, lock the row until the end of the transaction so
+        concurrent updates are not lost.
+        """
+        return get_or_create_row(
+            cls.query.filter_by(experiment_id=experiment.id),
+            lambda: cls(experiment=experiment, num_finished=0),
+            lock)
+
+    @classmethod
+    def rebuild(cls, experiment):
+        """Discard the statistics for ``experiment`` and recompute them from
+        its AssignmentSets and Assignments.
+
+        The ExperimentStats row is kept, or created, and locked until the end
+        of the transaction, so concurrent rebuilds of the same experiment run
+        one after the other.
+        """
+        stats = cls.get_or_create(experiment, lock=True)
+        ActivityStats.query.filter_by(experiment_id=experiment.id).\
+            delete(synchronize_session=False)
+        db.session.expire(experiment, ["stats", "activity_stats"])
+
+        stats.num_finished = AssignmentSet.query.\
+            filter_by(experiment_id=experiment.id).\
+            filter_by(complete=True).count()
+
+        activity_stats = {}
+        assignments = Assignment.query.\
+            join(Assignment.assignment_set).\
+            filter(AssignmentSet.experiment_id == experiment.id).\
+            filter(Assignment.result_id.isnot(None)).\
+            options(joinedload(Assignment.activity),
+                    joinedload(Assignment.result)).\
+            yield_per(1000)
+
+        for assignment in assignments:
+            activity = assignment.activity
+            if activity.id not in activity_stats:
+                activity_stats[activity.id] = ActivityStats.get_or_create(
+                    experiment, activity)
+            activity_stats[activity.id].record(assignment)
+
+        return stats
+
+
+class ActivityStats(Base):
+    """Running statistics about the responses to an Activity in an
+    Experiment.
+
+    Attributes:
+        num_responses (int): How many Assignments of this Activity have a
+            Result
+        num_correct (int): How many of those Results are correct
+        score_total (int): The sum of the scores of those Results
+        num_timed (int): How many of those Assignments have a time to submit
+        time_to_submit_total (float): The sum of those times, in seconds
+        time_to_submit_histogram (str): A JSON list in string form that
+            counts how many times to submit fall in each bucket of
+            ``TIME_TO_SUBMIT_BUCKETS``
+        experiment (Experiment): Which Experiment these statistics describe
+        activity (Activity): Which Activity these statistics describe
+    """
+    num_responses = db.Column(db.Integer, nullable=False, default=0)
+    num_correct = db.Column(db.Integer, nullable=False, default=0)
+    score_total = db.Column(db.Integer, nullable=False, default=0)
+    num_timed = db.Column(db.Integer, nullable=False, default=0)
+    time_to_submit_total = db.Column(db.Float, nullable=False, default=0)
+    time_to_submit_histogram = db.Column(db.Text)
+
+    experiment_id = db.Column(db.Integer, db.ForeignKey("experiment.id"),
+                              nullable=False)
+    experiment = db.relationship("Experiment",
+                                 back_populates="activity_stats")
+
+    activity_id = db.Column(db.Integer, db.ForeignKey("activity.id"),
+                            nullable=False)
+    activity = db.relationship("Activity", back_populates="stats")
+
+    __table_args__ = (
+        db.UniqueConstraint("experiment_id", "activity_id"),
+    )
+
+    @classmethod
+    def get_or_create(cls, experiment, activity, lock=False):
+        """Return the statistics for ``activity`` in ``experiment``, creating
+        them if they do not exist.
+
+        If ``lock`` is True, lock the row until the end of the transaction so
+        concurrent updates are not lost.
+        """
+        return get_or_create_row(
+            cls.query.filter_by(experiment_id=experiment.id,
+                                activity_id=activity.id),
+            lambda: cls(experiment=experiment, activity=activity,
+                        num_responses=0, num_correct=0, score_total=0,
+                        num_timed=0, time_to_submit_total=0),
+            lock)
+
+    def get_time_to_submit_histogram(self):
+        """Return ``time_to_submit_histogram`` as a list.
+        """
+        if not self.time_to_submit_histogram:
+            return [0] * (len(TIME_TO_SUBMIT_BUCKETS) + 1)
+        return json.loads(self.time_to_submit_histogram)
+
+    def record(self, assignment, sign=1):
+        """Add the response in ``assignment`` to these statistics.
+
+        If ``sign`` is -1, remove it instead. When a participant changes their
+        response, the old response should be removed before the Assignment is
+        changed and the new one recorded afterwards.
+
+        Assignments without a Result are ignored.
+        """
+        if not assignment.result:
+            return
+
+        self.num_responses += sign
+        self.num_correct += sign * int(bool(assignment.correct))
+        self.score_total += sign * (assignment.score or 0)
+
+        if assignment.time_to_submit is not None:
+            seconds = assignment.time_to_submit.total_seconds()
+            histogram = self.get_time_to_submit_histogram()
+            histogram[bisect.bisect_left(TIME_TO_SUBMIT_BUCKETS,
+                                         seconds)] += sign
+
+            self.num_timed += sign
+            self.time_to_submit_total += sign * seconds
+            self.time_to_submit_histogram = json.dumps(histogram)
+
+    @property
+    def mean_score(self):
+        """The mean score of the responses, or None if there are none.
+        """
+        if not self.num_responses:
+            return None
+        return self.score_total / float(self.num_responses)
+
+    @property
+    def mean_time_to_submit(self):
+        """The mean time to submit in seconds, or None if there are none.
+        """
+        if not self.num_timed:
+            return None
+        return self.time_to_submit_total / self.num_timed
@@ -0,0 +1,133 @@
+"""Models for users and their roles.
+"""
+from __future__ import unicode_literals
+import uuid
+
+from flask_security import UserMixin, RoleMixin
+from sqlalchemy import literal, select
+
+from quizApp import db
+from quizApp.models.base import Base
+
+
+UNUSABLE_PASSWORD = ""
+"""str: The password of users who never log in with one, such as
+participants that are registered automatically. It is not a valid hash, so
+no password matches it, and Flask-Security refuses to log in users whose
+password is empty.
+"""
+
+
+roles_users = db.Table('roles_users',
+                       db.Column('user_id', db.Integer(),
+                                 db.ForeignKey('user.id')),
+                       db.Column('role_id', db.Integer(),
+                                 db.ForeignKey('role.id')))
+
+
+class Role(Base, RoleMixin):
+    """A Role describes what a User can and can't do.
+    """
+    name = db.Column(db.String(80), unique=True)
+    description = db.Column(db.String(255))
+
+
+class User(Base, UserMixin):
+    """A User is used for authentication.
+
+    Attributes:
+        name (string): The username of this user.
+        password (string): This user's password.
+        authenticated (bool): True if this user is authenticated.
+        type (string): The type of this user, e.g. experimenter, participant
+    """
+
+    email = db.Column(db.String(255), unique=True)
+    active = db.Column(db.Boolean())
+    password = db.Column(db.String(255), nullable=False)
+    confirmed_at = db.Column(db.DateTime())
+    roles = db.relationship("Role", secondary=roles_users,
+                            backref=db.backref('users', lazy='dynamic'))
+
+    type = db.Column(db.String(50), nullable=False)
+
+    def has_any_role(self, roles):
+        """Given a list of Roles, return True if the user has at least one of
+        them.
+        """
+        return any(self.has_role(role) for role in roles)
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'user',
+        'polymorphic_on': type
+    }
+
+
+participant_dataset_table = db.Table(
+    "participant_dataset", db.metadata,
+    db.Column('participant_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('dataset_id', db.Integer, db.ForeignKey('dataset.id'))
+)
+
+
+class Participant(User):
+    """A User that takes Experiments.
+
+    Attributes:
+        opt_in (bool): Has this user opted in to data collection?
+        foreign_id (str): If the user is coming from an external source (e.g.
+            canvas, mechanical turk) it may be necessary to record their user
+            ID on the other service (e.g. preventing multiple submission). This
+            field holds the foreign ID of this user.
+        assignment_sets (list of AssignmentSets): List of AssignmentSets that
+            this participant has
+        provisioned (bool): If True, this participant was created in advance
+            by ``provision`` and has not been given to anyone yet.
+    """
+
+    opt_in = db.Column(db.Boolean)
+    foreign_id = db.Column(db.String(100))
+    provisioned = db.Column(db.Boolean, default=False, index=True,
+                            info={"import_include": False})
+
+    assignment_sets = db.relationship("AssignmentSet",
+                                      back_populates="participant")
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'participant',
+    }
+
+    @classmethod
+    def provision(cls, count, batch_size=500):
+        """Create count active participants that can't log in with a
+        password, to be claimed when participants register.
+
+        Participants are inserted in batches of batch_size with one statement
+        each, along with their participant role, and no password is hashed,
+        so large pools can be created quickly ahead of time. Each is given a
+        placeholder email, which is replaced when they are claimed.
+        """
+        table = cls.__table__
+        role = Role.query.filter_by(name="participant").first()
+
+        if not role:
+            role = Role(name="participant")
+            db.session.add(role)
+            db.session.flush()
+
+        for batch_start in range(0, count, batch_size):
+            emails = ["provisioned-" + uuid.uuid4().hex for _ in
+                      range(min(batch_size, count - batch_start))]
+
+            db.session.execute(
+                table.insert(),
+                [{"email": email, "password": UNUSABLE_PASSWORD,
+                  "active": True, "type": "participant", "provisioned": True}
+                 for email in emails])
+            db.session.execute(
+                roles_users.insert().from_select(
+                    ["user_id", "role_id"],
+                    select([table.c.id, literal(role.id)]).
+                    where(table.c.email.in_(emails))))
+
+        db.session.commit()
@@ -0,0 +1,279 @@
+"""Functions for building the results report of an experiment, which breaks
+down how every participant did, as an XLSX workbook or a CSV file.
+
+Rows are produced one participant at a time, so that large experiments can be
+exported without loading every assignment at once.
+"""
+from collections import defaultdict, Counter
+import csv
+
+from future.utils import PY2, text_type
+import openpyxl
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, subqueryload
+
+from quizApp import db
+from quizApp.models import Activity, Assignment, AssignmentSet
+
+RESULTS_BATCH_SIZE = 100
+
+
+def get_activity_column_index(activity, activity_column_mapping,
+                              activity_counter):
+    """Find the column index for this occurrence of the given activity and
+    update the counter.
+    """
+    activity_occurrence = activity_counter[activity.id]
+    activity_counter[activity.id] += 1
+    return activity_column_mapping[activity.id][activity_occurrence]
+
+
+def assignment_to_cells(assignment):
+    """Given an assignment, convert it into a 4-cell block for use in a
+    spreadsheet.
+    """
+    media_items = ",".join([str(mi.id) for mi
+                            in assignment.media_items])
+    if not assignment.result:
+        row = ["_BLANK_"] * 4 + [media_items]
+    else:
+        row = ["{}:{}".format(assignment.id, assignment.result),
+               assignment.correct,
+               assignment.score,
+               assignment.comment,
+               media_items]
+    return row
+
+
+def get_results_layout(experiment):
+    """Determine the columns of the results report before any rows are
+    written.
+
+    The same activity can appear multiple times in an assignment set. To
+    display them properly, we keep a list of their ocurrences in
+    activity_column_mapping, like so:
+    {1: [3, 8, 13], ...} means activity 1 occurs in columns 3, 8, and 13
+    When populating a row, we will use the earliest occurrence of the
+    activity possible.
+
+    The number of columns an activity needs is the largest number of times it
+    occurs in any one assignment set, which is found with a single aggregate
+    query. Activities are laid out in order of their IDs.
+
+    Returns a tuple of the headers and the activity column mapping.
+    """
+    headers = ["User email", "User ID"]
+    activity_column_mapping = {}
+
+    occurrences = db.session.query(
+        Assignment.activity_id.label("activity_id"),
+        func.count(Assignment.id).label("occurrences")).\
+        join(Assignment.assignment_set).\
+        filter(AssignmentSet.experiment_id == experiment.id).\
+        filter(AssignmentSet.participant_id.isnot(None)).\
+        filter(Assignment.activity_id.isnot(None)).\
+        group_by(Assignment.assignment_set_id, Assignment.activity_id).\
+        subquery()
+
+    max_occurrences = db.session.query(
+        occurrences.c.activity_id,
+        func.max(occurrences.c.occurrences)).\
+        group_by(occurrences.c.activity_id).\
+        order_by(occurrences.c.activity_id).all()
+
+    if not max_occurrences:
+        return headers, activity_column_mapping
+
+    activities = {a.id: a for a in Activity.query.filter(
+        Activity.id.in_([a[0] for a in max_occurrences]))}
+
+    for activity_id, num_occurrences in max_occurrences:
+        activity = activities[activity_id]
+        activity_column_mapping[activity_id] = []
+
+        for _ in range(0, num_occurrences):
+            activity_column_mapping[activity_id].append(len(headers) + 1)
+            headers.append("{}: {}".format(activity.id, activity))
+            headers.append("Correct?")
+            headers.append("Points")
+            headers.append("Comments")
+            headers.append("Media items")
+
+    return headers, activity_column_mapping
+
+
+def iter_assignment_sets_with_assignments(experiment):
+    """Iterate over every assignment set in this experiment that has a
+    participant, ordered by participant.
+
+    Assignment sets are read in batches of ``RESULTS_BATCH_SIZE``, and the
+    assignments of each batch are loaded at once. Yields tuples of an
+    assignment set and its list of assignments.
+    """
+    assignment_sets = AssignmentSet.query.\
+        filter_by(experiment_id=experiment.id).\
+        filter(AssignmentSet.participant_id.isnot(None)).\
+        options(joinedload(AssignmentSet.participant)).\
+        order_by(AssignmentSet.participant_id, AssignmentSet.id).\
+        yield_per(RESULTS_BATCH_SIZE)
+
+    batch = []
+    for assignment_set in assignment_sets:
+        batch.append(assignment_set)
+
+        if len(batch) == RESULTS_BATCH_SIZE:
+            for item in load_assignment_set_batch(batch):
+                yield item
+            batch = []
+
+    for item in load_assignment_set_batch(batch):
+        yield item
+
+
+def load_assignment_set_batch(assignment_sets):
+    """Load the assignments of every assignment set in ``assignment_sets``,
+    along with their activities, results, and media items. Return a list of
+    tuples of each assignment set and its assignments.
+    """
+    if not assignment_sets:
+        return []
+
+    assignments = Assignment.query.\
+        filter(Assignment.assignment_set_id.in_(
+            [s.id for s in assignment_sets])).\
+        options(joinedload(Assignment.activity),
+                joinedload(Assignment.result),
+                subqueryload(Assignment.media_items)).\
+        order_by(Assignment.assignment_set_id, Assignment.position)
+
+    set_assignments = defaultdict(list)
+    for assignment in assignments:
+        set_assignments[assignment.assignment_set_id].append(assignment)
+
+    return [(s, set_assignments[s.id]) for s in assignment_sets]
+
+
+def iter_results_rows(experiment):
+    """Yield the rows of the results report for this experiment, one
+    participant at a time. The first row is the header row.
+
+    The column layout is computed by ``get_results_layout`` before any rows
+    are produced, so rows can be written out as soon as they are yielded.
+    """
+    headers, activity_column_mapping = get_results_layout(experiment)
+    # Specify experiment ID in the last column
+    yield headers + ["Experiment ID"]
+
+    empty = True
+    for row in iter_participant_rows(experiment, headers,
+                                     activity_column_mapping):
+        if empty:
+            row[-1] = experiment.id
+            empty = False
+        yield row
+
+    if empty:
+        yield [None] * len(headers) + [experiment.id]
+
+
+def iter_participant_rows(experiment, headers, activity_column_mapping):
+    """Given the layout of the results report, yield one row for every
+    participant in this experiment.
+
+    Since the layout is fixed ahead of time, each row only depends on that
+    participant's assignment sets.
+    """
+    row = None
+    participant_id = None
+
+    for assignment_set, assignments in \
+            iter_assignment_sets_with_assignments(experiment):
+        participant = assignment_set.participant
+
+        # Encountered a new participant
+        if participant.id != participant_id:
+            if row:
+                yield row
+            participant_id = participant.id
+            row = [None] * (len(headers) + 1)
+            populate_row_segment(row, 1, [participant.email, participant.id])
+
+        activity_counter = Counter()
+        for assignment in assignments:
+            if not assignment.activity:
+                continue
+
+            activity_column_index = get_activity_column_index(
+                assignment.activity,
+                activity_column_mapping,
+                activity_counter)
+
+            populate_row_segment(row, activity_column_index,
+                                 assignment_to_cells(assignment))
+
+    if row:
+        yield row
+
+
+def get_results_workbook(experiment, rows=None):
+    """Analyze the assignment sets in the experiment and return a write only
+    excel workbook.
+
+    If rows is given, it is used instead of ``iter_results_rows``.
+    """
+    if rows is None:
+        rows = iter_results_rows(experiment)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(
+        title="Experiment {} - Report".format(experiment.id))
+
+    for row in rows:
+        sheet.append(row)
+
+    return workbook
+
+
+class CSVLineBuffer(object):
+    """A file-like object that returns what is written to it, so that a
+    ``csv.writer`` can be used to produce lines one at a time.
+    """
+    @staticmethod
+    def write(line):
+        """Return ``line`` instead of storing it.
+        """
+        return line
+
+
+def iter_results_csv(rows):
+    """Yield the rows of a results report as lines of CSV.
+
+    On Python 2 the csv module only handles byte strings, so text cells are
+    encoded as UTF-8 first.
+    """
+    writer = csv.writer(CSVLineBuffer())
+
+    for row in rows:
+        if PY2:
+            row = [cell.encode("utf-8") if isinstance(cell, text_type)
+                   else cell for cell in row]
+        yield writer.writerow(row)
+
+
+def write_results_csv(rows, file_name):
+    """Write the rows of a results report to a CSV file, one line at a time.
+    """
+    with open(file_name, "wb") as csv_file:
+        for line in iter_results_csv(rows):
+            if not isinstance(line, bytes):
+                line = line.encode("utf-8")
+            csv_file.write(line)
+
+
+def populate_row_segment(row, initial_col, cells):
+    """Populate the segment of the list ``row`` that starts at column
+    ``initial_col`` with the items in ``cells``. As in openpyxl, columns are
+    1-indexed.
+    """
+    for col_offset, cell in enumerate(cells):
+        row[initial_col + col_offset - 1] = cell
@@ -7,7 +7,8 @@ $(document).ready(function() {
       clear_errors(this);
       if(data.success) {
           $error_container.addClass("hidden")
-          save_message.text("Data uploaded successfully!");
+          save_message.html("Data uploaded successfully! <a href=\"" +
+            data.job_url + "\">Follow the import's progress.</a>");
           save_message.removeClass();
           save_message.addClass("text-success");
           $(this).find(".error-block").remove();
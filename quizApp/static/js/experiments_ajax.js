@@ -10,6 +10,33 @@ function question_submit_done(data) {
   }
 }
 
+/* Hide a media item flash_duration milliseconds after its images have
+ * loaded, so that the time spent downloading them is not taken out of the
+ * time they are shown for.
+ */
+function flash_media_item(media_item, flash_duration) {
+  var images = media_item.find("img").filter(function() {
+    return !this.complete;
+  });
+  var remaining = images.length;
+
+  function hide() {
+    media_item.delay(flash_duration).delay().hide(1);
+  }
+
+  if(remaining == 0) {
+    hide();
+    return;
+  }
+
+  images.one("load error", function() {
+    remaining -= 1;
+    if(remaining == 0) {
+      hide();
+    }
+  });
+}
+
 $(document).ready(function() {
   form_ajax("#create-experiment-form", done_redirect);
   form_ajax("#update-experiment-form", done_highlight, pre_callback_message);
@@ -25,7 +52,7 @@ $(document).ready(function() {
     var media_item = $(media_items[i]);
     var flash_duration = parseInt(media_item.data("flash-duration"))
     if(flash_duration > -1) {
-      media_item.delay(flash_duration).delay().hide(1);
+      flash_media_item(media_item, flash_duration);
     }
   }
   
@@ -0,0 +1,30 @@
+$(document).ready(function() {
+  var $job = $("#job");
+
+  function update_job() {
+    $.get($job.data("status-url"), function(data) {
+      $("#job-status").text(data.status);
+      $("#job-progress").css("width", Math.round(data.progress * 100) + "%");
+
+      if(data.status == "finished") {
+        var $result = $("#job-result").empty();
+        $.each(data.result, function(key, value) {
+          $result.append($("<dt>").text(key), $("<dd>").text(value));
+        });
+        if(data.download_url) {
+          $("#job-download").removeClass("hidden");
+        }
+      } else if(data.status == "failed") {
+        $("#job-traceback").text(data.traceback);
+        $("#job-error").removeClass("hidden");
+      } else {
+        setTimeout(update_job, 1000);
+      }
+    });
+  }
+
+  var status = $("#job-status").text();
+  if(status != "finished" && status != "failed") {
+    update_job();
+  }
+});
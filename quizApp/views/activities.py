@@ -6,9 +6,11 @@ function (for example, questions are read by read_question rather than
 read_activity itself).
 """
 from collections import defaultdict, OrderedDict
+import re
 
 from flask import Blueprint, render_template, url_for, jsonify, abort, request
 from flask_security import roles_required
+from markupsafe import escape
 
 from quizApp.models import Activity, Dataset, Question, Choice
 from quizApp.forms.experiments import get_answer_form
@@ -16,6 +18,7 @@ from quizApp.forms.activities import DatasetListForm,\
     ChoiceForm, get_activity_form
 from quizApp.forms.common import DeleteObjectForm, ObjectTypeForm
 from quizApp import db
+from quizApp.cache import fragment_cache
 from quizApp.views.helpers import validate_model_id
 from quizApp.views.common import ObjectCollectionView, ObjectView
 
@@ -34,6 +37,11 @@ ACTIVITY_ROUTE = "/<int:activity_id>"
 CHOICES_ROUTE = "/<int:question_id>/choices/"
 CHOICE_ROUTE = CHOICES_ROUTE + "<int:choice_id>"
 
+DISABLED_MARKER = "quizapp-fragment-disabled"
+CHOICE_INPUT_RE = re.compile(r'<input ([^>]*name="choices"[^>]*)>')
+INTEGER_INPUT_RE = re.compile(
+    r'(<input [^>]*name="integer"[^>]*)value=""([^>]*>)')
+
 
 class ActivityCollectionView(ObjectCollectionView):
     """View for the activity collection.
@@ -76,6 +84,13 @@ class ActivityView(ObjectView):
     def collection_url(self, **_):
         return url_for("activities.activities")
 
+    def put(self, activity):
+        """Update this activity, and give it a new version so that it is no
+        longer served from the fragment cache.
+        """
+        activity.bump_version()
+        return super(ActivityView, self).put(activity=activity)
+
     def get(self, activity):
         rendered_activity = render_activity(activity, False)
         return render_template("activities/read_activity.html",
@@ -148,6 +163,10 @@ def render_question(question, disabled=False, assignment=None,
                     render_explanation=True):
     """Display a given question as it would appear to a participant.
 
+    The question is rendered without any answers once per version and kept in
+    the fragment cache. The participant's answers and the disabled flag are
+    then spliced into the cached skeleton.
+
     Arguments:
         question (Question): The question to render
         disabled (bool): if True, disable the form controls
@@ -156,11 +175,27 @@ def render_question(question, disabled=False, assignment=None,
         render_explanation (bool): If True, render the explanation for this
             question
     """
-    form = get_answer_form(question)
-    form.populate_from_activity(question)
+    key = "activity:{}:{}:{}".format(question.id, question.version or 0,
+                                     int(render_explanation))
+    skeleton = fragment_cache.get_or_render(
+        key, lambda: render_question_skeleton(question, render_explanation))
 
+    form = get_answer_form(question)
     if assignment:
-        form.populate_from_assignment(assignment)
+        if assignment.result:
+            form.populate_from_result(assignment.result)
+        form.comment.data = assignment.comment
+
+    return fill_question_skeleton(skeleton, form, disabled)
+
+
+def render_question_skeleton(question, render_explanation):
+    """Render a question with no answers filled in. Form controls are given
+    ``DISABLED_MARKER`` as their disabled attribute, to be replaced by
+    ``fill_question_skeleton``.
+    """
+    form = get_answer_form(question)
+    form.populate_from_activity(question)
 
     template_mapping = {
         "question_mc_singleselect": "activities/render_mc_question.html",
@@ -171,10 +206,56 @@ def render_question(question, disabled=False, assignment=None,
     }
 
     return render_template(template_mapping[question.type],
-                           question=question, form=form, disabled=disabled,
+                           question=question, form=form,
+                           disabled=DISABLED_MARKER,
                            render_explanation=render_explanation)
 
 
+def fill_question_skeleton(skeleton, form, disabled):
+    """Given a skeleton rendered by ``render_question_skeleton`` and an answer
+    form holding a participant's answers, return the skeleton with the answers
+    filled in and the form controls disabled if necessary.
+    """
+    fragment = skeleton.replace(
+        ' disabled="{}"'.format(DISABLED_MARKER),
+        " disabled" if disabled else "")
+
+    if "choices" in form and form.choices.data:
+        selected = form.choices.data
+        if not isinstance(selected, list):
+            selected = [selected]
+        selected = set(str(choice_id) for choice_id in selected)
+
+        def check_choice(match):
+            """Check the choice input in match if it was selected.
+            """
+            value = re.search(r'value="([^"]*)"', match.group(1)).group(1)
+            if value in selected:
+                return "<input checked " + match.group(1) + ">"
+            return match.group(0)
+
+        fragment = CHOICE_INPUT_RE.sub(check_choice, fragment)
+
+    if "integer" in form and form.integer.data is not None:
+        fragment = INTEGER_INPUT_RE.sub(
+            lambda match: "".join([match.group(1), 'value="',
+                                   escape(form.integer.data), '"',
+                                   match.group(2)]),
+            fragment, count=1)
+
+    for name in ["text", "comment"]:
+        if name in form and form[name].data:
+            fragment = re.sub(
+                r'(<textarea [^>]*name="{}"[^>]*>\s*)(</textarea>)'.
+                format(name),
+                lambda match, name=name: "".join([
+                    match.group(1), escape(form[name].data),
+                    match.group(2)]),
+                fragment, count=1)
+
+    return fragment
+
+
 @activities.route(ACTIVITY_ROUTE + "/settings", methods=["GET"])
 @roles_required("experimenter")
 def settings_activity(activity_id):
@@ -317,6 +398,7 @@ class ChoiceCollectionView(ObjectCollectionView):
 
         create_form.populate_obj(choice)
         question.choices.append(choice)
+        question.bump_version()
 
         choice.save()
         db.session.commit()
@@ -349,6 +431,19 @@ class ChoiceView(ObjectView):
     def update_form(self, **_):
         return ChoiceForm(request.form, prefix="update")
 
+    def put(self, question, choice):
+        """Update this choice and bump the version of its question.
+        """
+        question.bump_version()
+        return super(ChoiceView, self).put(question=question, choice=choice)
+
+    def delete(self, question, choice):
+        """Delete this choice and bump the version of its question.
+        """
+        question.bump_version()
+        return super(ChoiceView, self).delete(question=question,
+                                              choice=choice)
+
 
 activities.add_url_rule(CHOICE_ROUTE,
                         view_func=ChoiceView.as_view('choice'))
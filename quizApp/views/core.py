@@ -1,16 +1,14 @@
 """This blueprint takes care of rendering static pages outside of the other
 blueprints.
 """
-import random
 import uuid
-import string
 
 from flask import Blueprint, render_template, redirect, url_for, request
 from flask_security import roles_required, login_required, current_user,\
     login_user
-from flask_security.utils import encrypt_password
 
-from quizApp import models, db, security
+from quizApp import models, db
+from quizApp.views.helpers import register_participant
 
 core = Blueprint("core", __name__, url_prefix="/")
 
@@ -72,15 +70,8 @@ def auto_register():
     experiment.
     """
     if not current_user.is_authenticated:
-        password = ''.join(random.SystemRandom().
-                           choice(string.ascii_uppercase + string.digits)
-                           for _ in range(0, 15))
-        participant = models.Participant(
-            email=str(uuid.uuid4()),  # just give them a random email
-            password=encrypt_password(password))
-        security.datastore.add_role_to_user(participant, "participant")
-        security.datastore.activate_user(participant)
-        participant.save()
+        # just give them a random email
+        participant = register_participant(str(uuid.uuid4()))
         login_user(participant)
 
     return redirect(url_for("experiments.experiment",
@@ -7,28 +7,28 @@ When generating a template for imports, we include exclude columns that have
 import_include: False in their info attributes.
 
 When importing from a spreadsheet, we will process every column (regardless of
-info attribute). However, in some cases certain columns need to be filled out
-earlier than others. This is why we use a special method on each model to
-populate an object.
+info attribute). The rows of each sheet are imported by the importer module.
 """
 
 from collections import OrderedDict, defaultdict
+from operator import attrgetter
 import os
 import tempfile
-import traceback
+import time
 
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, redirect, url_for
 from flask import send_file, jsonify
 from flask_security import roles_required
-import markupsafe
 import openpyxl
 from sqlalchemy import inspect
 from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOMANY
 from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 
 from quizApp import db
+from quizApp import importer
 from quizApp import models
 from quizApp.forms.data import ImportDataForm
+from quizApp.jobs import job_queue
 
 
 SHEET_NAME_MAPPING = OrderedDict([
@@ -44,24 +44,33 @@ SHEET_NAME_MAPPING = OrderedDict([
 
 data = Blueprint("data", __name__, url_prefix="/data")
 
+EXPORT_PLANS = {}
 
-def export_to_workbook():
+
+def export_to_workbook(report_progress=None):
     """Retrieve elements from thed database and save them to a workbook.
     Return the filename of the workbook.
 
     When we export to a workbook, we export almost everything. To prevent
     a field from being exported, add `"export_include": False` to a field's
     `info` dictionary.
+
+    If report_progress is given, it is called with the fraction of sheets
+    written after each sheet.
     """
 
-    workbook = openpyxl.Workbook()
-    workbook.remove_sheet(workbook.active)
+    workbook = openpyxl.Workbook(write_only=True)
 
-    for sheet_name, model in SHEET_NAME_MAPPING.items():
-        current_sheet = workbook.create_sheet()
-        current_sheet.title = sheet_name
-        sheet_data = object_list_to_sheet(model.query.all())
-        write_list_to_sheet(sheet_data, current_sheet)
+    for index, (sheet_name, model) in enumerate(SHEET_NAME_MAPPING.items()):
+        current_sheet = workbook.create_sheet(title=sheet_name)
+        sheet_data = object_list_to_sheet(model.query.all(),
+                                          get_model_related_ids(model))
+
+        for row in sheet_data:
+            current_sheet.append(row)
+
+        if report_progress:
+            report_progress(float(index + 1) / len(SHEET_NAME_MAPPING))
 
     file_name = tempfile.mkstemp(".xlsx")
     os.close(file_name[0])
@@ -148,33 +157,120 @@ def write_list_to_sheet(data_list, sheet):
             sheet.cell(row=r, column=c).value = data_list[r - 1][c - 1]
 
 
-def relationship_to_string(field, value):
-    """Given a relationship, convert it to a comma separated list of integers.
+def collection_to_string(value):
+    """Given a collection, convert it to a comma separated list of ids.
+    """
+    return ",".join([str(obj.id) for obj in value])
+
+
+def object_to_string(value):
+    """Given an object or None, convert it to its id as a string.
     """
-    ids = []
-    direction = field.property.direction
-    if direction in (MANYTOMANY, ONETOMANY) and field.property.uselist:
-        for obj in value:
-            ids.append(str(obj.id))
-        return ",".join(ids)
-    elif value:
+    if value:
         return str(value.id)
     return ""
 
 
-def field_to_string(obj, column):
-    """Given an object and a column name, convert the contents
-    of the column to a string. If it is a collection, return a
-    comma separated list of ids.
+def foreign_key_to_string(value):
+    """Given a foreign key or None, convert it to a string.
+    """
+    if value is None:
+        return ""
+    return str(value)
+
+
+def get_export_plan(model):
+    """Given a model, return a tuple with one entry per field that should be
+    exported, in the order given by get_field_order.
+
+    Each entry is a tuple of:
+
+    - The field's header
+    - A function that retrieves the field's value from an object
+    - A function that converts the value to a string, or None if the value can
+      be exported as is
+    - If the field is a relationship whose ids are stored on the other side,
+      the relationship property, otherwise None. The ids of these
+      relationships can be retrieved ahead of time using get_related_ids.
+
+    Many to one relationships are exported by reading their foreign key, so
+    that the related object does not have to be loaded.
+
+    Inspecting models is expensive, so plans are computed once per model
+    (including each polymorphism) and cached in EXPORT_PLANS.
     """
-    model = type(obj)
-    value = getattr(obj, column)
-    field_attrs = inspect(model).attrs[column]
+    try:
+        return EXPORT_PLANS[model]
+    except KeyError:
+        pass
+
+    mapper = inspect(model)
+    plan = []
+
+    for column, prop in get_field_order(model):
+        if not include_column(model, column, prop, "export_include"):
+            continue
+
+        header = header_from_property(prop)
+
+        if not isinstance(prop, RelationshipProperty):
+            plan.append((header, attrgetter(column), None, None))
+        elif prop.direction in (MANYTOMANY, ONETOMANY):
+            serializer = collection_to_string if prop.uselist \
+                else object_to_string
+            plan.append((header, attrgetter(column), serializer, prop))
+        else:
+            local_column = prop.local_remote_pairs[0][0]
+            foreign_key = mapper.get_property_by_column(local_column).key
+            plan.append((header, attrgetter(foreign_key),
+                         foreign_key_to_string, None))
+
+    EXPORT_PLANS[model] = tuple(plan)
+    return EXPORT_PLANS[model]
 
-    if isinstance(field_attrs, RelationshipProperty):
-        value = relationship_to_string(getattr(model, column), value)
 
-    return value
+def get_related_ids(prop):
+    """Given a one to many or many to many relationship, return a dictionary
+    that maps the id of every object to a list of the ids of its related
+    objects, as strings.
+
+    This takes one query, on the association table for many to many
+    relationships or on the related table for one to many relationships.
+    """
+    if prop.direction == MANYTOMANY:
+        local_column = prop.synchronize_pairs[0][1]
+        remote_column = prop.secondary_synchronize_pairs[0][1]
+        query = db.session.query(local_column, remote_column).\
+            order_by(local_column, remote_column)
+    else:
+        local_column = prop.local_remote_pairs[0][1]
+        remote_column = prop.mapper.primary_key[0]
+        order_by = prop.order_by or [remote_column]
+        query = db.session.query(local_column, remote_column).\
+            order_by(*order_by)
+
+    related_ids = defaultdict(list)
+    for obj_id, related_id in query.filter(local_column.isnot(None)):
+        related_ids[obj_id].append(str(related_id))
+
+    return related_ids
+
+
+def get_model_related_ids(model):
+    """Given a model, retrieve the related ids of every one to many and many
+    to many relationship that is exported by it or its polymorphisms.
+
+    Returns a dictionary mapping each relationship property to the result of
+    get_related_ids.
+    """
+    related_ids = {}
+
+    for mapper in inspect(model).self_and_descendants:
+        for _, _, _, prop in get_export_plan(mapper.class_):
+            if prop is not None and prop not in related_ids:
+                related_ids[prop] = get_related_ids(prop)
+
+    return related_ids
 
 
 def get_field_order(model):
@@ -205,166 +301,160 @@ def get_field_order(model):
     return ordered_fields
 
 
-def object_list_to_sheet(object_list):
+def object_list_to_sheet(object_list, related_ids=None):
     """Given a list of objects, iterate over all of them and create a list
     of lists that can be written using write_list_to_sheet.
 
     The first row returned will be a header row. All fields will be included
     unless a field contains export_include: False in its info attibute.
-    """
-    sheet = [[]]
-    for obj in object_list:
-        row = [""] * len(sheet[0])
-
-        ordered_fields = get_field_order(type(obj))
-
-        for column, prop in ordered_fields:
-            include = include_column(type(obj), column, prop, "export_include")
 
-            if not include:
-                continue
-
-            column_name = header_from_property(prop)
-
-            if column_name not in sheet[0]:
-                sheet[0].append(column_name)
-                row.append("")
+    If related_ids is given, as returned by get_model_related_ids, the ids of
+    relationships are looked up there instead of loading each object's
+    collections.
+    """
+    related_ids = related_ids or {}
+    headers = []
+    header_indices = {}
+    model_indices = {}
+    sheet = [headers]
 
-            index = sheet[0].index(column_name)
+    for obj in object_list:
+        model = type(obj)
+        plan = get_export_plan(model)
 
-            row[index] = field_to_string(obj, column)
-        sheet.append(row)
+        try:
+            indices = model_indices[model]
+        except KeyError:
+            # First object of this type - find where its fields go, adding any
+            # headers we have not seen yet
+            for header, _, _, _ in plan:
+                if header not in header_indices:
+                    header_indices[header] = len(headers)
+                    headers.append(header)
+            indices = tuple(header_indices[plan_entry[0]]
+                            for plan_entry in plan)
+            model_indices[model] = indices
+
+        sheet.append(object_to_row(obj, plan, indices, len(headers),
+                                   related_ids))
     return sheet
 
 
-def populate_field(obj, field_name, value, pk_mapping, args):
-    """Populate a field on a certain object based on the value from an imported
-    spreadsheet. The field on obj will not be set, rather args will be
-    populated with the field's name and its value for use with the model's
-    import_dict method.
-
-    This may involve doing a database lookup if the field in question is a
-    relationship field.
-
-    A note on pk_mapping:
+def object_to_row(obj, plan, indices, num_columns, related_ids):
+    """Given an object and its export plan, return a row of num_columns cells
+    with the value of each field of the plan at the matching index in
+    indices.
 
-    To avoid conflicts between imported PK and existing PK, we do not
-    assign PK's based on user input. However we have to store them
-    because other rows in the user input may be referencing a certain PK. So
-    we store them in a kind of bastard mini-database in memory while we
-    are importing data.
-
-    Arguments:
-        obj - The object whose fields need populating.
-        field_name - A string containing the name of the field that should be
-        populated.
-        value - The value of the field, as read from the spreadsheet.
-        pk_mapping - A mapping of any objects created in this import session
-        that value may refer to.
-        args - A dictionary to set the field and its value in.
+    The ids of relationships in related_ids are looked up there instead of
+    loading the object's collections.
     """
-    model = type(obj)
-    field_attrs = inspect(model).attrs[field_name]
-    field = getattr(model, field_name)
-
-    if isinstance(field_attrs, RelationshipProperty):
-        # This is a relationship
-        remote_model = field.property.mapper.class_
-        direction = field.property.direction
-        if direction in (MANYTOMANY, ONETOMANY):
-            args[field_name] = []
-            values = str(value).split(",")
-            for fk in values:
-                fk = int(float(fk))  # goddamn stupid excel
-                collection_item = get_object_from_id(remote_model, fk,
-                                                     pk_mapping)
-                args[field_name].append(collection_item)
+    row = [""] * num_columns
+
+    for index, (_, getter, serializer, prop) in zip(indices, plan):
+        if prop in related_ids:
+            row[index] = ",".join(related_ids[prop].get(obj.id, []))
         else:
-            value = int(float(value))  # goddamn stupid excel
-            collection_item = get_object_from_id(remote_model, value,
-                                                 pk_mapping)
-            args[field_name] = collection_item
-    elif field.primary_key:
-        pk = int(float(value))
-        pk_mapping[model.__tablename__][pk] = obj
-    elif isinstance(field_attrs, ColumnProperty):
-        args[field_name] = value
-
-
-def get_object_from_id(model, obj_id, pk_mapping):
-    """If the object of type model and id obj_id is in pk_mapping,
-    return it. Otherwise, query the database.
-    """
-    try:
-        obj = pk_mapping[model.__tablename__][obj_id]
-    except KeyError:
-        obj = model.query.get(obj_id)
-    if not obj:
-        raise ValueError("No such object {} with ID {}".
-                         format(model, obj_id))
-    return obj
+            value = getter(obj)
+            row[index] = serializer(value) if serializer else value
 
+    return row
 
-def instantiate_model(model, headers, row):
-    """Return an instance of a model, correctly handling polymorphism.
 
-    Since the actual object represented by a row may be different from another
-    in the same sheet, we need to take into account any possible polymorphisms.
+def import_data_from_workbook(workbook, report_progress=None):
+    """Given an excel workbook, read in the sheets and save them to the
+    database.
 
-    This method looks at the model to see if it has polymorphic identities. If
-    so, it returns an instance of the correct one. If not, it returns an
-    instance of the passed in model.
-    """
-    model_mapper = inspect(model).mapper
-    if not model_mapper.polymorphic_identity:
-        return model()
+    The workbook may also be a zip file of CSV files, as described in
+    importer.iter_sheet_rows.
 
-    polymorphic_index = headers.index(model_mapper.polymorphic_on.name)
-    polymorphic_type = row[polymorphic_index].value
-    return model_mapper.polymorphic_map[polymorphic_type].class_()
+    Each sheet is read as a stream and imported importer.IMPORT_BATCH_SIZE
+    rows at a time by importer.import_sheet: references to other objects are
+    checked with one query per related table, and new objects and their
+    associations are inserted without instantiating models. Nothing is
+    committed, so that the caller can roll back a failed import.
 
+    Afterwards, the imported rows are checked by importer.validate_import, any
+    new AssignmentSets are shuffled into the claim queues of their
+    experiments, and the statistics of every experiment that was
+    imported, or had assignment sets or assignments imported into it, are
+    rebuilt.
 
-def import_data_from_workbook(workbook):
-    """Given an excel workbook, read in the sheets and save them to the
-    database.
+    If report_progress is given, it is called with the fraction of sheets
+    imported after each sheet.
+
+    Returns a dictionary with the number of rows imported, how long the import
+    took in seconds, and the number of rows imported per second.
     """
     pk_mapping = defaultdict(dict)
+    num_rows = 0
+    start_time = time.time()
+
+    for index, (sheet_name, model) in enumerate(SHEET_NAME_MAPPING.items()):
+        if report_progress:
+            report_progress(float(index) / len(SHEET_NAME_MAPPING))
 
-    for sheet_name, model in SHEET_NAME_MAPPING.items():
         try:
-            sheet = workbook.get_sheet_by_name(sheet_name)
+            rows = importer.iter_sheet_rows(workbook, sheet_name)
         except KeyError:
             # This model is not present in the workbook
             continue
 
-        headers = [header_to_field_name(c.value, model) for c in sheet.rows[0]]
+        try:
+            header_row = next(rows)
+        except StopIteration:
+            continue
+
+        headers = [header_to_field_name(value, model) for value in header_row]
+
+        for batch in importer.iter_batches(rows, importer.IMPORT_BATCH_SIZE):
+            num_rows += importer.import_sheet(model, headers, batch,
+                                              pk_mapping)
+
+    importer.validate_import(pk_mapping)
+    models.Experiment.shuffle_claim_queues()
+
+    # Imported rows are inserted without going through the views that keep
+    # statistics up to date
+    for experiment in importer.get_imported_experiments(pk_mapping):
+        models.ExperimentStats.rebuild(experiment)
 
-        for row in sheet.rows[1:]:
-            obj = instantiate_model(model, headers, row)
-            obj_args = {}
+    seconds = time.time() - start_time
+    return {
+        "rows": num_rows,
+        "seconds": seconds,
+        "rows_per_second": num_rows / seconds if seconds else None,
+    }
 
-            for col_index, cell in enumerate(row):
-                if not cell.value or headers[col_index] is None:
-                    continue
-                populate_field(obj, headers[col_index],
-                               cell.value, pk_mapping, obj_args)
 
-            if obj_args:
-                obj.import_dict(**obj_args)
-                db.session.add(obj)
+@job_queue.handler("import")
+def import_job(args, report_progress):
+    """Import the uploaded file saved at the given path, then delete it.
+    """
+    try:
+        with open(args["path"], "rb") as import_file:
+            workbook = importer.open_import_file(import_file,
+                                                 args["file_name"])
+            return import_data_from_workbook(workbook, report_progress)
+    finally:
+        os.remove(args["path"])
 
-        db.session.commit()
+
+@job_queue.handler("export")
+def export_job(_, report_progress):
+    """Export the database to a workbook.
+    """
+    return {"output_path": export_to_workbook(report_progress),
+            "output_name": "quizapp_export.xlsx"}
 
 
 @data.route('/export')
 @roles_required("experimenter")
 def export_data():
-    """Send the user a breakddown of datasets, activities, etc. for use in
-    making assignments.
+    """Start exporting a breakddown of datasets, activities, etc. for use in
+    making assignments, and send the user to the job's page.
     """
-    file_name = export_to_workbook()
-    return send_file(file_name, as_attachment=True,
-                     attachment_filename="quizapp_export.xlsx")
+    job = job_queue.submit("export")
+    return redirect(url_for("jobs.read_job", job_id=job.id))
 
 
 @data.route('/import_template')
@@ -422,32 +512,28 @@ def import_template():
 @data.route('/import', methods=["POST"])
 @roles_required("experimenter")
 def import_data():
-    """Given an uploaded spreadsheet, import data from the spreadsheet
-    into the database.
+    """Given an uploaded spreadsheet, start importing data from the
+    spreadsheet into the database.
+
+    The upload is saved to a temporary file and imported by a job. If the
+    import fails, the traceback is stored on the job.
     """
     import_data_form = ImportDataForm()
 
     if not import_data_form.validate():
         return jsonify({"success": 0, "errors": import_data_form.errors})
 
-    workbook = openpyxl.load_workbook(import_data_form.data.data)
+    upload = import_data_form.data.data
+    file_handle, file_name = tempfile.mkstemp(
+        os.path.splitext(upload.filename)[1])
+    os.close(file_handle)
+    upload.save(file_name)
+
+    job = job_queue.submit("import", path=file_name,
+                           file_name=upload.filename)
 
-    try:
-        import_data_from_workbook(workbook)
-    except Exception:
-        # This isn't very nice, but we need a way to capture exceptions that
-        # happen during import and show them to the user. However, we also want
-        # to have the traceback for debugging purposes. So we print the
-        # traceback to stdout.
-        print(traceback.format_exc())
-        return jsonify({
-            "success": 0,
-            "errors": (markupsafe.Markup("<br>") +
-                       markupsafe.escape(traceback.format_exc()).
-                       replace("\n", markupsafe.Markup("<br>")))
-        })
-
-    return jsonify({"success": 1})
+    return jsonify({"success": 1, "job_id": job.id,
+                    "job_url": url_for("jobs.read_job", job_id=job.id)})
 
 
 @data.route('/manage', methods=["GET"])
@@ -1,16 +1,23 @@
 """Views for CRUD datasets.
 """
+from datetime import datetime
+from zlib import adler32
+import mimetypes
 import os
 
-from werkzeug.datastructures import CombinedMultiDict
+from werkzeug.datastructures import CombinedMultiDict, ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 from flask import Blueprint, render_template, url_for, abort, \
-    request
+    request, current_app, safe_join
 from flask_security import roles_required
 
+from quizApp.assets import CACHE_SECONDS
+from quizApp.filters import invalidate_graph_url
 from quizApp.forms.common import DeleteObjectForm, ObjectTypeForm
 from quizApp.forms.datasets import DatasetForm, GraphForm, TextForm
 from quizApp.models import Dataset, MediaItem
-from quizApp.views.helpers import validate_model_id
+from quizApp.views.helpers import validate_model_id, conditional_response
 from quizApp.views.common import ObjectCollectionView, ObjectView
 
 datasets = Blueprint("datasets", __name__, url_prefix="/datasets")
@@ -95,6 +102,28 @@ class MediaItemView(ObjectView):
 
         return {"dataset": dataset, "media_item": media_item}
 
+    def get(self, **kwargs):
+        """Render this media item, or return a 304 if the client has the
+        current version.
+        """
+        media_item = kwargs["media_item"]
+        return conditional_response(
+            [media_item.id, media_item.version],
+            lambda: super(MediaItemView, self).get(**kwargs))
+
+    def put(self, **kwargs):
+        """Update this media item and bump its version.
+        """
+        kwargs["media_item"].bump_version()
+        return super(MediaItemView, self).put(**kwargs)
+
+    def delete(self, **kwargs):
+        """Delete this media item, forgetting its cached URL if it is a graph.
+        """
+        if kwargs["media_item"].type == "graph":
+            invalidate_graph_url(kwargs["media_item"])
+        return super(MediaItemView, self).delete(**kwargs)
+
 
 datasets.add_url_rule(MEDIA_ITEM_ROUTE,
                       view_func=MediaItemView.as_view('media_item'))
@@ -184,3 +213,151 @@ def settings_media_item(dataset_id, media_item_id):
         dataset=dataset,
         create_media_item_form=create_media_item_form,
         media_item=media_item)
+
+
+@datasets.route("/graphs/<filename>", methods=["GET"])
+def read_graph_file(filename):
+    """Serve a variant of a graph from the graph directory.
+
+    Variants are stored under a hash of their contents, so they never change
+    and clients may cache them forever.
+    """
+    directory = os.path.join(current_app.static_folder,
+                             current_app.config["GRAPH_DIRECTORY"])
+    return send_media_file(safe_join(directory, filename), immutable=True)
+
+
+@datasets.route("/media_items/<int:media_item_id>/file", methods=["GET"])
+def read_media_item_file(media_item_id):
+    """Serve the file of a media item, if it has one.
+
+    Only files in the graph directory are served, whatever the path of the
+    graph is, so that a path like ``/etc/passwd`` can't be used to download
+    files from elsewhere.
+
+    If the ``v`` argument is the media item's current version, as in the URLs
+    made by ``get_graph_url``, clients may cache the file for
+    ``MEDIA_FILE_MAX_AGE`` seconds. Otherwise they must revalidate it every
+    time.
+    """
+    media_item = validate_model_id(MediaItem, media_item_id)
+
+    if media_item.type != "graph":
+        abort(404)
+
+    max_age = None
+    if request.args.get("v", type=int) == (media_item.version or 0):
+        max_age = current_app.config["MEDIA_FILE_MAX_AGE"]
+
+    directory = os.path.join(current_app.static_folder,
+                             current_app.config["GRAPH_DIRECTORY"])
+    return send_media_file(safe_join(directory, media_item.filename()),
+                           max_age=max_age)
+
+
+def send_media_file(path, immutable=False, max_age=None):
+    """Serve the file at path, so that it doesn't have to pass through
+    Python if possible.
+
+    If the ``MEDIA_SENDFILE_HEADER`` config option is ``X-Sendfile`` or
+    ``X-Accel-Redirect``, the web server is told to send the file itself. For
+    ``X-Accel-Redirect``, the path is given relative to
+    ``MEDIA_ACCEL_REDIRECT_ROOT`` (by default the static folder) and appended
+    to ``MEDIA_ACCEL_REDIRECT_PREFIX``, which should be an internal location
+    of the web server.
+
+    Otherwise, conditional requests are answered with a 304 and requests for
+    a single range of bytes with a 206. Whole files are handed to the WSGI
+    server's file wrapper, which can use ``sendfile``.
+
+    If immutable is True, clients are told they may cache the file forever,
+    and if max_age is given, for that many seconds. Otherwise they must
+    revalidate it every time.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = "{}-{}-{}".format(int(stat.st_mtime), stat.st_size,
+                             adler32(path.encode("utf-8")) & 0xffffffff)
+    last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+    sendfile_header = current_app.config["MEDIA_SENDFILE_HEADER"]
+
+    response = current_app.response_class(mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Accept-Ranges"] = "bytes"
+    if immutable:
+        response.headers["Cache-Control"] = \
+            "public, max-age={}, immutable".format(CACHE_SECONDS)
+    elif max_age:
+        response.headers["Cache-Control"] = \
+            "public, max-age={}".format(max_age)
+    else:
+        response.headers["Cache-Control"] = "public, no-cache"
+
+    if not is_resource_modified(request.environ, etag,
+                                last_modified=last_modified):
+        response.status_code = 304
+        return response
+
+    if sendfile_header == "X-Sendfile":
+        response.headers["X-Sendfile"] = path
+        return response
+
+    if sendfile_header == "X-Accel-Redirect":
+        root = current_app.config["MEDIA_ACCEL_REDIRECT_ROOT"] or \
+            current_app.static_folder
+        response.headers["X-Accel-Redirect"] = \
+            current_app.config["MEDIA_ACCEL_REDIRECT_PREFIX"] + \
+            os.path.relpath(path, root).replace(os.sep, "/")
+        return response
+
+    # If-Range asks for the whole file if it has changed since the client
+    # fetched the first part
+    byte_range = None
+    if request.range and len(request.range.ranges) == 1 and \
+            ("If-Range" not in request.headers or
+             request.if_range.etag == etag or
+             request.if_range.date == last_modified):
+        byte_range = request.range.range_for_length(stat.st_size)
+
+        if byte_range is None:
+            response.status_code = 416
+            response.content_range = ContentRange("bytes", None, None,
+                                                  stat.st_size)
+            return response
+
+    media_file = open(path, "rb")
+
+    if byte_range:
+        start, stop = byte_range
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", start, stop,
+                                              stat.st_size)
+        response.content_length = stop - start
+        response.response = iter_file_range(media_file, start, stop - start)
+    else:
+        response.content_length = stat.st_size
+        response.response = wrap_file(request.environ, media_file)
+
+    response.direct_passthrough = True
+    return response
+
+
+def iter_file_range(media_file, start, length, chunk_size=8192):
+    """Yield length bytes of media_file starting at start, then close it.
+    """
+    try:
+        media_file.seek(start)
+
+        while length > 0:
+            data = media_file.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        media_file.close()
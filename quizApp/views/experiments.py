@@ -1,25 +1,32 @@
 """Views that handle CRUD for experiments and rendering questions for
 participants.
 """
-from collections import defaultdict, Counter
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 import json
 import os
 import tempfile
 
-import openpyxl
 import dateutil.parser
 from flask import Blueprint, render_template, url_for, jsonify, abort, \
-    request, session, send_file
+    request, session, redirect, current_app
 from flask_security import login_required, current_user, roles_required
+from sqlalchemy import and_, func, distinct
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from quizApp import db
+from quizApp import results
+from quizApp.filters import get_graph_url_filter
 from quizApp.forms.experiments import CreateExperimentForm, \
     get_answer_form
+from quizApp.jobs import job_queue, iter_with_progress
 from quizApp.views.common import ObjectCollectionView, ObjectView
 from quizApp.models import Experiment, Assignment, \
-    AssignmentSet, Participant
-from quizApp.views.helpers import validate_model_id, get_first_assignment
+    AssignmentSet, Participant, Activity, Question, Choice, ExperimentStats, \
+    ActivityStats
+from quizApp.views.helpers import validate_model_id, get_first_assignment, \
+    conditional_response
 from quizApp.views.activities import render_activity
 from quizApp.views.mturk import submit_assignment
 
@@ -56,17 +63,77 @@ def validate_assignment_set(experiment_id, assignment_set_id):
 def validate_assignment(experiment_id, assignment_set_id, assignment_id):
     """Do everything ``validate_assignment_set`` does, but also check that the
     assignment exists and that it's part of the given assignment set.
+
+    The assignment set is retrieved using ``load_assignment_set``, so
+    everything needed to render or submit the assignment is already loaded.
     """
-    experiment, assignment_set = validate_assignment_set(experiment_id,
-                                                         assignment_set_id)
-    assignment = validate_model_id(Assignment, assignment_id)
+    experiment = validate_model_id(Experiment, experiment_id)
+    assignment_set = load_assignment_set(assignment_set_id)
+
+    if not assignment_set:
+        abort(404)
 
-    if assignment.assignment_set != assignment_set:
+    if assignment_set.experiment != experiment:
+        abort(404)
+
+    if assignment_set.participant != current_user:
+        abort(403)
+
+    # The assignments of the set are already in the session, so this does
+    # not need a query
+    assignment = Assignment.query.get(assignment_id)
+
+    if not assignment or assignment.assignment_set_id != assignment_set.id:
         abort(404)
 
     return (experiment, assignment_set, assignment)
 
 
+def load_assignment_set(assignment_set_id):
+    """Retrieve an assignment set along with its assignments and everything
+    that is needed to display them: activities, choices, scorecard settings,
+    results, and media items.
+
+    This takes a fixed number of queries, regardless of how many assignments
+    are in the set. Returns None if there is no such assignment set.
+    """
+    assignment_set = AssignmentSet.query.options(
+        joinedload(AssignmentSet.experiment).
+        joinedload(Experiment.stats),
+        subqueryload(AssignmentSet.assignments).
+        joinedload(Assignment.activity).
+        joinedload(Activity.scorecard_settings),
+        subqueryload(AssignmentSet.assignments).
+        joinedload(Assignment.result),
+        subqueryload(AssignmentSet.assignments).
+        subqueryload(Assignment.media_items),
+    ).get(assignment_set_id)
+
+    if not assignment_set:
+        return None
+
+    # Choices are only defined on questions, so they are loaded separately
+    questions = {a.activity.id: a.activity
+                 for a in assignment_set.assignments
+                 if isinstance(a.activity, Question) and
+                 "choices" not in a.activity.__dict__}
+
+    if questions:
+        question_choices = defaultdict(list)
+        choices = Choice.query.\
+            filter(Choice.question_id.in_(questions.keys())).\
+            order_by(Choice.id)
+
+        for choice in choices:
+            question_choices[choice.question_id].append(choice)
+
+        for question_id, question in questions.items():
+            set_committed_value(question, "choices",
+                                question_choices[question_id])
+
+    return assignment_set
+
+
 class ExperimentCollectionView(ObjectCollectionView):
     """View for a collection of Experiments.
     """
@@ -135,9 +202,18 @@ class ExperimentView(ObjectView):
         else:
             assignment = None
 
+        preload_urls = []
+        if assignment:
+            # Start fetching the media items of the first assignments while
+            # the participant reads the landing page
+            preload_urls = get_preload_urls(experiment,
+                                            assignment.assignment_set,
+                                            assignment.position - 1)
+
         return render_template("experiments/read_experiment.html",
                                experiment=experiment,
-                               assignment=assignment)
+                               assignment=assignment,
+                               preload_urls=preload_urls)
 
     def delete(self, **kwargs):
         if current_user.has_role("experimenter"):
@@ -146,6 +222,7 @@ class ExperimentView(ObjectView):
 
     def put(self, **kwargs):
         if current_user.has_role("experimenter"):
+            kwargs["experiment"].bump_version()
             return super(ExperimentView, self).put(**kwargs)
         abort(403)
 
@@ -169,8 +246,7 @@ def read_assignment(experiment_id, assignment_set_id, assignment_id):
         abort(400)
 
     if experiment.disable_previous and assignment_set.progress > \
-            assignment_set.assignments.index(assignment) and \
-            not assignment_set.complete:
+            assignment.position and not assignment_set.complete:
         abort(400)
 
     activity = assignment.activity
@@ -184,7 +260,70 @@ def read_assignment(experiment_id, assignment_set_id, assignment_id):
         "scorecard": read_scorecard,
     }
 
-    return read_function_mapping[activity.type](experiment, assignment)
+    etag_parts = get_assignment_version(experiment, assignment)
+
+    return conditional_response(
+        etag_parts,
+        lambda: read_function_mapping[activity.type](experiment, assignment))
+
+
+def get_assignment_version(experiment, assignment):
+    """Return a list of everything the page showing this assignment depends
+    on, for use in its ETag.
+    """
+    assignment_set = assignment.assignment_set
+    activity = assignment.activity
+    versioned = [experiment, activity] + list(assignment.media_items) + \
+        get_preload_media_items(experiment, assignment_set,
+                                assignment.position)
+
+    etag_parts = [
+        [(type(obj).__name__, obj.id, obj.version) for obj in versioned],
+        assignment.id,
+        assignment.result_id,
+        assignment.comment,
+        assignment_set.progress,
+        assignment_set.complete,
+        assignment_set.score,
+    ]
+
+    if activity.type == "scorecard":
+        # Scorecards show the results of the previous assignments
+        etag_parts.append([a.result_id for a in
+                           assignment_set.assignments[:assignment.position]])
+
+    return etag_parts
+
+
+def get_preload_media_items(experiment, assignment_set, position):
+    """Return the graphs shown in the ``MEDIA_PRELOAD_COUNT`` assignments
+    after the one at position.
+
+    If the experiment flashes its media items, any time spent downloading a
+    graph is taken out of the time it is shown for, so graphs are fetched
+    before the participant gets to them. Otherwise, or if the assignment set
+    is complete and nothing is flashed, nothing is preloaded.
+    """
+    if not experiment.flash or assignment_set.complete:
+        return []
+
+    start = max(position + 1, 0)
+    stop = start + current_app.config["MEDIA_PRELOAD_COUNT"]
+    media_items = []
+
+    for assignment in assignment_set.assignments[start:stop]:
+        for media_item in assignment.media_items:
+            if media_item.type == "graph" and media_item not in media_items:
+                media_items.append(media_item)
+
+    return media_items
+
+
+def get_preload_urls(experiment, assignment_set, position):
+    """Return the URLs of the graphs returned by ``get_preload_media_items``.
+    """
+    return [get_graph_url_filter(media_item) for media_item in
+            get_preload_media_items(experiment, assignment_set, position)]
 
 
 def read_scorecard(experiment, assignment):
@@ -195,7 +334,7 @@ def read_scorecard(experiment, assignment):
     scorecard_form.populate_from_assignment(assignment)
 
     assignment_set = assignment.assignment_set
-    this_index = assignment_set.assignments.index(assignment)
+    this_index = assignment.position
 
     next_url = get_next_assignment_url(assignment_set, this_index)
 
@@ -233,7 +372,7 @@ def read_question(experiment, assignment):
     question_form.populate_from_assignment(assignment)
 
     assignment_set = assignment.assignment_set
-    this_index = assignment_set.assignments.index(assignment)
+    this_index = assignment.position
 
     if assignment.result:
         question_form.populate_from_result(assignment.result)
@@ -262,6 +401,8 @@ def read_question(experiment, assignment):
         "experiment_complete": assignment_set.complete,
         "previous_assignment": previous_assignment,
         "rendered_question": rendered_question,
+        "preload_urls": get_preload_urls(experiment, assignment_set,
+                                         this_index),
     }
 
     # This mapping is for further processing of certain question types, if
@@ -307,7 +448,7 @@ def update_assignment(experiment_id, assignment_set_id, assignment_id):
         abort(400)
 
     if experiment.disable_previous and assignment_set.progress > \
-            assignment_set.assignments.index(assignment):
+            assignment.position:
         abort(400)
 
     activity_form = get_answer_form(assignment.activity, request.form)
@@ -316,14 +457,34 @@ def update_assignment(experiment_id, assignment_set_id, assignment_id):
     if not activity_form.validate():
         return jsonify({"success": 0, "errors": activity_form.errors})
 
+    this_index = assignment.position
+
+    # If this assignment is already counted in the running score, remember
+    # what it was worth so only the difference is applied
+    previous_score = None
+    if this_index < assignment_set.progress:
+        previous_score = assignment.score or 0
+
+    # Replace this assignment's previous response, if any, in the statistics.
+    # Experiments from before statistics were kept have none until they are
+    # rebuilt, which counts every response.
+    activity_stats = None
+    if experiment.stats:
+        activity_stats = ActivityStats.get_or_create(experiment,
+                                                     assignment.activity,
+                                                     lock=True)
+        activity_stats.record(assignment, -1)
+
     activity_form.populate_assignment(assignment)
 
-    this_index = assignment_set.assignments.index(assignment)
     next_url = get_next_assignment_url(assignment_set, this_index)
 
     if this_index == assignment_set.progress:
         assignment_set.progress += 1
 
+    if this_index < assignment_set.progress:
+        assignment_set.update_score(assignment, previous_score)
+
     # Record time to solve
     if activity_form.render_time.data and activity_form.submit_time.data:
         render_datetime = dateutil.parser.parse(activity_form.render_time.data)
@@ -331,6 +492,9 @@ def update_assignment(experiment_id, assignment_set_id, assignment_id):
         time_to_submit = submit_datetime - render_datetime
         assignment.time_to_submit = time_to_submit
 
+    if activity_stats:
+        activity_stats.record(assignment)
+
     db.session.commit()
 
     if assignment.activity.scorecard_settings.display_scorecard:
@@ -390,20 +554,76 @@ def settings_experiment(experiment_id):
                            update_experiment_form=update_experiment_form)
 
 
-def get_question_stats(assignment, question_stats):
-    """Given an assignment of a question and a stats array, return statistics
-    about this question in the array.
+def get_question_stats(experiment):
+    """Retrieve statistics about every question in this experiment.
+
+    Returns an ordered mapping of question IDs to dictionaries containing the
+    question text, number of responses, number of correct responses, mean
+    score, mean time to submit in seconds, and a histogram of times to
+    submit. Questions nobody has answered yet have no responses.
     """
-    question = assignment.activity
-    if question.id not in question_stats:
+    experiment_activity_ids = db.session.query(Assignment.activity_id).\
+        join(Assignment.assignment_set).\
+        filter(AssignmentSet.experiment_id == experiment.id)
+
+    questions = db.session.query(Activity, ActivityStats).\
+        outerjoin(ActivityStats,
+                  and_(ActivityStats.activity_id == Activity.id,
+                       ActivityStats.experiment_id == experiment.id)).\
+        filter(Activity.id.in_(experiment_activity_ids)).\
+        filter(Activity.type.like("question%")).\
+        order_by(Activity.id)
+
+    question_stats = OrderedDict()
+    for question, stats in questions:
+        if not stats:
+            stats = ActivityStats(num_responses=0, num_correct=0,
+                                  score_total=0, num_timed=0,
+                                  time_to_submit_total=0)
+
         question_stats[question.id] = {
-            "num_responses": 0,
-            "num_correct": 0,
             "question_text": question.question,
+            "num_responses": stats.num_responses,
+            "num_correct": stats.num_correct,
+            "mean_score": stats.mean_score,
+            "mean_time_to_submit": stats.mean_time_to_submit,
+            "time_to_submit_histogram":
+            stats.get_time_to_submit_histogram(),
         }
 
-    if assignment.result:
-        question_stats[question.id]["num_responses"] += 1
+    return question_stats
+
+
+def get_experiment_summary(experiment):
+    """Return a dictionary describing participation in this experiment and
+    statistics about its questions.
+    """
+    if not experiment.stats:
+        # Statistics were not kept when this experiment was run, and
+        # rebuild-stats has not been run since. Concurrent rebuilds wait for
+        # each other on the statistics row.
+        ExperimentStats.rebuild(experiment)
+        db.session.commit()
+
+    # Only count participants who have started this experiment, and never
+    # the provisioned participants waiting to be claimed
+    num_participants = db.session.query(
+        func.count(distinct(AssignmentSet.participant_id))).\
+        join(Participant, AssignmentSet.participant_id == Participant.id).\
+        filter(AssignmentSet.experiment_id == experiment.id).\
+        filter(Participant.provisioned.isnot(True)).scalar()
+    num_finished = experiment.stats.num_finished
+
+    percent_finished = None
+    if num_participants:
+        percent_finished = num_finished / float(num_participants)
+
+    return {
+        "num_participants": num_participants,
+        "num_finished": num_finished,
+        "percent_finished": percent_finished,
+        "question_stats": get_question_stats(experiment),
+    }
 
 
 @experiments.route(EXPERIMENT_ROUTE + "/results", methods=["GET"])
@@ -413,173 +633,71 @@ def results_experiment(experiment_id):
     """
     experiment = validate_model_id(Experiment, experiment_id)
 
-    num_participants = Participant.query.count()
-    num_finished = AssignmentSet.query.\
-        filter_by(experiment_id=experiment.id).\
-        filter_by(complete=True).count()
-
-    percent_finished = num_finished / float(num_participants)
+    return render_template("experiments/results_experiment.html",
+                           experiment=experiment,
+                           **get_experiment_summary(experiment))
 
-    # {"question_id": {"question": "question_text", "num_responses":
-    #   num_responses, "num_correct": num_correct], ...}
-    question_stats = defaultdict(dict)
-    assignments = Assignment.query.join(AssignmentSet).\
-        filter(AssignmentSet.experiment == experiment).all()
 
-    for assignment in assignments:
-        activity = assignment.activity
+@experiments.route(EXPERIMENT_ROUTE + "/results/stats", methods=["GET"])
+@roles_required("experimenter")
+def results_stats_experiment(experiment_id):
+    """Return the same statistics as ``results_experiment`` in JSON format.
+    """
+    experiment = validate_model_id(Experiment, experiment_id)
+    summary = get_experiment_summary(experiment)
 
-        if "question" in activity.type:
-            get_question_stats(assignment, question_stats)
+    question_stats = []
+    for question_id, stats in summary["question_stats"].items():
+        stats = dict(stats)
+        stats["question_id"] = question_id
+        question_stats.append(stats)
+    summary["question_stats"] = question_stats
 
-    return render_template("experiments/results_experiment.html",
-                           experiment=experiment,
-                           num_participants=num_participants,
-                           num_finished=num_finished,
-                           percent_finished=percent_finished,
-                           question_stats=question_stats)
+    summary["success"] = 1
+    return jsonify(summary)
 
 
 @experiments.route(EXPERIMENT_ROUTE + "/results/export", methods=["GET"])
 @roles_required("experimenter")
 def export_results_experiment(experiment_id):
-    """Get a spreadsheet breaking down how participants did in this experiment.
+    """Start generating a spreadsheet breaking down how participants did in
+    this experiment, and send the user to the job's page.
+
+    By default this is an XLSX workbook. If the ``format`` argument is
+    ``csv``, a CSV file is generated instead.
     """
-    # Grab all assignments in the experiment
-    # For every assignment
-    #  If the activity is not present in the headers
-    #   Add it to the headers
-    #  If the user is not present in the rows
-    #   Add them to the rows
-    #  Determine the activity's position in the headers
-    #  Determine the user's position in the rows
-    #  The above two give us coordinates, fill them out with user's answer,
-    #  points, etc.
     experiment = validate_model_id(Experiment, experiment_id)
+    export_format = "csv" if request.args.get("format") == "csv" else "xlsx"
 
-    workbook = get_results_workbook(experiment)
-
-    file_name = tempfile.mkstemp(".xlsx")
-    os.close(file_name[0])
-    workbook.save(file_name[1])
-    return send_file(
-        file_name[1], as_attachment=True,
-        attachment_filename="experiment_{}_report.xlsx".format(experiment.id))
+    job = job_queue.submit("export_results", experiment_id=experiment.id,
+                           format=export_format)
+    return redirect(url_for("jobs.read_job", job_id=job.id))
 
 
-def get_activity_column_index(activity, activity_column_mapping,
-                              activity_counter, headers):
-    """Find the column index for this occurrence of the given activity. This
-    will update headers, counter, and mapping if necessary.
+@job_queue.handler("export_results")
+def export_results_job(args, report_progress):
+    """Write the results report of an experiment to a temporary file.
     """
-    activity_occurrence = activity_counter[activity.id]
-    activity_counter[activity.id] += 1
-    try:
-        return activity_column_mapping[activity.id][activity_occurrence]
-    except KeyError:
-        activity_column_mapping[activity.id] = [len(headers) + 1]
-        headers.append("{}: {}".format(activity.id, activity))
-        headers.append("Correct?")
-        headers.append("Points")
-        headers.append("Comments")
-        headers.append("Media items")
-    except IndexError:
-        activity_column_mapping[activity.id].append(len(headers) + 1)
-        headers.append("{}: {}".format(activity.id, activity))
-        headers.append("Correct?")
-        headers.append("Points")
-        headers.append("Comments")
-        headers.append("Media items")
-    return activity_column_mapping[activity.id][activity_occurrence]
-
-
-def assignment_to_cells(assignment):
-    """Given an assignment, convert it into a 4-cell block for use in a
-    spreadsheet.
-    """
-    media_items = ",".join([str(mi.id) for mi
-                            in assignment.media_items])
-    if not assignment.result:
-        row = ["_BLANK_"] * 4 + [media_items]
-    else:
-        row = ["{}:{}".format(assignment.id, assignment.result),
-               assignment.correct,
-               assignment.score,
-               assignment.comment,
-               media_items]
-    return row
+    experiment = Experiment.query.get(args["experiment_id"])
+    export_format = args["format"]
 
+    num_participants = db.session.query(
+        func.count(distinct(AssignmentSet.participant_id))).\
+        filter(AssignmentSet.experiment_id == experiment.id).scalar()
+    rows = iter_with_progress(results.iter_results_rows(experiment),
+                              num_participants + 1, report_progress)
 
-def get_results_workbook(experiment):
-    """Analyze the assignment sets in the experiment and return an excel
-    workbook.
-    """
-    assignment_sets = experiment.assignment_sets
-    headers = ["User email", "User ID"]
-    activity_column_mapping = {}
-    next_participant_row = 2
-    participant_row_mapping = {}
-
-    # The same activity can appear multiple times in an assignment set. To
-    # display them properly, we keep a list of their ocurrences in
-    # activity_column_mapping, like so:
-    # {1: [3, 7, 10], ...} means activity 1 occurs in columns 3, 7, and 10
-    # When populating a row, we will use the earliest occurrence of the
-    # activity possible.
-
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = "Experiment {} - Report".format(experiment.id)
-
-    for assignment_set in assignment_sets:
-        activity_counter = Counter()
-        participant = assignment_set.participant
-
-        # Nobody has done this set
-        if not participant:
-            continue
-
-        # Encountered a new participant
-        if participant.id not in participant_row_mapping:
-            participant_row_mapping[participant.id] = next_participant_row
-            populate_row_segment(sheet,
-                                 next_participant_row,
-                                 1,
-                                 [participant.email, participant.id])
-            next_participant_row += 1
-
-        for assignment in assignment_set.assignments:
-            activity = assignment.activity
-            activity_column_index = get_activity_column_index(
-                activity,
-                activity_column_mapping,
-                activity_counter,
-                headers)
-
-            row = assignment_to_cells(assignment)
-
-            populate_row_segment(
-                sheet,
-                participant_row_mapping[participant.id],
-                activity_column_index,
-                row
-            )
-
-    populate_row_segment(sheet, 1, 1, headers)
-
-    # Specify experiment ID
-    sheet.cell(row=1, column=len(headers) + 1).value = "Experiment ID"
-    sheet.cell(row=2, column=len(headers) + 1).value = experiment.id
-
-    return workbook
-
-
-def populate_row_segment(sheet, row_index, initial_col, row):
-    """Populate the segment of row # ``row_index`` in ``sheet`` that starts at
-    ``initial_col`` and contains the items in ``row``.
-    """
-    for col_offset, cell in enumerate(row):
-        sheet.cell(row=row_index, column=initial_col + col_offset).value = cell
+    file_handle, file_name = tempfile.mkstemp("." + export_format)
+    os.close(file_handle)
+
+    if export_format == "csv":
+        results.write_results_csv(rows, file_name)
+    else:
+        results.get_results_workbook(experiment, rows).save(file_name)
+
+    return {"output_path": file_name,
+            "output_name": "experiment_{}_report.{}".format(experiment.id,
+                                                            export_format)}
 
 
 @experiments.route(ASSIGNMENT_SET_ROUTE + "/confirm_done", methods=["GET"])
@@ -595,6 +713,25 @@ def confirm_done_assignment_set(experiment_id, assignment_set_id):
                            experiment=experiment)
 
 
+@experiments.route(ASSIGNMENT_SET_ROUTE + "/manifest", methods=["GET"])
+@roles_required("participant")
+def read_manifest_assignment_set(experiment_id, assignment_set_id):
+    """Return the URLs of the graphs in the participant's next few
+    assignments, so that they can be fetched before they are flashed.
+
+    The assignments after the one at the ``position`` query parameter are
+    included, or after the participant's progress if it is not given.
+    """
+    experiment, assignment_set = validate_assignment_set(experiment_id,
+                                                         assignment_set_id)
+    position = request.args.get("position", assignment_set.progress - 1,
+                                type=int)
+
+    return jsonify({"success": 1,
+                    "urls": get_preload_urls(experiment, assignment_set,
+                                             position)})
+
+
 @experiments.route(ASSIGNMENT_SET_ROUTE + "/finalize", methods=["PATCH"])
 @roles_required("participant")
 def finalize_assignment_set(experiment_id, assignment_set_id):
@@ -609,6 +746,13 @@ def finalize_assignment_set(experiment_id, assignment_set_id):
 
     assignment_set.complete = True
 
+    # As in update_assignment, experiments without statistics count this
+    # set when they are rebuilt
+    experiment_stats = ExperimentStats.query.\
+        filter_by(experiment_id=experiment.id).with_for_update().first()
+    if experiment_stats:
+        experiment_stats.num_finished += 1
+
     db.session.commit()
 
     return jsonify({"success": 1,
@@ -1,36 +1,261 @@
 """Various functions that are useful in multiple views.
 """
+import hashlib
+import json
 import random
-from flask import abort, jsonify
+import time
+
+from flask import abort, current_app, jsonify, make_response, request
 from flask_security import current_user
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.http import is_resource_modified
 
 from quizApp import models
 from quizApp import db
+from quizApp import security
+
+
+def claim_assignment_set(experiment, participant):
+    """Atomically claim an unclaimed AssignmentSet in the experiment's pool
+    for participant and return it, or return None if the pool is empty.
+
+    If the experiment's pool has been shuffled into a claim queue, sets are
+    given out in queue order, see ``pop_claim_queue``. Otherwise, or once the
+    queue runs out, a random unclaimed set is claimed, see
+    ``claim_random_assignment_set``.
+    """
+    if experiment.claim_seed is not None:
+        while True:
+            candidate_id = pop_claim_queue(experiment)
+
+            if candidate_id is None:
+                break
+
+            assignment_set = take_assignment_set(candidate_id, participant)
+
+            if assignment_set:
+                return assignment_set
+
+    return claim_random_assignment_set(experiment, participant)
+
+
+def pop_claim_queue(experiment):
+    """Return the ID of the next AssignmentSet in the experiment's claim
+    queue and move the queue along, or return None if the queue is empty.
+
+    The experiment's ``claim_cursor`` is incremented with a single UPDATE,
+    which locks the experiment's row until the claim is committed, so every
+    participant gets a different place in the queue. The set at that place is
+    found by its ``claim_order``, so the cost of a claim does not depend on
+    the size of the pool.
+    """
+    table = models.Experiment.__table__
+    set_table = models.AssignmentSet.__table__
+
+    db.session.execute(
+        table.update().
+        where(table.c.id == experiment.id).
+        values(claim_cursor=table.c.claim_cursor + 1))
+    claim_order = db.session.execute(
+        select([table.c.claim_cursor]).
+        where(table.c.id == experiment.id)).scalar() - 1
+
+    return db.session.execute(
+        select([set_table.c.id]).
+        where(and_(set_table.c.experiment_id == experiment.id,
+                   set_table.c.claim_order == claim_order))).scalar()
+
+
+def take_assignment_set(assignment_set_id, participant):
+    """Give the AssignmentSet with the given ID to participant and return it,
+    unless someone else has already claimed it, in which case return None.
+
+    The set is claimed with an UPDATE that only succeeds if it is still
+    unclaimed, so no set is ever given to two participants.
+
+    If participant already has a set in the same experiment, the unique
+    constraint on ``(experiment_id, participant_id)`` is violated and an
+    IntegrityError is raised. The UPDATE is run in a savepoint, so the rest of
+    the transaction is not affected.
+    """
+    table = models.AssignmentSet.__table__
+    savepoint = db.session.begin_nested()
+    try:
+        claimed = db.session.execute(
+            table.update().
+            where(and_(table.c.id == assignment_set_id,
+                       table.c.participant_id.is_(None))).
+            values(participant_id=participant.id))
+    except IntegrityError:
+        savepoint.rollback()
+        raise
+    savepoint.commit()
+
+    if claimed.rowcount != 1:
+        return None
+
+    db.session.commit()
+    return models.AssignmentSet.query.populate_existing().\
+        get(assignment_set_id)
+
+
+def claim_random_assignment_set(experiment, participant):
+    """Atomically claim a random unclaimed AssignmentSet in the experiment's
+    pool for participant and return it, or return None if the pool is empty.
+
+    A candidate is found by picking a random ID between the lowest and
+    highest assignment set IDs in the experiment and taking the first
+    unclaimed set at or after it, wrapping around to the start of the pool if
+    necessary, see ``find_random_row``. Both lookups use the index on
+    ``experiment_id``, so the cost of a claim does not depend on the size of
+    the pool.
+
+    The candidate is then claimed with ``take_assignment_set``. If another
+    participant claimed it first, we try again with a new candidate. Sets we
+    failed to claim are excluded from later candidates, as our snapshot of
+    the pool may still show them as unclaimed.
+    """
+    table = models.AssignmentSet.__table__
+    taken_ids = []
+
+    lowest_id, highest_id = db.session.execute(
+        select([func.min(table.c.id), func.max(table.c.id)]).
+        where(table.c.experiment_id == experiment.id)).first()
+
+    if lowest_id is None:
+        return None
+
+    while True:
+        in_pool = and_(table.c.experiment_id == experiment.id,
+                       table.c.participant_id.is_(None))
+        if taken_ids:
+            in_pool = and_(in_pool, table.c.id.notin_(taken_ids))
+
+        candidate_id = find_random_row(table, in_pool, lowest_id, highest_id)
+
+        if candidate_id is None:
+            return None
+
+        assignment_set = take_assignment_set(candidate_id, participant)
+
+        if assignment_set:
+            return assignment_set
+
+        taken_ids.append(candidate_id)
+
+
+def find_random_row(table, condition, lowest_id, highest_id):
+    """Return the ID of a random row in table that meets condition, or None
+    if there isn't one.
+
+    A random ID between lowest_id and highest_id is picked, and the first
+    matching row at or after it is returned, wrapping around to the start of
+    the table if necessary.
+    """
+    start_id = random.randint(lowest_id, highest_id)
+    row_id = db.session.execute(
+        select([table.c.id]).
+        where(and_(condition, table.c.id >= start_id)).
+        order_by(table.c.id).limit(1)).scalar()
+
+    if row_id is None:
+        row_id = db.session.execute(
+            select([table.c.id]).
+            where(and_(condition, table.c.id < start_id)).
+            order_by(table.c.id).limit(1)).scalar()
+
+    return row_id
+
+
+def register_participant(email, foreign_id=None):
+    """Return a new, active Participant with the given email and foreign ID
+    who can't log in with a password.
+
+    A participant made by ``Participant.provision`` is claimed if there are
+    any left, see ``claim_provisioned_participant``. Otherwise one is
+    created. Either way no password is hashed, so a burst of registrations,
+    such as when HITs are posted, doesn't tie up the CPU.
+    """
+    participant = claim_provisioned_participant(email, foreign_id)
+
+    if participant:
+        return participant
+
+    participant = models.Participant(email=email, foreign_id=foreign_id,
+                                     password=models.UNUSABLE_PASSWORD)
+    security.datastore.add_role_to_user(participant, "participant")
+    security.datastore.activate_user(participant)
+    participant.save()
+
+    return participant
+
+
+def claim_provisioned_participant(email, foreign_id=None):
+    """Atomically claim a random provisioned Participant, give them email and
+    foreign_id, and return them, or return None if there are none left.
+
+    As in ``claim_random_assignment_set``, candidates are claimed with an
+    UPDATE that only succeeds if they are still provisioned, and we try again
+    if someone else claimed them first.
+    """
+    table = models.Participant.__table__
+    provisioned = table.c.provisioned.is_(True)
+    taken_ids = []
+
+    lowest_id, highest_id = db.session.execute(
+        select([func.min(table.c.id), func.max(table.c.id)]).
+        where(provisioned)).first()
+
+    if lowest_id is None:
+        return None
+
+    while True:
+        in_pool = provisioned
+        if taken_ids:
+            in_pool = and_(in_pool, table.c.id.notin_(taken_ids))
+
+        candidate_id = find_random_row(table, in_pool, lowest_id, highest_id)
+
+        if candidate_id is None:
+            return None
+
+        claimed = db.session.execute(
+            table.update().
+            where(and_(table.c.id == candidate_id, provisioned)).
+            values(provisioned=False, email=email, foreign_id=foreign_id))
+
+        if claimed.rowcount == 1:
+            db.session.commit()
+            return models.Participant.query.populate_existing().\
+                get(candidate_id)
+
+        taken_ids.append(candidate_id)
 
 
 def get_or_create_assignment_set(experiment):
     """Attempt to retrieve the AssignmentSet record for the current
     user in the given Experiment.
 
-    If no such record exists, grab a random AssignmentSet record in the
-    experiment AssignmentSet pool, copy it to be the current user's
-    AssignmentSet record, and return that.
+    If no such record exists, claim an AssignmentSet record in the
+    experiment AssignmentSet pool for the current user and return that. See
+    ``claim_assignment_set``.
     """
+    query = models.AssignmentSet.query.\
+        filter_by(participant_id=current_user.id).\
+        filter_by(experiment_id=experiment.id)
+
     try:
-        assignment_set = models.AssignmentSet.query.\
-            filter_by(participant_id=current_user.id).\
-            filter_by(experiment_id=experiment.id).one()
+        assignment_set = query.one()
     except NoResultFound:
-        pool = models.AssignmentSet.query.\
-            filter_by(participant_id=None).\
-            filter_by(experiment_id=experiment.id).all()
         try:
-            assignment_set = random.choice(pool)
-        except IndexError:
-            return None
-        assignment_set.participant = current_user
-        db.session.commit()
+            assignment_set = claim_assignment_set(experiment, current_user)
+        except IntegrityError:
+            # Another request from this user claimed a set first. Start a new
+            # transaction so that we can see it.
+            db.session.rollback()
+            assignment_set = query.one()
 
     return assignment_set
 
@@ -84,3 +309,41 @@ def validate_form_or_error(form):
         return jsonify({"success": 0, "errors": form.errors})
 
     return None
+
+
+def conditional_response(etag_parts, render):
+    """Return a 304 response if the client's cached copy of a page is still
+    current. Otherwise call render and return its result as a response.
+
+    Either way, the response has a strong ETag made from ``etag_parts``, a
+    list of everything the page depends on, such as the IDs and versions of
+    the objects it shows. The current user and the age of the CSRF token
+    embedded in every page are added to it, so that a cached page is not
+    shown to another user or kept after its token has expired. Clients are
+    asked to revalidate their copy every time they use it.
+
+    No ``Last-Modified`` date is sent, and ``If-Modified-Since`` is ignored:
+    a date says nothing about whose page a client has cached or what they
+    have done on it since, so only the ETag can tell if a copy is current.
+
+    Arguments:
+        etag_parts (list): JSON serializable values that change whenever
+            the page changes. Datetimes are converted to strings.
+        render (function): Called with no arguments to render the page
+    """
+    csrf_time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    csrf_window = int(time.time() // (csrf_time_limit // 2)) \
+        if csrf_time_limit else 0
+    parts = [current_user.get_id(), csrf_window] + list(etag_parts)
+    etag = hashlib.sha1(json.dumps(parts, default=str).encode("utf-8")).\
+        hexdigest()
+
+    if is_resource_modified(request.environ, etag):
+        response = make_response(render())
+    else:
+        response = current_app.response_class(status=304)
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
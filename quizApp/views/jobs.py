@@ -0,0 +1,57 @@
+"""Views for checking on background jobs and downloading what they produce.
+"""
+from flask import Blueprint, render_template, url_for, jsonify, abort, \
+    send_file
+from flask_security import roles_required
+
+from quizApp.models import Job
+from quizApp.views.helpers import validate_model_id
+
+jobs = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+JOB_ROUTE = "/<int:job_id>"
+
+
+@jobs.route(JOB_ROUTE, methods=["GET"])
+@roles_required("experimenter")
+def read_job(job_id):
+    """Show the progress of a job, and a download link once it is finished.
+    """
+    job = validate_model_id(Job, job_id)
+
+    return render_template("jobs/read_job.html", job=job)
+
+
+@jobs.route(JOB_ROUTE + "/status", methods=["GET"])
+@roles_required("experimenter")
+def status_job(job_id):
+    """Return the status and progress of a job as JSON.
+    """
+    job = validate_model_id(Job, job_id)
+
+    download_url = None
+    if job.status == "finished" and job.output_path:
+        download_url = url_for("jobs.download_job", job_id=job.id)
+
+    return jsonify({
+        "success": 1,
+        "status": job.status,
+        "progress": job.progress,
+        "result": job.get_result(),
+        "traceback": job.traceback,
+        "download_url": download_url,
+    })
+
+
+@jobs.route(JOB_ROUTE + "/download", methods=["GET"])
+@roles_required("experimenter")
+def download_job(job_id):
+    """Send the file produced by a finished job.
+    """
+    job = validate_model_id(Job, job_id)
+
+    if job.status != "finished" or not job.output_path:
+        abort(404)
+
+    return send_file(job.output_path, as_attachment=True,
+                     attachment_filename=job.output_name)
@@ -1,16 +1,12 @@
 """These are views for interfacing with amazon mechanical turk.
 """
-import random
-import string
-
 from flask import Blueprint, render_template, request, session, url_for
 from sqlalchemy.orm.exc import NoResultFound
 
-from quizApp.views.helpers import validate_model_id, get_first_assignment
+from quizApp.views.helpers import validate_model_id, get_first_assignment, \
+    register_participant
 from quizApp.forms.mturk import PostbackForm
 from quizApp.models import Experiment, Participant
-from quizApp import security
-from flask_security.utils import encrypt_password
 from flask_security import login_user, logout_user
 
 mturk = Blueprint("mturk", __name__, url_prefix="/mturk")
@@ -37,18 +33,9 @@ def register():
             participant = Participant.query.\
                 filter_by(email=request.args["workerId"]).one()
         except NoResultFound:
-            # Generate a new participant record
-            password = ''.join(random.SystemRandom().
-                               choice(string.ascii_uppercase + string.digits)
-                               for _ in range(0, 15))
-
-            participant = Participant(
-                foreign_id=request.args["workerId"],
-                email=request.args["workerId"],
-                password=encrypt_password(password))
-            security.datastore.add_role_to_user(participant, "participant")
-            security.datastore.activate_user(participant)
-            participant.save()
+            # Workers never log in with a password, so they don't get one
+            participant = register_participant(request.args["workerId"],
+                                               request.args["workerId"])
             session["experiment_post_finalize_handler"] = "mturk"
             session["mturk_assignmentId"] = request.args["assignmentId"]
             session["mturk_post_url"] = request.args["turkSubmitTo"] + \
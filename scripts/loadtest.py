@@ -0,0 +1,331 @@
+"""Simulate many participants taking an experiment at once, to find out how
+much load a QuizApp instance can handle before posting a large batch of HITs.
+
+Each simulated participant registers, either through the mturk registration
+endpoint or ``/auto_register``, answers every assignment in the assignment set
+they are given, and finalizes it. Participants run in a pool of threads, each
+with its own cookies, against a QuizApp instance over HTTP. The latency and
+outcome of every request is recorded and summarized per endpoint.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from builtins import object
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import random
+import re
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+
+ASSIGNMENT_URL_RE = re.compile(
+    r"/experiments/\d+/assignment_sets/\d+/assignments/\d+")
+CONFIRM_DONE_URL_RE = re.compile(
+    r"/experiments/\d+/assignment_sets/\d+/confirm_done")
+CSRF_TOKEN_RE = re.compile(r'<meta name="csrf-token" content="([^"]*)"')
+INPUT_RE = re.compile(r"<input[^>]*>")
+ATTRIBUTE_RE = re.compile(r'(\w+)="([^"]*)"')
+MAX_ASSIGNMENTS = 1000
+"""int: How many assignments a participant may be sent to before we give up,
+in case the app sends them around in circles.
+"""
+
+
+class LoadTestError(Exception):
+    """Raised when a simulated participant can't continue.
+    """
+    pass
+
+
+class LoadTestResults(object):
+    """Collects the latency and outcome of every request made during a load
+    test. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.participants_finished = 0
+        self.participants_failed = 0
+        self.start = None
+        self.stop = None
+
+    def record(self, endpoint, seconds, error):
+        """Record a request to endpoint that took seconds.
+        """
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if error:
+                self.errors[endpoint] += 1
+
+    def record_participant(self, finished):
+        """Record whether a participant made it to the end of the experiment.
+        """
+        with self.lock:
+            if finished:
+                self.participants_finished += 1
+            else:
+                self.participants_failed += 1
+
+    def summarize(self):
+        """Return a dictionary describing the overall throughput and the
+        latency percentiles and error rate of each endpoint.
+        """
+        seconds = self.stop - self.start
+        num_requests = sum(len(l) for l in self.latencies.values())
+        endpoints = OrderedDict()
+
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / float(len(latencies)),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+
+        return {
+            "seconds": seconds,
+            "requests": num_requests,
+            "requests_per_second": num_requests / seconds if seconds else None,
+            "participants_finished": self.participants_finished,
+            "participants_failed": self.participants_failed,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(sorted_values, percent):
+    """Return the given percentile of a sorted list, using the nearest rank
+    method.
+    """
+    rank = int(round(percent / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class SimulatedParticipant(object):
+    """A participant who registers, answers every assignment in their
+    assignment set, and finalizes it.
+    """
+
+    def __init__(self, base_url, experiment_id, results, mturk=False):
+        self.base_url = base_url.rstrip("/")
+        self.experiment_id = experiment_id
+        self.results = results
+        self.mturk = mturk
+        self.session = requests.Session()
+        self.csrf_token = None
+
+    def request(self, endpoint, method, url, **kwargs):
+        """Make a request, record how long it took, and return the response.
+
+        Responses with an error status code, or JSON responses whose success
+        flag is not set, count as errors.
+        """
+        if not url.startswith("http"):
+            url = self.base_url + url
+
+        headers = {}
+        if self.csrf_token:
+            headers["X-CSRFToken"] = self.csrf_token
+
+        start = time.time()
+        try:
+            response = self.session.request(method, url, headers=headers,
+                                            **kwargs)
+        except requests.RequestException:
+            self.results.record(endpoint, time.time() - start, True)
+            raise LoadTestError("{} {} failed".format(method, url))
+
+        error = response.status_code >= 400
+        if not error and \
+                response.headers.get("Content-Type") == "application/json":
+            error = not response.json().get("success")
+
+        self.results.record(endpoint, time.time() - start, error)
+
+        if error:
+            raise LoadTestError("{} {} returned {}".format(
+                method, url, response.status_code))
+
+        match = CSRF_TOKEN_RE.search(response.text)
+        if match:
+            self.csrf_token = match.group(1)
+
+        return response
+
+    def register(self):
+        """Register and return the URL of the first assignment.
+        """
+        if self.mturk:
+            worker_id = uuid.uuid4().hex
+            response = self.request("mturk.register", "GET",
+                                    "/mturk/register",
+                                    params={
+                                        "experiment_id": self.experiment_id,
+                                        "workerId": worker_id,
+                                        "assignmentId": worker_id,
+                                        "hitId": "loadtest",
+                                        "turkSubmitTo": self.base_url,
+                                    })
+        else:
+            response = self.request("core.auto_register", "GET",
+                                    "/auto_register",
+                                    params={
+                                        "experiment_id": self.experiment_id,
+                                    })
+
+        match = ASSIGNMENT_URL_RE.search(response.text)
+        if not match:
+            raise LoadTestError("No assignment set was available")
+
+        return match.group(0)
+
+    def answer(self, url):
+        """Read and answer the assignment at url, and return the URL to go to
+        next.
+        """
+        response = self.request("experiments.read_assignment", "GET", url)
+        render_time = datetime.now()
+        data = get_answer(response.text)
+        data["render_time"] = render_time.isoformat()
+        data["submit_time"] = (render_time +
+                               timedelta(seconds=random.uniform(1, 10))).\
+            isoformat()
+
+        response = self.request("experiments.update_assignment", "PATCH",
+                                url, data=data)
+        next_url = response.json().get("next_url")
+
+        if not next_url:
+            # A scorecard was shown, which contains the link onwards
+            scorecard = response.json().get("scorecard", "")
+            match = ASSIGNMENT_URL_RE.search(scorecard) or \
+                CONFIRM_DONE_URL_RE.search(scorecard)
+            if not match:
+                raise LoadTestError("Don't know where to go after " + url)
+            next_url = match.group(0)
+
+        return next_url
+
+    def finalize(self, confirm_done_url):
+        """Confirm and finalize the assignment set.
+        """
+        self.request("experiments.confirm_done_assignment_set", "GET",
+                     confirm_done_url)
+        finalize_url = confirm_done_url.replace("/confirm_done", "/finalize")
+        response = self.request("experiments.finalize_assignment_set",
+                                "PATCH", finalize_url)
+        self.request("experiments.done_assignment_set", "GET",
+                     response.json()["next_url"])
+
+    def run(self):
+        """Take the experiment from start to finish. Returns True if the
+        participant finished.
+        """
+        try:
+            url = self.register()
+
+            for _ in range(MAX_ASSIGNMENTS):
+                if CONFIRM_DONE_URL_RE.search(url):
+                    self.finalize(url)
+                    return True
+                url = self.answer(url)
+        except (LoadTestError, ValueError, KeyError):
+            # ValueError and KeyError mean we got a response we didn't
+            # expect, e.g. HTML instead of JSON
+            return False
+
+        return False
+
+
+def get_answer(html):
+    """Given a rendered assignment, return form data that answers it.
+
+    A random choice is picked for multiple choice questions. Integer
+    questions are answered with their minimum value, and free answer
+    questions with some text.
+    """
+    choices = []
+    integer_min = None
+
+    for tag in INPUT_RE.findall(html):
+        attributes = dict(ATTRIBUTE_RE.findall(tag))
+
+        if attributes.get("name") == "choices":
+            choices.append(attributes.get("value"))
+        elif attributes.get("name") == "integer":
+            integer_min = attributes.get("min", "0")
+
+    if choices:
+        return {"choices": random.choice(choices)}
+
+    if integer_min is not None:
+        return {"integer": integer_min}
+
+    if 'name="text"' in html:
+        return {"text": "Load test answer"}
+
+    return {}
+
+
+def serve(app, host="127.0.0.1", port=0):
+    """Serve app with a threaded WSGI server in a background thread. Returns
+    the server, whose ``server_port`` is the port it is listening on.
+    """
+    server = make_server(host, port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_loadtest(base_url, experiment_id, num_participants, concurrency,
+                 mturk=False):
+    """Run num_participants simulated participants, concurrency at a time,
+    against the QuizApp instance at base_url. Returns the LoadTestResults.
+    """
+    results = LoadTestResults()
+
+    def run_participant(_):
+        """Run one simulated participant and record the outcome.
+        """
+        participant = SimulatedParticipant(base_url, experiment_id, results,
+                                           mturk)
+        results.record_participant(participant.run())
+
+    results.start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(run_participant, range(num_participants)))
+    results.stop = time.time()
+
+    return results
+
+
+def format_summary(summary):
+    """Return a loadtest summary as a human readable table.
+    """
+    lines = [
+        "{requests} requests in {seconds:.2f}s "
+        "({requests_per_second:.2f} requests/s)".format(**summary),
+        "{participants_finished} participants finished, "
+        "{participants_failed} failed".format(**summary),
+        "",
+        "{:<40} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+            "Endpoint", "Requests", "Errors", "p50 ms", "p95 ms", "p99 ms"),
+    ]
+
+    for endpoint, stats in summary["endpoints"].items():
+        lines.append("{:<40} {:>8} {:>7.1f}% {:>8.1f} {:>8.1f} {:>8.1f}".
+                     format(endpoint, stats["requests"],
+                            stats["error_rate"] * 100,
+                            stats["p50"] * 1000, stats["p95"] * 1000,
+                            stats["p99"] * 1000))
+
+    return "\n".join(lines)
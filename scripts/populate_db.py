@@ -302,7 +302,7 @@ def create_assignment(question_id, assignment_set, graph_id):
         participant=assignment_set.participant,
         media_items=[Graph.query.get(graph_id)])
     assignment.activity = question
-    assignment.assignment_set = assignment_set
+    assignment_set.assignments.append(assignment)
 
     db.session.add(assignment)
 
@@ -325,6 +325,7 @@ def setup_db():
     get_choices()
     get_students()
     create_assignments()
+    Experiment.shuffle_claim_queues()
 
     db.session.commit()
 
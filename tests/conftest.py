@@ -9,6 +9,7 @@ import pytest
 from scripts.clear_db import clear_db
 from quizApp import create_app
 from quizApp import db
+from quizApp.cache import fragment_cache
 
 from quizApp.models import User, Participant, Role
 
@@ -60,6 +61,7 @@ def dbsession(request, monkeypatch):
     """Provide a patched database session that rolls back after each test.
     """
     request.addfinalizer(db.session.remove)
+    request.addfinalizer(fragment_cache.clear)
 
     monkeypatch.setattr(db.session, "commit", db.session.flush)
     monkeypatch.setattr(db.session, "remove", lambda: None)
@@ -2,11 +2,57 @@
 """
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
 import json
 
+from sqlalchemy import event
+
+from quizApp import db
+from quizApp.models import Job
+
 
 def json_success(json_bytes):
     """Assert that this json string contains a top level item called "success"
     and it is set to 1.
     """
     return json.loads(json_bytes.decode("utf-8"))["success"] == 1
+
+
+@contextmanager
+def count_queries():
+    """Record every statement executed by the database engine while in this
+    context. Yields a list that the statements are appended to.
+    """
+    statements = []
+
+    def record_statement(_, __, statement, *___):
+        """Append this statement to the list.
+        """
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+
+def get_job(response):
+    """Given a response from an endpoint that started a job, return the job.
+
+    The response is either a redirect to the job's page or JSON containing
+    the job's ID.
+    """
+    if response.status_code == 302:
+        job_id = int(response.location.rstrip("/").split("/")[-1])
+    else:
+        job_id = json.loads(response.data.decode("utf-8"))["job_id"]
+    return Job.query.get(job_id)
+
+
+def download_job_output(client, response):
+    """Given a response from an endpoint that started a job, download the
+    output of the job.
+    """
+    job = get_job(response)
+    return client.get("/jobs/{}/download".format(job.id))
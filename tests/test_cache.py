@@ -0,0 +1,109 @@
+"""Tests for the fragment cache.
+"""
+from __future__ import unicode_literals
+
+from flask import Flask
+import mock
+import pytest
+
+from quizApp.cache import FragmentCache, LRUCache, fragment_cache
+from quizApp.config import Config
+
+
+def create_cache_app(cache_type):
+    """Return an app whose fragment cache backend is cache_type.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config["FRAGMENT_CACHE_TYPE"] = cache_type
+    return app
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.get("a") == 1
+
+    # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+    cache.delete("a")
+    assert cache.get("a") is None
+
+    cache.clear()
+    assert cache.get("c") is None
+
+
+def test_get_or_render(app):
+    renders = []
+
+    def render():
+        renders.append(None)
+        return "fragment"
+
+    assert fragment_cache.get_or_render("test", render) == "fragment"
+    assert fragment_cache.get_or_render("test", render) == "fragment"
+    assert len(renders) == 1
+
+    fragment_cache.clear()
+    assert fragment_cache.get_or_render("test", render) == "fragment"
+    assert len(renders) == 2
+
+
+def test_fragment_cache_key_prefix():
+    for cache_type, backend in [("memcached", "MemcachedCache"),
+                                ("redis", "RedisCache")]:
+        app = create_cache_app(cache_type)
+        app.config["FRAGMENT_CACHE_SERVERS"] = ["127.0.0.1:6379"]
+
+        with mock.patch("quizApp.cache." + backend) as backend_mock:
+            FragmentCache(app)
+            assert backend_mock.call_args[1]["key_prefix"] == "quizapp:"
+
+            FragmentCache(app, key_prefix="test:")
+            assert backend_mock.call_args[1]["key_prefix"] == "test:"
+
+
+def test_fragment_cache_backends():
+    app = create_cache_app("lru")
+    FragmentCache(app)
+    assert isinstance(app.extensions["fragment_cache"], LRUCache)
+    assert app.extensions["fragment_cache"].max_size == \
+        app.config["FRAGMENT_CACHE_SIZE"]
+
+    renders = []
+
+    def render():
+        renders.append(None)
+        return "fragment"
+
+    app = create_cache_app("null")
+    cache = FragmentCache(app)
+    with app.app_context():
+        assert cache.get_or_render("test", render) == "fragment"
+        assert cache.get_or_render("test", render) == "fragment"
+    assert len(renders) == 2
+
+    with pytest.raises(ValueError):
+        FragmentCache(create_cache_app("unknown"))
+
+
+def test_fragment_cache_missing_client():
+    # werkzeug raises a RuntimeError if the client is not installed
+    for cache_type, backend in [("memcached", "MemcachedCache"),
+                                ("redis", "RedisCache")]:
+        app = create_cache_app(cache_type)
+
+        with mock.patch("quizApp.cache." + backend,
+                        side_effect=RuntimeError("no module found")):
+            with pytest.raises(RuntimeError) as excinfo:
+                FragmentCache(app)
+
+        assert "Install" in str(excinfo.value)
@@ -4,13 +4,14 @@ import mock
 import os
 
 from tests.factories import GraphFactory
-from quizApp.filters import get_graph_url_filter
+from quizApp.filters import get_graph_url_filter, graph_url_cache, \
+    invalidate_graph_url
 
 
 @mock.patch("quizApp.filters.os.path.isfile", autospec=os.path.isfile)
 def test_get_graph_url_filter(isfile_mock, app):
     isfile_mock.return_value = False
-    graph = GraphFactory()
+    graph = GraphFactory(id=2)
 
     with app.test_request_context('/'):
         url = get_graph_url_filter(graph)
@@ -21,4 +22,62 @@ def test_get_graph_url_filter(isfile_mock, app):
     with app.test_request_context('/'):
         url = get_graph_url_filter(graph)
 
-    assert "missing" not in url
+    assert url == "/datasets/media_items/2/file?v=0"
+
+    # Changing the graph changes its URL
+    graph.bump_version()
+    with app.test_request_context('/'):
+        url = get_graph_url_filter(graph)
+
+    assert url == "/datasets/media_items/2/file?v=1"
+
+
+@mock.patch("quizApp.filters.os.path.isfile", autospec=os.path.isfile)
+def test_get_graph_url_filter_variants(isfile_mock, app):
+    graph = GraphFactory(path="/graphs/0a1b.png",
+                         display_path="/graphs/2c3d.png",
+                         thumbnail_path="/graphs/4e5f.png")
+
+    with app.test_request_context('/'):
+        assert get_graph_url_filter(graph).endswith("/graphs/2c3d.png")
+        assert get_graph_url_filter(graph, "full").endswith(
+            "/graphs/0a1b.png")
+        assert get_graph_url_filter(graph, "thumbnail").endswith(
+            "/graphs/4e5f.png")
+
+    assert not isfile_mock.called
+
+
+@mock.patch("quizApp.filters.os.path.isfile", autospec=os.path.isfile)
+def test_get_graph_url_filter_cache(isfile_mock, app):
+    graph_url_cache.clear()
+    isfile_mock.return_value = True
+    graph = GraphFactory(id=1)
+    misses = graph_url_cache.misses
+    hits = graph_url_cache.hits
+
+    with app.test_request_context('/'):
+        url = get_graph_url_filter(graph)
+        assert get_graph_url_filter(graph) == url
+
+    assert isfile_mock.call_count == 1
+    assert graph_url_cache.misses == misses + 1
+    assert graph_url_cache.hits == hits + 1
+
+    # A new path, or an invalidated one, is checked again
+    invalidate_graph_url(graph)
+    with app.test_request_context('/'):
+        get_graph_url_filter(graph)
+        graph.path = "other.png"
+        get_graph_url_filter(graph)
+
+    assert isfile_mock.call_count == 3
+
+    # Missing files are not cached
+    isfile_mock.return_value = False
+    graph.path = "missing_file.png"
+    with app.test_request_context('/'):
+        get_graph_url_filter(graph)
+        get_graph_url_filter(graph)
+
+    assert isfile_mock.call_count == 5
@@ -0,0 +1,47 @@
+"""Tests for importing the rows of spreadsheets.
+"""
+from collections import defaultdict
+
+import pytest
+from sqlalchemy import inspect
+
+from quizApp import importer
+from quizApp import models
+from tests.factories import ActivityFactory
+
+
+def test_iter_batches():
+    assert list(importer.iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(importer.iter_batches([], 2)) == []
+
+
+def test_resolve_ids():
+    mapper = inspect(models.Activity)
+    pk_mapping = defaultdict(dict)
+
+    with pytest.raises(ValueError):
+        importer.resolve_ids(mapper, [5], pk_mapping)
+
+    activity = ActivityFactory()
+    activity.save()
+    pk_mapping["activity"][activity.id + 1] = activity.id
+
+    assert importer.resolve_ids(mapper, [activity.id, activity.id + 1],
+                                pk_mapping) == {activity.id: activity.id,
+                                                activity.id + 1: activity.id}
+
+
+def test_parse_row():
+    headers = ["id", "type", None, "datasets"]
+
+    parsed_row = importer.parse_row(models.Activity, headers,
+                                    [3.0, "question_freeanswer", "foo",
+                                     "1,2"])
+
+    assert parsed_row["mapper"] is inspect(models.FreeAnswerQuestion)
+    assert parsed_row["pk"] == 3
+    assert parsed_row["values"] == {"type": "question_freeanswer"}
+    assert [ids for _, ids in parsed_row["relationships"]] == [[1, 2]]
+
+    assert importer.parse_row(models.Activity, headers,
+                              [None, "", "foo"]) is None
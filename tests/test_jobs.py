@@ -0,0 +1,135 @@
+"""Tests for the background job queue.
+"""
+from __future__ import unicode_literals
+from datetime import datetime, timedelta
+
+import pytest
+
+from quizApp import db
+from quizApp import models
+from quizApp.jobs import job_queue, iter_with_progress, STALE_JOB_TRACEBACK
+from tests.factories import ActivityFactory
+
+
+@job_queue.handler("test_succeed")
+def succeed_job(args, report_progress):
+    """Create an activity and report some progress.
+    """
+    ActivityFactory(category=args["category"]).save(commit=False)
+    report_progress(.5)
+    return {"output_path": "foo.txt", "output_name": "bar.txt", "baz": 1}
+
+
+@job_queue.handler("test_fail")
+def fail_job(args, _):
+    """Create an activity and then fail.
+    """
+    ActivityFactory(category=args["category"]).save(commit=False)
+    raise ValueError("Job failed")
+
+
+def test_submit_job():
+    job = job_queue.submit("test_succeed", category="succeed")
+
+    assert job.status == "finished"
+    assert job.progress == 1
+    assert job.output_path == "foo.txt"
+    assert job.output_name == "bar.txt"
+    assert job.get_result() == {"baz": 1}
+    assert job.started and job.finished
+    assert models.Activity.query.filter_by(category="succeed").count() == 1
+
+
+def test_submit_job_failure():
+    job = job_queue.submit("test_fail", category="fail")
+
+    assert job.status == "failed"
+    assert "Job failed" in job.traceback
+    assert job.output_path is None
+    assert models.Activity.query.filter_by(category="fail").count() == 0
+
+
+def test_fail_stale_jobs():
+    """Jobs whose process exited without finishing them should be failed.
+    """
+    old = datetime.now() - timedelta(hours=1)
+    jobs = {
+        "no_heartbeat": models.Job(type="test_succeed", status="running"),
+        "stale_queued": models.Job(type="test_succeed", status="queued",
+                                   heartbeat=old),
+        "stale_running": models.Job(type="test_succeed", status="running",
+                                    heartbeat=old),
+        "alive": models.Job(type="test_succeed", status="running",
+                            heartbeat=datetime.now()),
+        "finished": models.Job(type="test_succeed", status="finished",
+                               heartbeat=old),
+    }
+    db.session.add_all(jobs.values())
+    db.session.commit()
+
+    assert job_queue.fail_stale_jobs() == 3
+
+    for job in jobs.values():
+        db.session.refresh(job)
+
+    for name in ["no_heartbeat", "stale_queued", "stale_running"]:
+        assert jobs[name].status == "failed"
+        assert jobs[name].traceback == STALE_JOB_TRACEBACK
+        assert jobs[name].finished
+
+    assert jobs["alive"].status == "running"
+    assert jobs["finished"].status == "finished"
+    assert job_queue.fail_stale_jobs() == 0
+
+
+def test_delete_expired_jobs(tmpdir):
+    """Jobs that finished long ago should be deleted with their output.
+    """
+    old = datetime.now() - timedelta(days=30)
+    output = tmpdir.join("export.xlsx")
+    output.write("foo")
+    jobs = {
+        "expired": models.Job(type="test_succeed", status="finished",
+                              finished=old, output_path=str(output)),
+        "expired_missing_output": models.Job(
+            type="test_succeed", status="finished", finished=old,
+            output_path=str(tmpdir.join("missing.xlsx"))),
+        "expired_failed": models.Job(type="test_fail", status="failed",
+                                     finished=old),
+        "recent": models.Job(type="test_succeed", status="finished",
+                             finished=datetime.now()),
+        "running": models.Job(type="test_succeed", status="running",
+                              heartbeat=datetime.now()),
+    }
+    db.session.add_all(jobs.values())
+    db.session.commit()
+    job_ids = {name: job.id for name, job in jobs.items()}
+
+    assert job_queue.delete_expired_jobs() == 3
+    assert not output.check()
+
+    db.session.expire_all()
+    for name in ["expired", "expired_missing_output", "expired_failed"]:
+        assert models.Job.query.get(job_ids[name]) is None
+    assert models.Job.query.get(job_ids["recent"])
+    assert models.Job.query.get(job_ids["running"])
+    assert job_queue.delete_expired_jobs() == 0
+
+
+def test_submit_job_heartbeat():
+    job = job_queue.submit("test_succeed", category="heartbeat")
+    assert job.heartbeat >= job.created
+
+
+def test_submit_job_unknown_type():
+    with pytest.raises(ValueError):
+        job_queue.submit("test_nonexistent")
+
+
+def test_iter_with_progress():
+    progress = []
+
+    items = list(iter_with_progress(range(10), 10, progress.append, 5))
+
+    assert items == list(range(10))
+    assert progress == [0, .5]
@@ -0,0 +1,50 @@
+"""Tests for the load testing script.
+"""
+from __future__ import unicode_literals
+
+from scripts.loadtest import LoadTestResults, get_answer, percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3], 99) == 3
+
+
+def test_get_answer():
+    html = ('<input id="choices-0" name="choices" type="radio" value="4">'
+            '<input id="choices-1" name="choices" type="radio" value="7">')
+    assert get_answer(html)["choices"] in ["4", "7"]
+
+    html = '<input id="integer" min="3" name="integer" type="number">'
+    assert get_answer(html) == {"integer": "3"}
+
+    html = '<textarea id="text" name="text"></textarea>'
+    assert "text" in get_answer(html)
+
+    assert get_answer("<p>Scorecard</p>") == {}
+
+
+def test_summarize():
+    results = LoadTestResults()
+    results.start = 0
+    results.stop = 2
+
+    for seconds in [0.1, 0.2, 0.3, 0.4]:
+        results.record("experiments.read_assignment", seconds, False)
+    results.record("experiments.update_assignment", 1, True)
+    results.record_participant(True)
+    results.record_participant(False)
+
+    summary = results.summarize()
+
+    assert summary["requests"] == 5
+    assert summary["requests_per_second"] == 2.5
+    assert summary["participants_finished"] == 1
+    assert summary["participants_failed"] == 1
+    assert summary["endpoints"]["experiments.read_assignment"]["p50"] == 0.2
+    assert summary["endpoints"]["experiments.update_assignment"][
+        "error_rate"] == 1
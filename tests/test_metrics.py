@@ -0,0 +1,115 @@
+"""Tests for request instrumentation.
+"""
+from __future__ import unicode_literals
+
+import mock
+
+from tests.auth import login_experimenter, login_participant
+from quizApp.cache import LRUCache
+from quizApp.metrics import EndpointMetrics, RequestMetrics, format_metrics, \
+    format_cache_metrics
+
+
+def get_endpoint_metrics(app, endpoint):
+    return app.extensions["metrics"]["endpoints"][endpoint]
+
+
+def test_record_request(client, users, app):
+    login_experimenter(client)
+    endpoint = get_endpoint_metrics(app, "core.getting_started")
+    num_requests = endpoint.requests
+    num_statements = endpoint.statements
+
+    response = client.get("/getting_started")
+    assert response.status_code == 200
+
+    assert endpoint.requests == num_requests + 1
+    assert endpoint.statements > num_statements
+    assert endpoint.render_seconds > 0
+    assert endpoint.seconds >= endpoint.render_seconds
+
+
+def test_metrics_endpoint(client, users):
+    login_experimenter(client)
+    client.get("/getting_started")
+
+    response = client.get("/metrics")
+    data = response.data.decode(response.charset)
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "# TYPE quizapp_requests_total counter" in data
+    assert 'quizapp_requests_total{endpoint="core.getting_started"}' in data
+    assert 'quizapp_request_seconds_bucket{endpoint="core.getting_started",' \
+        'le="+Inf"}' in data
+
+
+def test_metrics_endpoint_forbidden(client, users):
+    client.get("/logout")
+    response = client.get("/metrics")
+    assert response.status_code == 403
+
+    login_participant(client)
+    response = client.get("/metrics")
+    assert response.status_code == 403
+
+
+def test_metrics_endpoint_token(client, users, app, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "secret")
+    client.get("/logout")
+
+    response = client.get("/metrics",
+                          headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 403
+
+    response = client.get("/metrics",
+                          headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "quizapp_requests_total" in response.data.decode(response.charset)
+
+
+def test_slow_request_log(client, users, app, monkeypatch):
+    login_experimenter(client)
+    monkeypatch.setitem(app.config, "METRICS_SLOW_REQUEST_STATEMENTS", 0)
+
+    with mock.patch.object(app.logger, "warning") as warning_mock:
+        client.get("/getting_started")
+
+    warning_mock.assert_called_once()
+    assert "/getting_started" in warning_mock.call_args[0]
+
+
+def test_format_metrics():
+    request_metrics = RequestMetrics()
+    request_metrics.statements = 3
+    request_metrics.db_seconds = 0.5
+
+    endpoint = EndpointMetrics()
+    endpoint.record(request_metrics, 0.02)
+    endpoint.record(request_metrics, 20)
+
+    lines = format_metrics({"core.index": endpoint}).splitlines()
+
+    assert 'quizapp_requests_total{endpoint="core.index"} 2' in lines
+    assert 'quizapp_request_statements_total{endpoint="core.index"} 6' in \
+        lines
+    assert 'quizapp_request_seconds_bucket{endpoint="core.index",' \
+        'le="0.01"} 0' in lines
+    assert 'quizapp_request_seconds_bucket{endpoint="core.index",' \
+        'le="0.025"} 1' in lines
+    assert 'quizapp_request_seconds_bucket{endpoint="core.index",' \
+        'le="+Inf"} 2' in lines
+    assert 'quizapp_request_seconds_count{endpoint="core.index"} 2' in lines
+
+
+def test_format_cache_metrics():
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    cache.get("c")
+
+    lines = format_cache_metrics({"graph_url": cache}).splitlines()
+
+    assert 'quizapp_cache_hits_total{cache="graph_url"} 1' in lines
+    assert 'quizapp_cache_misses_total{cache="graph_url"} 2' in lines
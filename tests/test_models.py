@@ -9,7 +9,9 @@ from sqlalchemy import inspect
 import mock
 
 from tests.factories import ExperimentFactory, \
-    ChoiceFactory, QuestionFactory, ScorecardFactory
+    ChoiceFactory, QuestionFactory, ScorecardFactory, ParticipantFactory, \
+    create_experiment
+from quizApp import db
 from quizApp import models
 
 
@@ -192,6 +194,241 @@ def test_assignment_get_score():
         assert assignment.get_score() is None
 
 
+def test_assignment_set_update_score():
+    assignment_set = models.AssignmentSet()
+    question = models.FreeAnswerQuestion(num_media_items=-1,
+                                         category="foo")
+    assignment = models.Assignment(activity=question)
+    assignment.result = models.FreeAnswerQuestionResult(text="bar")
+    assignment_set.assignments.append(assignment)
+
+    assignment_set.update_score(assignment)
+
+    assert assignment_set.score == 1
+    assert assignment_set.get_category_scores() == \
+        {"foo": {"score": 1, "count": 1}}
+
+    assignment.result = models.FreeAnswerQuestionResult(text="")
+    assignment_set.update_score(assignment, previous_score=1)
+
+    assert assignment_set.score == 0
+    assert assignment_set.get_category_scores() == \
+        {"foo": {"score": 0, "count": 1}}
+
+
+def test_assignment_set_recompute_score():
+    assignment_set = models.AssignmentSet(progress=2)
+
+    for text in ["foo", "bar", "baz"]:
+        question = models.FreeAnswerQuestion(num_media_items=-1,
+                                             category=text)
+        assignment = models.Assignment(activity=question)
+        assignment.result = models.FreeAnswerQuestionResult(text=text)
+        assignment_set.assignments.append(assignment)
+
+    assignment_set.score = 50
+    assignment_set.recompute_score()
+
+    assert assignment_set.score == 2
+    assert set(assignment_set.get_category_scores()) == {"foo", "bar"}
+
+
+def test_assignment_set_positions():
+    assignment_set = models.AssignmentSet()
+
+    for _ in range(3):
+        assignment_set.assignments.append(models.Assignment())
+
+    assert [a.position for a in assignment_set.assignments] == [0, 1, 2]
+
+    assignment = assignment_set.assignments.pop(0)
+    assignment_set.assignments.append(assignment)
+
+    assert [a.position for a in assignment_set.assignments] == [0, 1, 2]
+    assert assignment.position == 2
+
+    # Moving an assignment to another set renumbers both sets
+    other_set = models.AssignmentSet(assignments=[models.Assignment()])
+    other_set.assignments.append(assignment_set.assignments[0])
+
+    assert [a.position for a in assignment_set.assignments] == [0, 1]
+    assert [a.position for a in other_set.assignments] == [0, 1]
+
+
+def test_experiment_shuffle_claim_queue():
+    experiment = create_experiment(1, 10)
+    experiment.save()
+
+    def get_queue():
+        db.session.expire_all()
+        return [assignment_set.id for assignment_set in
+                models.AssignmentSet.query.
+                filter_by(experiment_id=experiment.id).
+                order_by(models.AssignmentSet.claim_order)]
+
+    assert experiment.shuffle_claim_queue(seed=7) == 10
+    assert experiment.claim_seed == 7
+    assert experiment.shuffle_claim_queue() == 0
+    queue = get_queue()
+
+    models.AssignmentSet.query.\
+        filter_by(experiment_id=experiment.id).\
+        update({"claim_order": None}, synchronize_session=False)
+    assert experiment.shuffle_claim_queue() == 10
+    assert get_queue() == queue
+
+    new_set = models.AssignmentSet(experiment=experiment)
+    new_set.save()
+    assert experiment.shuffle_claim_queue() == 1
+    assert get_queue()[-1] == new_set.id
+
+
+def explain_keys(query):
+    """Return a dictionary mapping each table in query to the index MySQL
+    would use to read it.
+    """
+    statement = query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    rows = db.session.connection().execute("EXPLAIN {}".format(statement))
+    return {row["table"]: row["key"] for row in rows}
+
+
+def test_participant_indexes():
+    """Make sure the queries on the participant hot path use the composite
+    indexes.
+    """
+    if db.engine.dialect.name != "mysql":
+        pytest.skip("EXPLAIN output is only checked on MySQL")
+
+    experiment = create_experiment(3, 10)
+    for assignment_set in experiment.assignment_sets[:5]:
+        assignment_set.participant = ParticipantFactory()
+        assignment_set.complete = True
+    experiment.save()
+    participant_id = experiment.assignment_sets[0].participant_id
+
+    assignment_set_query = models.AssignmentSet.query.\
+        filter_by(experiment_id=experiment.id).\
+        filter_by(participant_id=participant_id)
+    assert explain_keys(assignment_set_query)["assignment_set"] == \
+        "uq_assignment_set_experiment_id_participant_id"
+
+    results_query = models.AssignmentSet.query.\
+        filter_by(experiment_id=experiment.id).\
+        filter(models.AssignmentSet.participant_id.isnot(None)).\
+        order_by(models.AssignmentSet.participant_id)
+    assert explain_keys(results_query)["assignment_set"] == \
+        "uq_assignment_set_experiment_id_participant_id"
+
+    complete_query = models.AssignmentSet.query.\
+        filter_by(experiment_id=experiment.id).\
+        filter_by(complete=True)
+    assert explain_keys(complete_query)["assignment_set"] == \
+        "ix_assignment_set_experiment_id_complete"
+
+    assignment_query = models.Assignment.query.\
+        filter_by(assignment_set_id=experiment.assignment_sets[0].id).\
+        order_by(models.Assignment.position)
+    assert explain_keys(assignment_query)["assignment"] == \
+        "ix_assignment_assignment_set_id_position"
+
+
+def test_participant_provision():
+    models.Participant.provision(5, batch_size=2)
+
+    participants = models.Participant.query.filter_by(provisioned=True).all()
+    assert len(participants) == 5
+    assert len(set(p.email for p in participants)) == 5
+
+    for participant in participants:
+        assert participant.active
+        assert participant.password == models.UNUSABLE_PASSWORD
+        assert participant.has_role("participant")
+
+
+def test_insert_mappings():
+    mapper = inspect(models.FreeAnswerQuestion)
+    mappings = [{"question": "Question {}".format(i),
+                 "type": "question_freeanswer"} for i in range(5)]
+    mappings[1]["explanation"] = "Explanation"
+    mappings[3]["explanation"] = "Explanation"
+
+    with mock.patch.object(db.session, "bulk_insert_mappings") as bulk:
+        models.insert_mappings(mapper, mappings, return_defaults=True,
+                               batch_size=2)
+        bulk.assert_not_called()
+
+    assert len(set(m["id"] for m in mappings)) == 5
+    for mapping in mappings:
+        question = models.FreeAnswerQuestion.query.get(mapping["id"])
+        assert question.question == mapping["question"]
+        assert question.explanation == mapping.get("explanation")
+        assert question.version == 0
+
+
+def test_insert_mappings_increment_unknown():
+    mappings = [{} for _ in range(3)]
+
+    with mock.patch("quizApp.models.base.get_id_increment", return_value=None):
+        models.insert_mappings(inspect(models.ScorecardSettings), mappings,
+                               return_defaults=True)
+
+    assert len(set(m["id"] for m in mappings)) == 3
+
+
+def test_experiment_stats_created_up_front():
+    experiment = ExperimentFactory()
+    experiment.save()
+
+    assert experiment.stats.num_finished == 0
+    assert models.ExperimentStats.get_or_create(experiment) == \
+        experiment.stats
+
+
+def test_experiment_stats_rebuild_keeps_row():
+    experiment = ExperimentFactory()
+    experiment.save()
+    stats_id = experiment.stats.id
+    experiment.stats.num_finished = 5
+
+    stats = models.ExperimentStats.rebuild(experiment)
+
+    assert stats.id == stats_id
+    assert stats.num_finished == 0
+    assert models.ExperimentStats.query.filter_by(
+        experiment_id=experiment.id).count() == 1
+
+
+def test_activity_stats_record():
+    stats = models.ActivityStats(num_responses=0, num_correct=0,
+                                 score_total=0, num_timed=0,
+                                 time_to_submit_total=0)
+    question = models.FreeAnswerQuestion(num_media_items=-1)
+    assignment = models.Assignment(activity=question)
+
+    stats.record(assignment)
+    assert stats.num_responses == 0
+    assert stats.mean_score is None
+
+    assignment.result = models.FreeAnswerQuestionResult(text="foo")
+    assignment.time_to_submit = timedelta(seconds=3)
+    stats.record(assignment)
+
+    assert stats.num_responses == 1
+    assert stats.num_correct == 1
+    assert stats.mean_score == 1
+    assert stats.mean_time_to_submit == 3
+    histogram = stats.get_time_to_submit_histogram()
+    assert histogram[models.TIME_TO_SUBMIT_BUCKETS.index(5)] == 1
+    assert sum(histogram) == 1
+
+    stats.record(assignment, -1)
+
+    assert stats.num_responses == 0
+    assert stats.num_timed == 0
+    assert sum(stats.get_time_to_submit_histogram()) == 0
+
+
 def test_integer_question_validators():
     int_question = models.IntegerQuestion()
     int_result = models.IntegerQuestionResult()
@@ -273,7 +510,7 @@ def test_mc_question_correct():
     mc_question = models.MultipleChoiceQuestion()
     correct_choice = models.Choice(correct=True)
     incorrect_choice = models.Choice(correct=False)
-    mc_result = models.MultipleChoiceQuestionResult
+    mc_result = models.MultipleChoiceQuestionResult()
     mc_question.choices = [correct_choice, incorrect_choice]
 
     mc_result.choice = incorrect_choice
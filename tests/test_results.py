@@ -0,0 +1,82 @@
+"""Tests for building the results reports of experiments.
+"""
+from __future__ import unicode_literals
+from collections import Counter
+import random
+
+import mock
+
+from quizApp.models import Activity
+from quizApp.results import populate_row_segment, get_activity_column_index, \
+    get_results_layout, write_results_csv
+from tests.factories import ExperimentFactory, create_experiment, \
+    ParticipantFactory, AssignmentFactory
+
+
+def test_populate_row_segment():
+    initial_col = int(random.randint(1, 100))
+    data = range(0, int(random.randint(1, 100)))
+    row = [None] * (initial_col + len(data))
+
+    populate_row_segment(row, initial_col, data)
+
+    for col_offset, datum in enumerate(data):
+        assert row[col_offset + initial_col - 1] == datum
+
+
+def test_get_activity_column_index():
+    activity = mock.MagicMock(autospec=Activity)
+    activity.id = 5
+    counter = Counter()
+    mapping = {activity.id: [3, 8]}
+
+    assert get_activity_column_index(activity, mapping, counter) == 3
+    assert counter[activity.id] == 1
+
+    assert get_activity_column_index(activity, mapping, counter) == 8
+    assert counter[activity.id] == 2
+
+
+def test_get_results_layout(users):
+    exp = create_experiment(3, 2, ["question_mc_singleselect"])
+    for assignment_set in exp.assignment_sets:
+        assignment_set.participant = ParticipantFactory()
+
+    # Make the first activity occur twice in one assignment set
+    repeated_activity = exp.assignment_sets[0].assignments[0].activity
+    assignment = AssignmentFactory()
+    assignment.activity = repeated_activity
+    exp.assignment_sets[0].assignments.append(assignment)
+    exp.save()
+
+    headers, mapping = get_results_layout(exp)
+
+    assert headers[:2] == ["User email", "User ID"]
+    assert len(mapping) == 6
+    assert len(mapping[repeated_activity.id]) == 2
+    assert len(headers) == 2 + 5 * 7
+
+    columns = [c for occurrences in mapping.values() for c in occurrences]
+    assert len(set(columns)) == len(columns)
+
+    for activity_id, occurrences in mapping.items():
+        for column in occurrences:
+            assert headers[column - 1].startswith("{}:".format(activity_id))
+
+    exp = ExperimentFactory()
+    exp.save()
+
+    assert get_results_layout(exp) == (["User email", "User ID"], {})
+
+
+def test_write_results_csv(tmpdir):
+    rows = [["User email", "User ID", "Experiment ID"],
+            ["jos\u00e9@example.com", 4, 1]]
+    file_name = str(tmpdir.join("results.csv"))
+
+    write_results_csv(rows, file_name)
+
+    with open(file_name, "rb") as csv_file:
+        assert csv_file.read().decode("utf-8") == \
+            "User email,User ID,Experiment ID\r\n" \
+            "jos\u00e9@example.com,4,1\r\n"
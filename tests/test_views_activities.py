@@ -7,9 +7,9 @@ import factory
 from tests.auth import login_experimenter
 from tests import factories
 from tests.helpers import json_success
-from quizApp.views.activities import render_scorecard
+from quizApp.views.activities import render_scorecard, render_question
 from quizApp import db
-from quizApp.models import Question, Scorecard
+from quizApp.models import Question, Scorecard, MultipleChoiceQuestionResult
 
 
 def test_read_activities(client, users):
@@ -133,11 +133,45 @@ def test_render_scorecard(client, users):
             str(assignment.id) in rendered_sc
 
 
+def test_render_question(client, users):
+    question = factories.SingleSelectQuestionFactory()
+    question.num_media_items = -1
+    question.needs_comment = True
+    assignment = factories.AssignmentFactory(activity=question,
+                                             comment="Because")
+    assignment.result = MultipleChoiceQuestionResult(
+        choice=question.choices[1])
+    assignment.save()
+
+    rendered = render_question(question, True, assignment)
+    assert question.question in rendered
+    assert 'checked disabled id="choices-1"' in rendered
+    assert 'id="choices-0" name="choices"' in rendered
+    assert ">Because</textarea>" in rendered
+
+    # The cached skeleton is shared, but answers are not
+    rendered = render_question(question)
+    assert "checked" not in rendered
+    assert "disabled" not in rendered
+    assert "Because" not in rendered
+
+    # Changes are only shown once the version is bumped
+    old_text = question.question
+    question.question = "A new question"
+    assert old_text in render_question(question)
+
+    question.bump_version()
+    rendered = render_question(question)
+    assert "A new question" in rendered
+    assert old_text not in rendered
+
+
 def test_update_activity(client, users):
     login_experimenter(client)
 
     question = factories.SingleSelectQuestionFactory()
     question.save()
+    initial_version = question.version
 
     url = "/activities/" + str(question.id)
 
@@ -158,6 +192,8 @@ def test_update_activity(client, users):
     assert response.status_code == 200
     assert json_success(response.data)
 
+    assert question.version > initial_version
+
     response = client.get(url)
     data = response.data.decode(response.charset)
     assert new_question.question in data
@@ -240,6 +276,7 @@ def test_create_choice(client, users):
     updated_question = Question.query.get(question.id)
     assert initial_num_choices + 1 == len(updated_question.choices)
     assert choice.choice in [c.choice for c in updated_question.choices]
+    assert updated_question.version == 1
 
 
 def test_update_choice(client, users):
@@ -262,6 +299,7 @@ def test_update_choice(client, users):
     assert updated_question.choices[0].choice == choice.choice
     assert updated_question.choices[0].label == choice.label
     assert updated_question.choices[0].correct == choice.correct
+    assert updated_question.version == 1
 
     unrelated_choice = factories.ChoiceFactory()
     unrelated_choice.save()
@@ -292,6 +330,7 @@ def test_delete_choice(client, users):
     db.session.refresh(question)
 
     assert initial_num_choices - 1 == len(question.choices)
+    assert question.version == 1
 
     unrelated_choice = factories.ChoiceFactory()
     unrelated_choice.save()
@@ -1,18 +1,24 @@
 from builtins import range
+import io
+import os
 import tempfile
+import zipfile
 
 from openpyxl import load_workbook
 from factory import create_batch
 import mock
 import pytest
+from sqlalchemy import inspect
 
 from quizApp import db
 from quizApp import models
 
 from tests.auth import login_experimenter
 from tests.factories import ActivityFactory, MediaItemFactory, \
-    create_experiment, DatasetFactory, ExperimentFactory
-from tests.helpers import json_success
+    create_experiment, DatasetFactory, ExperimentFactory, ChoiceFactory, \
+    QuestionFactory
+from tests.helpers import json_success, get_job, download_job_output, \
+    count_queries
 
 from quizApp.views import data
 
@@ -43,6 +49,11 @@ def test_export_template(client, users):
     login_experimenter(client)
 
     response = client.get("/data/export")
+    assert response.status_code == 302
+    assert get_job(response).status == "finished"
+
+    response = download_job_output(client, response)
+    assert response.status_code == 200
     outfile = tempfile.TemporaryFile()
     outfile.write(response.data)
 
@@ -65,6 +76,7 @@ def test_import_assignments(client, users):
     login_experimenter(client)
     url = "/data/import"
     experiment = ExperimentFactory(id=1)
+    experiment.stats.num_finished = 99
     db.session.add(experiment)
 
     for i in range(1, 4):
@@ -83,6 +95,10 @@ def test_import_assignments(client, users):
     assert response.status_code == 200
     assert json_success(response.data)
 
+    job = get_job(response)
+    assert job.status == "finished"
+    assert job.get_result()["rows"] == 16
+
     assert models.Experiment.query.count() == 1
     assert models.AssignmentSet.query.count() == 4
     assert models.Assignment.query.count() == 12
@@ -90,6 +106,15 @@ def test_import_assignments(client, users):
 
     for pe in models.Experiment.query.one().assignment_sets:
         assert len(pe.assignments) == 3
+        assert [a.position for a in pe.assignments] == [0, 1, 2]
+
+    for assignment in models.Assignment.query.all():
+        assert assignment.activity
+        assert len(assignment.media_items) == 1
+
+    # The statistics of the experiment are rebuilt
+    assert experiment.stats.num_finished == models.AssignmentSet.query.\
+        filter_by(complete=True).count()
 
     response = client.post(url)
     assert response.status_code == 200
@@ -101,7 +126,128 @@ def test_import_assignments(client, users):
         response = client.post(url,
                                data={"data":
                                      open("tests/data/import.xlsx", "rb")})
-        assert not json_success(response.data)
+        assert json_success(response.data)
+
+        job = get_job(response)
+        assert job.status == "failed"
+        assert "AttributeError" in job.traceback
+
+
+def test_import_assignments_csv(client, users):
+    login_experimenter(client)
+    url = "/data/import"
+    experiment = ExperimentFactory(id=1)
+    db.session.add(experiment)
+
+    for i in range(1, 4):
+        media_item = MediaItemFactory(id=i)
+        db.session.add(media_item)
+
+    for i in range(1, 5):
+        activity = ActivityFactory(id=i)
+        db.session.add(activity)
+
+    db.session.commit()
+
+    assignment_sets = ["assignment_set:experiment,assignment_set:id,"
+                       "assignment_set:assignments"]
+    for i in range(1, 5):
+        assignment_ids = range(3 * i - 2, 3 * i + 1)
+        assignment_sets.append('1,{},"{}"'.format(
+            i, ",".join(str(a) for a in assignment_ids)))
+
+    assignments = ["assignment:media_items,assignment:activity,assignment:id"]
+    for i in range(1, 13):
+        assignments.append("{},{},{}".format((i - 1) % 3 + 1,
+                                             (i - 1) % 4 + 1, i))
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        zip_file.writestr("Assignment Sets.csv", "\n".join(assignment_sets))
+        zip_file.writestr("Assignments.csv", "\n".join(assignments))
+    zip_buffer.seek(0)
+
+    response = client.post(url, data={"data": (zip_buffer, "import.zip")})
+    assert response.status_code == 200
+    assert json_success(response.data)
+    assert get_job(response).status == "finished"
+
+    assert models.AssignmentSet.query.count() == 4
+    assert models.Assignment.query.count() == 12
+
+    for pe in models.Experiment.query.one().assignment_sets:
+        assert len(pe.assignments) == 3
+
+
+def import_csv_files(csv_files):
+    """Import a zip file of the given CSV files, given as a dictionary of file
+    names to lists of rows, in a savepoint that is rolled back if the import
+    fails.
+    """
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        for file_name, rows in csv_files.items():
+            zip_file.writestr(file_name, "\n".join(rows))
+    zip_buffer.seek(0)
+
+    savepoint = db.session.begin_nested()
+    try:
+        data.import_data_from_workbook(zipfile.ZipFile(zip_buffer))
+    except ValueError:
+        savepoint.rollback()
+        raise
+    savepoint.commit()
+
+
+def test_validate_import():
+    question = models.SingleSelectQuestion(question="foo",
+                                           num_media_items=1)
+    choice = ChoiceFactory(question=question)
+    other_choice = ChoiceFactory(question=QuestionFactory())
+    media_items = [MediaItemFactory(), MediaItemFactory()]
+    db.session.add_all([question, choice, other_choice] + media_items)
+    db.session.commit()
+
+    media_item_ids = '"{},{}"'.format(*[m.id for m in media_items])
+    with pytest.raises(ValueError) as error:
+        import_csv_files({"Assignments.csv": [
+            "assignment:media_items,assignment:activity,assignment:id",
+            "{},{},5".format(media_item_ids, question.id)]})
+    assert "Assignment with ID 5" in str(error.value)
+    assert models.Assignment.query.count() == 0
+
+    assignments = [
+        "assignment:media_items,assignment:activity,assignment:id",
+        "{},{},5".format(media_items[0].id, question.id)]
+    results = ["result:type,result:choice,result:assignment,result:id",
+               "mc_question_result,{},5,1".format(other_choice.id)]
+    with pytest.raises(ValueError):
+        import_csv_files({"Assignments.csv": assignments,
+                          "Results.csv": results})
+    assert models.Result.query.count() == 0
+
+    # Giving an existing assignment an invalid result is also caught
+    assignment = models.Assignment(media_items=media_items[:1])
+    assignment.activity = question
+    assignment.save()
+    results[1] = "mc_question_result,{},{},1".format(
+        other_choice.id, assignment.id)
+    with pytest.raises(ValueError):
+        import_csv_files({"Results.csv": results})
+
+    results[1] = "mc_question_result,{},5,1".format(choice.id)
+    import_csv_files({"Assignments.csv": assignments,
+                      "Results.csv": results})
+    imported = models.Assignment.query.filter(
+        models.Assignment.id != assignment.id).one()
+    assert imported.result.choice == choice
+
+    with pytest.raises(ValueError) as error:
+        import_csv_files({"Activities.csv": [
+            "activity:type,activity:question,activity:num_media_items,"
+            "activity:lower_bound,activity:answer,activity:id",
+            "question_integer,foo,1,5,3,7"]})
+    assert "activity with ID 7" in str(error.value)
 
 
 def test_manage_form(client, users):
@@ -123,6 +269,61 @@ def test_header_to_field_name():
         data.header_to_field_name(header, models.Activity)
 
 
-def test_get_object_from_id():
-    with pytest.raises(ValueError):
-        data.get_object_from_id(models.Activity, 5, {})
+def test_get_export_plan():
+    plan = data.get_export_plan(models.Assignment)
+    assert plan is data.get_export_plan(models.Assignment)
+
+    headers = [plan_entry[0] for plan_entry in plan]
+    assert "assignment:media_items" in headers
+    assert "assignment:activity" in headers
+    assert "assignment:comment" in headers
+    # Foreign keys are exported via their relationships
+    assert "assignment:activity_id" not in headers
+
+
+def test_object_list_to_sheet():
+    experiment = create_experiment(2, 1, ["question_mc_singleselect",
+                                          "scorecard"])
+    experiment.save()
+    activities = [a.activity for a in
+                  experiment.assignment_sets[0].assignments]
+
+    sheet = data.object_list_to_sheet(activities)
+    headers = sheet[0]
+
+    assert len(sheet) == len(activities) + 1
+    assert len(headers) == len(set(headers))
+
+    for activity, row in zip(activities, sheet[1:]):
+        assert row[headers.index("activity:id")] == activity.id
+        assert row[headers.index("activity:type")] == activity.type
+
+
+def test_export_to_workbook_query_count():
+    query_counts = []
+
+    for num_activities in [2, 6]:
+        db.session.add(create_experiment(num_activities, 2))
+        db.session.add_all(create_batch(MediaItemFactory, num_activities))
+        db.session.commit()
+        db.session.expire_all()
+
+        with count_queries() as statements:
+            file_name = data.export_to_workbook()
+        os.remove(file_name)
+
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_get_related_ids():
+    experiment = create_experiment(3, 2)
+    experiment.save()
+    assignment_set = experiment.assignment_sets[0]
+
+    related_ids = data.get_related_ids(
+        inspect(models.AssignmentSet).attrs["assignments"])
+
+    assert related_ids[assignment_set.id] == \
+        [str(a.id) for a in assignment_set.assignments]
@@ -2,17 +2,17 @@
 """
 from __future__ import unicode_literals
 from builtins import str
-import factory
+import hashlib
+import io
+import os
 
-from werkzeug.datastructures import FileStorage
+import factory
 
-from quizApp.forms.datasets import GraphForm
 from tests.helpers import json_success
 from tests.auth import login_experimenter
 from tests.factories import DatasetFactory, GraphFactory, MediaItemFactory
 from quizApp.models import Dataset
 from quizApp import db
-import mock
 
 
 def test_read_datasets(client, users):
@@ -163,6 +163,14 @@ def test_read_media_item(client, users):
 
     response = client.get(url)
     assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    dataset.media_items[0].bump_version()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
 
     unrelated_media_item = MediaItemFactory()
     unrelated_media_item.save()
@@ -197,7 +205,7 @@ def test_settings_media_item(client, users):
     assert response.status_code == 404
 
 
-def test_update_media_item(client, users):
+def test_update_media_item(client, users, app, tmpdir, monkeypatch):
     login_experimenter(client)
     dataset = DatasetFactory()
     dataset.media_items[0] = GraphFactory()
@@ -215,6 +223,7 @@ def test_update_media_item(client, users):
     db.session.refresh(graph)
 
     assert graph.name == new_graph.name
+    assert graph.version == 1
 
     response = client.put(url, data={"name": "a"*10000})
     assert response.status_code == 200
@@ -229,35 +238,134 @@ def test_update_media_item(client, users):
     assert response.status_code == 404
 
     # Test uploading a graph
+    monkeypatch.setattr(app, "static_folder", str(tmpdir))
+    graph_directory = os.path.join(str(tmpdir), app.config["GRAPH_DIRECTORY"])
 
     url = "/datasets/" + str(dataset.id) + "/media_items/" + str(graph.id)
 
-    with mock.patch("quizApp.views.datasets.GraphForm") as GraphFormMock:
-        file_storage_mock = mock.MagicMock(spec_set=FileStorage())
-        file_storage_mock.configure_mock(filename="foo.png")
-
-        graph_form = GraphForm()
-        graph_form.path.data = file_storage_mock
-
-        GraphFormMock.configure_mock(return_value=graph_form)
-
-        response = client.put(url,
-                              data={"graph": open("tests/data/graph.png",
-                                                  "rb")})
-        assert response.status_code == 200
-        assert json_success(response.data)
-        assert file_storage_mock.save.called_once()
-        assert str(graph.id) in file_storage_mock.save.call_args[0][0]
-
-        with mock.patch("quizApp.views.datasets.os.path.isfile",
-                        autospec=True) as isfile_mock:
-            isfile_mock.return_value = True
-            db.session.refresh(graph)
-            file_storage_mock.reset_mock()
-            response = client.put(url,
-                                  data={"graph": open("tests/data/graph.png",
-                                                      "rb")})
-            assert response.status_code == 200
-            assert json_success(response.data)
-            assert file_storage_mock.save.called_once()
-            assert str(graph.path) in file_storage_mock.save.call_args[0][0]
+    with open("tests/data/graph.png", "rb") as graph_file:
+        response = client.put(url, data={"name": graph.name,
+                                         "path": (graph_file, "graph.png")})
+    assert response.status_code == 200
+    assert json_success(response.data)
+
+    db.session.refresh(graph)
+    variant_paths = [graph.path, graph.display_path, graph.thumbnail_path]
+
+    for path in variant_paths:
+        assert os.path.dirname(path) == graph_directory
+        with open(path, "rb") as variant_file:
+            assert hashlib.sha1(variant_file.read()).hexdigest() in path
+
+    response = client.get("/datasets/graphs/" +
+                          os.path.basename(graph.thumbnail_path))
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+
+    # Uploading the same image again gives the same files
+    with open("tests/data/graph.png", "rb") as graph_file:
+        response = client.put(url, data={"name": graph.name,
+                                         "path": (graph_file, "graph.png")})
+    assert json_success(response.data)
+
+    db.session.refresh(graph)
+    assert [graph.path, graph.display_path, graph.thumbnail_path] == \
+        variant_paths
+
+    response = client.put(url, data={"name": graph.name,
+                                     "path": (io.BytesIO(b"not an image"),
+                                              "graph.png")})
+    assert response.status_code == 200
+    assert not json_success(response.data)
+
+
+def test_read_media_item_file(client, app, tmpdir, monkeypatch):
+    monkeypatch.setattr(app, "static_folder", str(tmpdir))
+    contents = b"0123456789" * 100
+    graph_file = tmpdir.mkdir(app.config["GRAPH_DIRECTORY"]).\
+        join("graph.png")
+    graph_file.write(contents, mode="wb")
+
+    # Only the file name of the path is used
+    graph = GraphFactory(path="/elsewhere/graph.png")
+    media_item = MediaItemFactory()
+    db.session.add_all([graph, media_item])
+    db.session.commit()
+
+    url = "/datasets/media_items/{}/file".format(graph.id)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == contents
+    assert response.mimetype == "image/png"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Cache-Control"] == "public, no-cache"
+    etag = response.headers["ETag"]
+
+    # The URLs of the current version may be cached, but not old ones
+    response = client.get(url + "?v={}".format(graph.version))
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age={}".\
+        format(app.config["MEDIA_FILE_MAX_AGE"])
+
+    response = client.get(url + "?v={}".format(graph.version - 1))
+    assert response.headers["Cache-Control"] == "public, no-cache"
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert not response.data
+
+    response = client.get(url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == contents[10:20]
+    assert response.headers["Content-Range"] == "bytes 10-19/1000"
+
+    # A stale If-Range gets the whole file
+    response = client.get(url, headers={"Range": "bytes=10-19",
+                                        "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.data == contents
+
+    response = client.get(url, headers={"Range": "bytes=2000-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */1000"
+
+    monkeypatch.setitem(app.config, "MEDIA_SENDFILE_HEADER", "X-Sendfile")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["X-Sendfile"] == str(graph_file)
+    assert not response.data
+
+    monkeypatch.setitem(app.config, "MEDIA_SENDFILE_HEADER",
+                        "X-Accel-Redirect")
+    response = client.get(url)
+    assert response.headers["X-Accel-Redirect"] == "/media/{}/graph.png".\
+        format(app.config["GRAPH_DIRECTORY"])
+    assert not response.data
+
+    response = client.get("/datasets/media_items/{}/file".
+                          format(media_item.id))
+    assert response.status_code == 404
+
+    graph_file.remove()
+    response = client.get(url)
+    assert response.status_code == 404
+
+
+def test_read_media_item_file_outside_graph_directory(client, app, tmpdir,
+                                                      monkeypatch):
+    monkeypatch.setattr(app, "static_folder", str(tmpdir))
+    tmpdir.mkdir(app.config["GRAPH_DIRECTORY"])
+    secret_file = tmpdir.join("secret.txt")
+    secret_file.write("secret")
+
+    graphs = [GraphFactory(path=str(secret_file)),
+              GraphFactory(path="../secret.txt"),
+              GraphFactory(path="/etc/passwd")]
+    db.session.add_all(graphs)
+    db.session.commit()
+
+    for graph in graphs:
+        response = client.get("/datasets/media_items/{}/file".
+                              format(graph.id))
+        assert response.status_code == 404
@@ -2,25 +2,28 @@
 """
 from __future__ import unicode_literals
 from builtins import str
-from collections import Counter
+import csv
+import io
 import json
 import random
+import tempfile
 import mock
 from datetime import datetime, timedelta
 from mock import patch
 
 import openpyxl
+from flask_sqlalchemy import BaseQuery
 
 from quizApp import db
-from quizApp.models import AssignmentSet, Activity
+from quizApp.models import AssignmentSet, ExperimentStats, ActivityStats, \
+    Participant
 from quizApp.views.experiments import get_next_assignment_url, \
-    POST_FINALIZE_HANDLERS, validate_assignment_set, populate_row_segment, \
-    get_activity_column_index
+    POST_FINALIZE_HANDLERS, validate_assignment_set
 from tests.factories import ExperimentFactory, create_experiment, \
-    ParticipantFactory, create_result
+    ParticipantFactory, create_result, GraphFactory
 from tests.auth import login_participant, get_participant, \
     login_experimenter
-from tests.helpers import json_success
+from tests.helpers import json_success, count_queries, download_job_output
 
 
 @patch('quizApp.views.experiments.abort', autospec=True)
@@ -261,6 +264,7 @@ def test_update_experiment(client, users):
                               "stop": experiment.stop.strftime(datetime_format)
                           })
     assert json_success(response.data)
+    assert experiment.version > 0
 
     response = client.get("/experiments/")
     data = response.data.decode(response.charset)
@@ -386,6 +390,150 @@ def test_read_assignment(client, users):
     assert assignment3.activity.question in data
 
 
+def test_read_assignment_query_count(client, users):
+    """Make sure the number of queries needed to read or update an assignment
+    does not depend on the size of the assignment set.
+    """
+    login_participant(client)
+    query_counts = []
+
+    for num_activities in [2, 10]:
+        experiment = create_experiment(num_activities, 1,
+                                       ["question_mc_singleselect"])
+        assignment_set = experiment.assignment_sets[0]
+        assignment_set.complete = False
+        assignment_set.progress = 0
+        assignment_set.participant = get_participant()
+        experiment.save()
+
+        assignment = assignment_set.assignments[0]
+        url = "/experiments/{}/assignment_sets/{}/assignments/{}".\
+            format(experiment.id, assignment_set.id, assignment.id)
+
+        # Make sure nothing is served out of the identity map
+        db.session.expunge_all()
+
+        with count_queries() as read_queries:
+            response = client.get(url)
+        assert response.status_code == 200
+
+        with count_queries() as update_queries:
+            response = client.patch(url)
+        assert response.status_code == 200
+
+        query_counts.append((len(read_queries), len(update_queries)))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_read_assignment_conditional(client, users):
+    login_participant(client)
+    experiment = create_experiment(2, 1, ["question_mc_singleselect"])
+    assignment_set = experiment.assignment_sets[0]
+    assignment_set.complete = False
+    assignment_set.progress = 0
+    assignment_set.participant = get_participant()
+    experiment.save()
+
+    assignment = assignment_set.assignments[0]
+    url = "/experiments/{}/assignment_sets/{}/assignments/{}".\
+        format(experiment.id, assignment_set.id, assignment.id)
+
+    response = client.get(url)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert not etag.startswith("W/")
+    assert "Last-Modified" not in response.headers
+
+    # A date alone cannot tell whose page the client has cached
+    response = client.get(url, headers={
+        "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.data
+
+    # Answering the assignment changes the page
+    choice = assignment.activity.choices[0]
+    response = client.patch(url, data={"choices": str(choice.id)})
+    assert json_success(response.data)
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # So does changing the experiment or the activity
+    for obj in [experiment, assignment.activity]:
+        obj.bump_version()
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        etag = response.headers["ETag"]
+
+
+def test_preload_media_items(client, users):
+    login_participant(client)
+    experiment = create_experiment(5, 1, ["question_mc_singleselect"])
+    experiment.flash = True
+    experiment.flash_duration = 500
+    assignment_set = experiment.assignment_sets[0]
+    assignment_set.complete = False
+    assignment_set.progress = 0
+    assignment_set.participant = get_participant()
+
+    graph_urls = []
+    for i, assignment in enumerate(assignment_set.assignments):
+        assignment.media_items = [GraphFactory(path="full{}.png".format(i),
+                                               display_path="d{}.png".
+                                               format(i))]
+        graph_urls.append("/datasets/graphs/d{}.png".format(i))
+    experiment.save()
+
+    manifest_url = "/experiments/{}/assignment_sets/{}/manifest".\
+        format(experiment.id, assignment_set.id)
+
+    # By default, start with the assignment the participant is on
+    response = client.get(manifest_url)
+    assert json_success(response.data)
+    assert json.loads(response.data.decode(response.charset))["urls"] == \
+        graph_urls[:3]
+
+    response = client.get(manifest_url + "?position=2")
+    assert json.loads(response.data.decode(response.charset))["urls"] == \
+        graph_urls[3:]
+
+    response = client.get("/experiments/{}".format(experiment.id))
+    data = response.data.decode(response.charset)
+    assert '<link rel="prefetch" href="{}"'.format(graph_urls[0]) in data
+
+    assignment = assignment_set.assignments[0]
+    url = "/experiments/{}/assignment_sets/{}/assignments/{}".\
+        format(experiment.id, assignment_set.id, assignment.id)
+    response = client.get(url)
+    data = response.data.decode(response.charset)
+    for graph_url in graph_urls[1:4]:
+        assert '<link rel="prefetch" href="{}"'.format(graph_url) in data
+    assert '<link rel="prefetch" href="{}"'.format(graph_urls[4]) \
+        not in data
+    etag = response.headers["ETag"]
+
+    # Changing an upcoming graph changes the page
+    assignment_set.assignments[1].media_items[0].bump_version()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    # Nothing is flashed, so nothing needs to be preloaded
+    experiment.flash = False
+    experiment.save()
+    response = client.get(manifest_url)
+    assert json.loads(response.data.decode(response.charset))["urls"] == []
+
+    response = client.get(url)
+    assert 'rel="prefetch"' not in response.data.decode(response.charset)
+
+
 def test_read_scorecard(client, users):
     login_participant(client)
     participant = get_participant()
@@ -447,6 +595,14 @@ def test_update_assignment(client, users):
     assert response.status_code == 200
     assert assignment.time_to_submit == time_to_submit
     assert json_success(response.data)
+    assert assignment_set.score == choice.points
+
+    activity_stats = ActivityStats.query.filter_by(
+        experiment_id=experiment.id,
+        activity_id=assignment.activity.id).one()
+    assert activity_stats.num_responses == 1
+    assert activity_stats.score_total == choice.points
+    assert activity_stats.num_timed == 1
 
     # Test bad response
     response = client.patch(url,
@@ -507,6 +663,56 @@ def test_update_assignment(client, users):
     assert response.status_code == 403
 
 
+def test_update_assignment_concurrent_first_responses(client, users,
+                                                      monkeypatch):
+    """When two participants submit the first responses to an activity at
+    the same time, neither finds its statistics, and both try to create
+    them. Both responses should be recorded.
+    """
+    login_participant(client)
+    experiment = create_experiment(2, 1, ["question_mc_singleselect"])
+    assignment_set = experiment.assignment_sets[0]
+    assignment_set.complete = False
+    assignment_set.progress = 0
+    assignment_set.participant = get_participant()
+    first, second = assignment_set.assignments
+    second.activity = first.activity
+    experiment.save()
+
+    url = "/experiments/{}/assignment_sets/{}/assignments/".\
+        format(experiment.id, assignment_set.id)
+    choice = first.activity.choices[0]
+
+    response = client.patch(url + str(first.id),
+                            data={"choices": str(choice.id)})
+    assert json_success(response.data)
+
+    # Pretend the first response was committed while the second was looking
+    # for the statistics
+    original_first = BaseQuery.first
+    missed = []
+
+    def first_missing_stats(query):
+        if not missed and "activity_stats" in str(query):
+            missed.append(query)
+            return None
+        return original_first(query)
+
+    monkeypatch.setattr(BaseQuery, "first", first_missing_stats)
+
+    response = client.patch(url + str(second.id),
+                            data={"choices": str(choice.id)})
+    assert response.status_code == 200
+    assert json_success(response.data)
+    assert missed
+
+    activity_stats = ActivityStats.query.filter_by(
+        experiment_id=experiment.id,
+        activity_id=first.activity.id).all()
+    assert len(activity_stats) == 1
+    assert activity_stats[0].num_responses == 2
+
+
 def test_update_int_assignment(client, users):
     login_participant(client)
     participant = get_participant()
@@ -573,6 +779,7 @@ def test_finalize_experiment(client, users):
     response = client.patch(url)
     assert response.status_code == 200
     assert json_success(response.data)
+    assert experiment.stats.num_finished == 1
 
     response = client.patch(url)
     assert response.status_code == 400
@@ -683,18 +890,97 @@ def test_results_experiment(client, users):
     assert response.status_code == 200
 
 
-def test_populate_row_segment():
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    row_index = int(random.randint(1, 100))
-    initial_col = int(random.randint(1, 100))
-    data = range(0, int(random.randint(1, 100)))
+def test_results_stats_experiment(client, users):
+    login_experimenter(client)
+
+    exp = create_experiment(3, 1, ["question_mc_singleselect"])
+    assignments = exp.assignment_sets[0].assignments
+
+    for assignment in assignments[:2]:
+        assignment.result = create_result(assignment.activity)
+        assignment.time_to_submit = timedelta(seconds=30)
+    exp.save()
+    ExperimentStats.rebuild(exp)
+    db.session.commit()
+
+    url = "/experiments/{}/results/stats".format(exp.id)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert json_success(response.data)
+
+    data = json.loads(response.data.decode(response.charset))
+    question_stats = {q["question_id"]: q for q in data["question_stats"]}
+    assert len(question_stats) == 3
+
+    for assignment in assignments[:2]:
+        stats = question_stats[assignment.activity.id]
+        choice = assignment.result.choice
+        assert stats["num_responses"] == 1
+        assert stats["num_correct"] == int(bool(choice.correct))
+        assert stats["mean_score"] == choice.points
+        assert round(stats["mean_time_to_submit"]) == 30
+        assert sum(stats["time_to_submit_histogram"]) == 1
 
-    populate_row_segment(sheet, row_index, initial_col, data)
+    stats = question_stats[assignments[2].activity.id]
+    assert stats["num_responses"] == 0
+    assert stats["mean_score"] is None
 
-    for col_offset, datum in enumerate(data):
-        assert sheet.cell(row=row_index,
-                          column=col_offset + initial_col).value == datum
+
+def test_results_stats_experiment_without_stats(client, users):
+    """Experiments that were run before statistics were kept have their
+    statistics built the first time their results are shown.
+    """
+    login_experimenter(client)
+
+    exp = create_experiment(2, 2, ["question_mc_singleselect"])
+    exp.assignment_sets[0].complete = True
+    exp.assignment_sets[1].complete = False
+    for assignment in exp.assignment_sets[0].assignments:
+        assignment.result = create_result(assignment.activity)
+    exp.save()
+    db.session.delete(exp.stats)
+    db.session.commit()
+    db.session.expire(exp)
+    assert exp.stats is None
+
+    url = "/experiments/{}/results/stats".format(exp.id)
+    response = client.get(url)
+    assert response.status_code == 200
+
+    data = json.loads(response.data.decode(response.charset))
+    assert data["num_finished"] == 1
+    assert sum(q["num_responses"] for q in data["question_stats"]) == 2
+    assert exp.stats.num_finished == 1
+
+
+def test_results_stats_experiment_participants(client, users):
+    login_experimenter(client)
+    Participant.provision(10)
+
+    exp = create_experiment(1, 3)
+    exp.assignment_sets[0].participant = ParticipantFactory()
+    exp.assignment_sets[0].complete = True
+    exp.assignment_sets[1].participant = ParticipantFactory()
+    exp.assignment_sets[1].complete = False
+    exp.assignment_sets[2].complete = False
+    exp.save()
+    ExperimentStats.rebuild(exp)
+
+    empty_exp = create_experiment(1, 1)
+    empty_exp.save()
+
+    response = client.get("/experiments/{}/results/stats".format(exp.id))
+    data = json.loads(response.data.decode(response.charset))
+    assert data["num_participants"] == 2
+    assert data["num_finished"] == 1
+    assert data["percent_finished"] == 0.5
+
+    response = client.get("/experiments/{}/results/stats".
+                          format(empty_exp.id))
+    assert response.status_code == 200
+    data = json.loads(response.data.decode(response.charset))
+    assert data["num_participants"] == 0
+    assert data["percent_finished"] is None
 
 
 def test_export_experiment_results(client, users):
@@ -703,13 +989,9 @@ def test_export_experiment_results(client, users):
     exp = create_experiment(10, 10, ["question_mc_singleselect", "scorecard",
                                      "question_mc_singleselect_scale",
                                      "question_mc_multiselect"])
-    common_participant = ParticipantFactory()
     for assignment_set in exp.assignment_sets:
         if random.random() > .5:
-            if random.random() > .5:
-                assignment_set.participant = common_participant
-            else:
-                assignment_set.participant = ParticipantFactory()
+            assignment_set.participant = ParticipantFactory()
 
             for assignment in assignment_set.assignments:
                 if random.random() > .5:
@@ -719,34 +1001,27 @@ def test_export_experiment_results(client, users):
     exp.save()
     url = "/experiments/{}/results/export".format(exp.id)
 
-    response = client.get(url)
+    response = download_job_output(client, client.get(url))
+    assert response.status_code == 200
+
+    outfile = tempfile.TemporaryFile()
+    outfile.write(response.data)
+    workbook = openpyxl.load_workbook(outfile)
+    sheet = workbook.active
+    num_participants = len(set(s.participant for s in exp.assignment_sets
+                               if s.participant))
+    assert sheet.cell(row=1, column=1).value == "User email"
+    assert len(sheet.rows) == max(num_participants, 1) + 1
+
+    response = download_job_output(client, client.get(url + "?format=csv"))
     assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.data.decode("utf-8"))))
+    assert rows[0][0] == "User email"
+    assert len(rows) == max(num_participants, 1) + 1
 
     exp = ExperimentFactory()
     exp.save()
 
     url = "/experiments/{}/results/export".format(exp.id)
-    response = client.get(url)
+    response = download_job_output(client, client.get(url))
     assert response.status_code == 200
-
-
-def test_get_activity_column_index():
-    activity = mock.MagicMock(autospec=Activity)
-    activity.id = 5
-    activity.__str__.return_value = ""
-    counter = Counter()
-    mapping = {}
-    headers = []
-
-    get_activity_column_index(activity, mapping, counter, headers)
-
-    assert mapping[activity.id][0] == 1  # 1-indexed due to openpyxl
-    assert len(mapping[activity.id]) == 1
-    assert counter[activity.id] == 1
-
-    get_activity_column_index(activity, mapping, counter, headers)
-
-    assert mapping[activity.id][0] == 1
-    assert mapping[activity.id][1] == 6
-    assert len(mapping[activity.id]) == 2
-    assert counter[activity.id] == 2
@@ -3,15 +3,21 @@
 from __future__ import unicode_literals
 
 from mock import MagicMock, patch
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import Update
 from wtforms import Form
 
 from tests.auth import login_participant, get_participant
-from tests.factories import create_experiment
-from tests.helpers import json_success
-from quizApp.models import Base
+from tests.factories import create_experiment, ParticipantFactory
+from tests.helpers import json_success, count_queries
+from quizApp import db
+from quizApp.models import Base, AssignmentSet, Participant, \
+    UNUSABLE_PASSWORD
 from quizApp.views.helpers import validate_model_id,\
     get_or_create_assignment_set, get_first_assignment,\
-    validate_form_or_error
+    validate_form_or_error, claim_assignment_set, take_assignment_set,\
+    register_participant
 
 
 def test_get_first_assignment(client, users):
@@ -41,6 +47,142 @@ def test_get_or_create_assignment_set(client, users):
     assert result is None
 
 
+def create_participants(num_participants):
+    participants = [ParticipantFactory() for _ in range(num_participants)]
+    db.session.add_all(participants)
+    db.session.commit()
+    return participants
+
+
+def test_claim_assignment_set(users):
+    experiment = create_experiment(1, 20)
+    experiment.save()
+
+    claimed_ids = []
+    for participant in create_participants(20):
+        assignment_set = claim_assignment_set(experiment, participant)
+        assert assignment_set.participant_id == participant.id
+        claimed_ids.append(assignment_set.id)
+
+    assert len(set(claimed_ids)) == 20
+    assert claim_assignment_set(experiment, ParticipantFactory()) is None
+
+
+def test_claim_assignment_set_contention(users, monkeypatch):
+    """If another participant claims our candidate before we do, we should
+    claim a different set rather than share theirs.
+    """
+    experiment = create_experiment(1, 2)
+    experiment.save()
+    participant, rival = create_participants(2)
+    table = AssignmentSet.__table__
+    execute = db.session.execute
+    stolen_ids = []
+
+    def execute_after_rival(statement, *args, **kwargs):
+        """Let the rival claim the candidate just before we update it.
+        """
+        if isinstance(statement, Update) and statement.table is table \
+                and not stolen_ids:
+            candidate_id = statement.compile().params["id_1"]
+            execute(table.update().where(table.c.id == candidate_id).
+                    values(participant_id=rival.id))
+            stolen_ids.append(candidate_id)
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db.session, "execute", execute_after_rival)
+    assignment_set = claim_assignment_set(experiment, participant)
+    monkeypatch.setattr(db.session, "execute", execute)
+
+    assert assignment_set.participant_id == participant.id
+    assert assignment_set.id not in stolen_ids
+    assert AssignmentSet.query.filter_by(participant_id=rival.id).count() == 1
+
+    assert claim_assignment_set(experiment, ParticipantFactory()) is None
+
+
+def test_claim_assignment_set_queue(users):
+    experiment = create_experiment(1, 10)
+    experiment.save()
+    experiment.shuffle_claim_queue(seed=3)
+    experiment.save()
+
+    queue = [assignment_set.id for assignment_set in
+             AssignmentSet.query.filter_by(experiment_id=experiment.id).
+             order_by(AssignmentSet.claim_order)]
+
+    claimed_ids = [claim_assignment_set(experiment, participant).id
+                   for participant in create_participants(10)]
+
+    assert claimed_ids == queue
+    assert claim_assignment_set(experiment, ParticipantFactory()) is None
+
+
+def test_take_assignment_set_once_per_experiment(users):
+    """A participant may only have one assignment set in each experiment.
+    """
+    experiment = create_experiment(1, 2)
+    experiment.save()
+    participant = create_participants(1)[0]
+    first_set, second_set = experiment.assignment_sets
+
+    assert take_assignment_set(first_set.id, participant) == first_set
+
+    with pytest.raises(IntegrityError):
+        take_assignment_set(second_set.id, participant)
+
+    assert AssignmentSet.query.get(second_set.id).participant_id is None
+
+
+def test_claim_assignment_set_query_count(users):
+    """Claiming a set should take the same number of queries no matter how
+    big the pool is.
+    """
+    query_counts = []
+
+    for pool_size in [5, 50]:
+        experiment = create_experiment(1, pool_size)
+        experiment.save()
+        participant = create_participants(1)[0]
+
+        with count_queries() as statements:
+            claim_assignment_set(experiment, participant)
+
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_register_participant(users):
+    participant = register_participant("worker1", "worker1")
+    assert participant.email == "worker1"
+    assert participant.foreign_id == "worker1"
+    assert participant.password == UNUSABLE_PASSWORD
+    assert participant.active
+    assert participant.has_role("participant")
+    assert not participant.provisioned
+
+    Participant.provision(3)
+    provisioned_ids = [p.id for p in
+                       Participant.query.filter_by(provisioned=True)]
+
+    claimed_ids = []
+    for i in range(3):
+        participant = register_participant("pooled{}".format(i))
+        assert participant.email == "pooled{}".format(i)
+        assert participant.has_role("participant")
+        assert not participant.provisioned
+        claimed_ids.append(participant.id)
+
+    assert sorted(claimed_ids) == sorted(provisioned_ids)
+
+    # Once the pool is empty, participants are created again
+    num_participants = Participant.query.count()
+    participant = register_participant("worker2")
+    assert participant.id not in provisioned_ids
+    assert Participant.query.count() == num_participants + 1
+
+
 @patch('quizApp.views.helpers.abort', autospec=True)
 def test_validate_model_id(abort_mock):
     """Test the validate_model_id method.
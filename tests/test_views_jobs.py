@@ -0,0 +1,70 @@
+"""Tests for job views.
+"""
+from __future__ import unicode_literals
+import json
+import tempfile
+
+from quizApp import db
+from quizApp.models import Job
+from tests.auth import login_experimenter
+from tests.helpers import json_success
+
+
+def test_read_job(client, users):
+    login_experimenter(client)
+    job = Job(type="export", status="running", progress=.5)
+    job.save()
+
+    response = client.get("/jobs/{}".format(job.id))
+    assert response.status_code == 200
+
+    response = client.get("/jobs/{}".format(job.id + 1))
+    assert response.status_code == 404
+
+
+def test_status_job(client, users):
+    login_experimenter(client)
+    job = Job(type="export", status="running", progress=.5)
+    job.save()
+    url = "/jobs/{}/status".format(job.id)
+
+    response = client.get(url)
+    data = json.loads(response.data.decode("utf-8"))
+    assert json_success(response.data)
+    assert data["status"] == "running"
+    assert data["progress"] == .5
+    assert data["download_url"] is None
+
+    job.status = "failed"
+    job.traceback = "Traceback"
+    db.session.commit()
+
+    response = client.get(url)
+    data = json.loads(response.data.decode("utf-8"))
+    assert data["traceback"] == "Traceback"
+    assert data["download_url"] is None
+
+
+def test_download_job(client, users):
+    login_experimenter(client)
+    output_file = tempfile.NamedTemporaryFile()
+    output_file.write(b"foo")
+    output_file.flush()
+
+    job = Job(type="export", status="running", output_path=output_file.name,
+              output_name="foo.txt")
+    job.save()
+    url = "/jobs/{}/download".format(job.id)
+
+    response = client.get(url)
+    assert response.status_code == 404
+
+    job.status = "finished"
+    db.session.commit()
+
+    response = client.get("/jobs/{}/status".format(job.id))
+    assert json.loads(response.data.decode("utf-8"))["download_url"] == url
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b"foo"
@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 import mock
 from flask import session
 
-from quizApp.models import Participant
+from quizApp.models import Participant, UNUSABLE_PASSWORD
 from quizApp.views import mturk
 from tests.factories import create_experiment
 
@@ -36,6 +36,9 @@ def test_register(client, users):
 
     # one from users fixture, one from views
     assert Participant.query.count() == 2
+    participant = Participant.query.filter_by(email="4fsa").one()
+    assert participant.foreign_id == "4fsa"
+    assert participant.password == UNUSABLE_PASSWORD
 
     response = client.get(("/mturk/register?experiment_id={}"
                            "&workerId=4fsa&assignmentId=4&turkSubmitTo=4"